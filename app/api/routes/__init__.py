@@ -5,6 +5,9 @@ from .conversation import router as conversation_router
 from .character import router as character_router
 from .message import router as message_router
 from .settings import router as settings_router
+from .metrics import router as metrics_router
+from .search import router as search_router
+from .jobs import router as jobs_router
 
 # Main API router
 router = APIRouter(prefix="/api")
@@ -14,5 +17,8 @@ router.include_router(conversation_router, tags=["conversation"])
 router.include_router(character_router, tags=["character"])
 router.include_router(message_router, tags=["message"])
 router.include_router(settings_router, tags=["settings"])
+router.include_router(metrics_router, tags=["metrics"])
+router.include_router(search_router, tags=["search"])
+router.include_router(jobs_router, tags=["jobs"])
 
 __all__ = ["router"]
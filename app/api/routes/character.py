@@ -1,47 +1,105 @@
 """Character management routes"""
 
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Response
 from datetime import datetime
+from typing import Optional
 import os
 
-from app.models import Character
+from app.models import Character, Conversation
 from app.core.config import settings
+from app.core.locks import conversation_lock
 from app.core.state import get_state
+from app.services.persona_service import persona_service
+from .jobs import start_job
+from .limits import model_request
 
 router = APIRouter()
 
 
-@router.post("/character/add")
-async def add_character(name: str = Form(...), description: str = Form("")):
-    """Add a new character to the current conversation"""
-    from app.services.ai_service import ai_service
+@router.post("/character/add", dependencies=[Depends(model_request)])
+async def add_character(response: Response, name: str = Form(...), description: str = Form(""),
+                        personality: str = Form(""), speech_patterns: str = Form(""),
+                        motivations: str = Form(""), background: bool = Form(False)):
+    """Add a new character to the current conversation.
+    
+    With `background` the request returns a job at once (see /api/jobs);
+    the character joins the conversation that was current when it was asked for.
+    """
     state = get_state()
     
     if not state.conversation:
         raise HTTPException(status_code=400, detail="No active conversation")
     
+    conversation = state.conversation
+    fields = {"personality": personality, "speech_patterns": speech_patterns, "motivations": motivations}
+    if background:
+        return start_job(response, "character_add", lambda: _add_character(conversation, name, description, fields))
+    return await _add_character(conversation, name, description, fields)
+
+
+async def _add_character(conversation: Conversation, name: str, description: str, fields: dict) -> dict:
+    """Generate a missing description and add the character"""
+    from app.services.ai_service import ai_service
+    
     # Generate description if empty
+    usage = None
     if not description or description.strip() == "":
         prompt = f"""Create a character description for someone named {name}.
 
-Setting: {state.conversation.scenario.description}
+Setting: {conversation.scenario.description}
 
 Write 1-2 sentences describing their personality, background, and speaking style. Make them fit the story and be interesting.
 
 Character description:"""
-        description = ai_service.get_response(prompt).strip()
-    
-    char_id = f"char{len(state.conversation.characters)}"
-    new_char = Character(
-        id=char_id,
-        name=name,
-        description=description
-    )
+        description, usage = await ai_service.complete(prompt, task="description")
+        description = description.strip()
     
-    state.conversation.characters.append(new_char)
+    async with conversation_lock(conversation.id):
+        if usage:
+            conversation.record_usage(usage)
+        char_id = conversation.next_character_id()
+        new_char = Character(
+            id=char_id,
+            name=name,
+            description=description,
+            **fields
+        )
+        
+        conversation.add_character(new_char)
+    # Condense a long persona now so the character's first turn doesn't wait for it
+    persona_service.prepare(new_char, conversation)
     return {"status": "success", "character": new_char}
 
 
+@router.put("/character/{character_id}")
+async def update_character(
+    character_id: str,
+    description: Optional[str] = Form(None),
+    personality: Optional[str] = Form(None),
+    speech_patterns: Optional[str] = Form(None),
+    motivations: Optional[str] = Form(None)
+):
+    """Change a character's description fields; the prompt persona is rebuilt from them"""
+    state = get_state()
+    
+    if not state.conversation:
+        raise HTTPException(status_code=400, detail="No active conversation")
+    
+    character = state.conversation.get_character(character_id)
+    if not character:
+        raise HTTPException(status_code=404, detail="Character not found")
+    
+    changes = {"description": description, "personality": personality,
+               "speech_patterns": speech_patterns, "motivations": motivations}
+    async with conversation_lock(state.conversation.id):
+        for field, value in changes.items():
+            if value is not None:
+                setattr(character, field, value)
+        state.conversation.touch()
+    persona_service.prepare(character, state.conversation)
+    return {"status": "success", "character": character}
+
+
 @router.post("/character/{character_id}/image")
 async def upload_character_image(character_id: str, file: UploadFile = File(...)):
     """Upload an image for a character"""
@@ -51,7 +109,7 @@ async def upload_character_image(character_id: str, file: UploadFile = File(...)
         raise HTTPException(status_code=400, detail="No active conversation")
     
     # Find character
-    character = next((c for c in state.conversation.characters if c.id == character_id), None)
+    character = state.conversation.get_character(character_id)
     if not character:
         raise HTTPException(status_code=404, detail="Character not found")
     
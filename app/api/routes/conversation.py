@@ -1,42 +1,78 @@
 """Conversation management routes"""
 
-from fastapi import APIRouter, HTTPException, Form
+from fastapi import APIRouter, Depends, HTTPException, Form, Response
 from datetime import datetime
 from typing import Optional
-import json
+import asyncio
 import os
 
-from app.models import Character, Scenario, Conversation
+from app.models import Character, Scenario, Conversation, GenerationUsage, UsageTotals
 from app.core.config import settings
+from app.core.locks import conversation_lock
 from app.core.state import get_state
+from app.services.generation_manager import generation_manager
+from app.services.idempotency import idempotency_cache
+from app.services.memory_service import memory_service
+from app.services.search_service import search_index
+from app.services.storage_service import conversation_store, page_start
+from app.services.job_service import JobQueueFull, job_queue
+from app.services.summary_service import summary_service
+from .jobs import start_job
+from .limits import model_request
 
 router = APIRouter()
 
 
-@router.post("/conversation/new")
+@router.post("/conversation/new", dependencies=[Depends(model_request)])
 async def create_conversation(
+    response: Response,
     scenario_description: str = Form(""),
     character1_name: str = Form(...),
     character1_description: str = Form(""),
     character2_name: str = Form(...),
-    character2_description: str = Form("")
+    character2_description: str = Form(""),
+    background: bool = Form(False)
 ):
-    """Create a new conversation with initial setup"""
-    from app.services.ai_service import ai_service
+    """Create a new conversation with initial setup.
+    
+    Generating a missing scenario and descriptions can take a while; with
+    `background` the request returns a job at once (see /api/jobs).
+    """
+    def setup():
+        return _create_conversation(scenario_description, character1_name, character1_description,
+                                    character2_name, character2_description)
+    
+    if background:
+        return start_job(response, "conversation_new", setup)
+    return await setup()
+
+
+async def _create_conversation(scenario_description: str, character1_name: str, character1_description: str,
+                               character2_name: str, character2_description: str) -> dict:
+    """Generate whatever setup is missing and make the result the current conversation"""
     state = get_state()
     
     conv_id = f"conv_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
     
+    # Leaving the current story: stop anything still generating for it
+    if state.conversation:
+        generation_manager.cancel_conversation(state.conversation.id)
+    
+    usages = []
+    
     # Generate scenario if empty
     if not scenario_description or scenario_description.strip() == "":
-        scenario_description = _generate_scenario(character1_name, character2_name)
+        scenario_description, usage = await _generate_scenario(character1_name, character2_name)
+        usages.append(usage)
     
     # Generate character descriptions if empty
     if not character1_description or character1_description.strip() == "":
-        character1_description = _generate_character_description(character1_name, scenario_description)
+        character1_description, usage = await _generate_character_description(character1_name, scenario_description)
+        usages.append(usage)
     
     if not character2_description or character2_description.strip() == "":
-        character2_description = _generate_character_description(character2_name, scenario_description)
+        character2_description, usage = await _generate_character_description(character2_name, scenario_description)
+        usages.append(usage)
     
     # Create narrator (fixed character)
     narrator = Character(
@@ -71,14 +107,17 @@ async def create_conversation(
         characters=[narrator, char1, char2],
         messages=[]
     )
+    for usage in usages:
+        conversation.record_usage(usage)
     
     state.conversation = conversation
     state.current_message_index = -1
+    memory_service.activate(conversation)
     
     return {"status": "success", "conversation_id": conv_id}
 
 
-def _generate_scenario(char1_name: str, char2_name: str) -> str:
+async def _generate_scenario(char1_name: str, char2_name: str) -> tuple[str, GenerationUsage]:
     """Generate a scenario based on character names"""
     from app.services.ai_service import ai_service
     
@@ -88,11 +127,11 @@ Write 1-2 sentences describing the setting and situation. Be creative and intere
 
 Scenario:"""
     
-    response = ai_service.get_response(prompt)
-    return response.strip()
+    response, usage = await ai_service.complete(prompt, task="scenario")
+    return response.strip(), usage
 
 
-def _generate_character_description(name: str, scenario: str) -> str:
+async def _generate_character_description(name: str, scenario: str) -> tuple[str, GenerationUsage]:
     """Generate a character description based on name and scenario"""
     from app.services.ai_service import ai_service
     
@@ -104,63 +143,220 @@ Write 1-2 sentences describing their personality, background, and speaking style
 
 Character description:"""
     
-    response = ai_service.get_response(prompt)
-    return response.strip()
+    response, usage = await ai_service.complete(prompt, task="description")
+    return response.strip(), usage
 
 
 @router.post("/conversation/save")
 async def save_conversation():
-    """Save the current conversation to a JSON file"""
+    """Save the current conversation; only messages changed since the last save are written"""
     state = get_state()
     
     if not state.conversation:
         raise HTTPException(status_code=400, detail="No active conversation")
     
-    filename = f"{state.conversation.id}.json"
-    filepath = os.path.join(settings.save_dir, filename)
+    async with conversation_lock(state.conversation.id):
+        filepath = conversation_store.save(state.conversation)
+        if settings.search_enabled:
+            await asyncio.to_thread(search_index.update, state.conversation, os.path.basename(filepath))
+    memory_service.save(state.conversation)
     
-    with open(filepath, "w", encoding="utf-8") as f:
-        json.dump(state.conversation.model_dump(), f, indent=2, ensure_ascii=False)
-    
-    return {"status": "success", "filename": filename, "path": filepath}
+    return {"status": "success", "filename": os.path.basename(filepath), "path": filepath}
 
 
 @router.post("/conversation/load")
-async def load_conversation(filename: str = Form(...)):
-    """Load a conversation from a JSON file"""
+async def load_conversation(filename: str = Form(...), lazy: bool = Form(False)):
+    """Load a conversation from a save file.
+    
+    With `lazy` the response carries only the metadata, summaries and the
+    last page of messages; earlier pages come from /conversation/messages.
+    """
     state = get_state()
     
     filepath = os.path.join(settings.save_dir, filename)
     if not os.path.exists(filepath):
         raise HTTPException(status_code=404, detail="Conversation file not found")
     
-    with open(filepath, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    # Parse off the event loop so long stories don't stall other requests
+    conversation = await asyncio.to_thread(conversation_store.load, filename)
     
-    state.conversation = Conversation(**data)
+    if state.conversation:
+        generation_manager.cancel_conversation(state.conversation.id)
+    
+    state.conversation = conversation
     state.current_message_index = len(state.conversation.messages) - 1
+    # Results generated since this save was made are not part of it; never replay them
+    idempotency_cache.clear()
+    memory_service.activate(state.conversation)
     
-    return {"status": "success", "conversation": state.conversation}
+    # Stories saved without summaries get them in the background
+    backfill_job = None
+    if settings.summary_backfill_on_load and summary_service.missing_summaries(conversation) >= 2:
+        try:
+            backfill_job = job_queue.submit("summary_backfill", lambda: summary_service.backfill(conversation))
+        except JobQueueFull:
+            pass
+    
+    if lazy:
+        return {
+            "status": "success",
+            "conversation": _conversation_view(state.conversation, settings.message_page_size),
+            "backfill_job": backfill_job,
+        }
+    return {"status": "success", "conversation": state.conversation, "backfill_job": backfill_job}
+
+
+@router.post("/conversation/summaries/backfill", dependencies=[Depends(model_request)])
+async def backfill_summaries(response: Response):
+    """Summarize every chunk of the current branch that has no summary, as a job.
+    
+    Stale summaries are redone first. Chunks are summarized concurrently and the summaries reduced into an
+    overview; the job reports its progress. Running it again after an
+    interruption resumes where it stopped.
+    """
+    state = get_state()
+    
+    if not state.conversation:
+        raise HTTPException(status_code=400, detail="No active conversation")
+    
+    conversation = state.conversation
+    if summary_service.is_backfilling(conversation):
+        raise HTTPException(status_code=409, detail="A summary backfill is already running for this branch")
+    branch = conversation.active_branch
+    if (not summary_service.missing_summaries(conversation) and not summary_service.is_stale(conversation)
+            and branch.overview_covers == len(branch.summaries)):
+        return {"status": "success", "summaries_added": 0, "summaries": len(branch.summaries)}
+    return start_job(response, "summary_backfill", lambda: summary_service.backfill(conversation))
+
+
+@router.get("/conversation/messages")
+async def get_messages(offset: Optional[int] = None, limit: Optional[int] = None):
+    """A page of the current conversation's messages; without an offset, the last page"""
+    state = get_state()
+    
+    if not state.conversation:
+        raise HTTPException(status_code=400, detail="No active conversation")
+    
+    limit = limit or settings.message_page_size
+    messages = state.conversation.messages
+    start = page_start(len(messages), offset, limit)
+    return {
+        "total": len(messages),
+        "offset": start,
+        "messages": [m.to_message() for m in messages[start:start + limit]]
+    }
+
+
+@router.get("/conversation/saved/{filename}/messages")
+async def get_saved_messages(filename: str, offset: Optional[int] = None, limit: Optional[int] = None):
+    """A page of a saved conversation's messages, read without loading the whole save"""
+    filepath = os.path.join(settings.save_dir, filename)
+    if not os.path.exists(filepath):
+        raise HTTPException(status_code=404, detail="Conversation file not found")
+    
+    total, start, messages = conversation_store.read_page(filename, offset, limit or settings.message_page_size)
+    return {"total": total, "offset": start, "messages": messages}
+
+
+def _conversation_view(conversation: Conversation, message_limit: int) -> dict:
+    """A conversation with only its last `message_limit` messages"""
+    data = conversation.model_dump(exclude={"messages"})
+    start = max(0, len(conversation.messages) - message_limit)
+    data["messages"] = [m.to_dict() for m in conversation.messages[start:]]
+    data["message_count"] = len(conversation.messages)
+    data["messages_offset"] = start
+    return data
 
 
 @router.get("/conversation/list")
 async def list_conversations():
     """List all saved conversations"""
-    files = [f for f in os.listdir(settings.save_dir) if f.endswith(".json")]
-    conversations = []
+    return {"conversations": conversation_store.list()}
+
+
+@router.get("/conversation/usage")
+async def get_usage():
+    """Tokens and time spent on the current conversation, per task.
+
+    `tasks` counts every model call made for the conversation, including
+    discarded candidates and stale generations; `active_branch` sums the
+    usage of the messages on the branch being read.
+    """
+    state = get_state()
+
+    if not state.conversation:
+        raise HTTPException(status_code=400, detail="No active conversation")
+
+    total = UsageTotals()
+    tasks = {}
+    for task, usage in state.conversation.usage.items():
+        total.merge(usage)
+        tasks[task] = {**usage.model_dump(), **usage.rates()}
+    branch = UsageTotals()
+    for message in state.conversation.messages:
+        if message.usage_values:
+            branch.add(message.usage)
+    return {
+        "conversation_id": state.conversation.id,
+        "tasks": tasks,
+        "total": {**total.model_dump(), **total.rates()},
+        "active_branch": {**branch.model_dump(), **branch.rates()},
+    }
+
+
+@router.get("/conversation/branches")
+async def list_branches():
+    """List the branches of the current conversation"""
+    state = get_state()
     
-    for filename in files:
-        filepath = os.path.join(settings.save_dir, filename)
-        with open(filepath, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            conversations.append({
-                "filename": filename,
-                "name": data.get("name", "Unnamed"),
-                "created_at": data.get("created_at", ""),
-                "message_count": len(data.get("messages", []))
-            })
+    if not state.conversation:
+        raise HTTPException(status_code=400, detail="No active conversation")
     
-    return {"conversations": conversations}
+    return {
+        "active_branch_id": state.conversation.active_branch_id,
+        "branches": list(state.conversation.branches.values())
+    }
+
+
+@router.post("/conversation/branch")
+async def create_branch(
+    name: str = Form(...),
+    from_message_id: Optional[str] = Form(None),
+    switch: bool = Form(True)
+):
+    """Start a branch after a message (or from the beginning) and optionally switch to it"""
+    state = get_state()
+    
+    if not state.conversation:
+        raise HTTPException(status_code=400, detail="No active conversation")
+    
+    async with conversation_lock(state.conversation.id):
+        try:
+            branch = state.conversation.create_branch(name, from_message_id)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Message not found")
+        if switch:
+            state.conversation.switch_branch(branch.id)
+            state.current_message_index = len(state.conversation.messages) - 1
+    
+    return {"status": "success", "branch": branch}
+
+
+@router.post("/conversation/branch/{branch_id}/switch")
+async def switch_branch(branch_id: str):
+    """Make another branch the active one"""
+    state = get_state()
+    
+    if not state.conversation:
+        raise HTTPException(status_code=400, detail="No active conversation")
+    if branch_id not in state.conversation.branches:
+        raise HTTPException(status_code=404, detail="Branch not found")
+    
+    async with conversation_lock(state.conversation.id):
+        state.conversation.switch_branch(branch_id)
+        state.current_message_index = len(state.conversation.messages) - 1
+    
+    return {"status": "success", "conversation": state.conversation}
 
 
 @router.post("/scenario/update")
@@ -174,21 +370,27 @@ async def update_scenario(
     if not state.conversation:
         raise HTTPException(status_code=400, detail="No active conversation")
     
-    if what_happens_next is not None:
-        state.conversation.scenario.what_happens_next = what_happens_next
-    if never_forget is not None:
-        state.conversation.scenario.never_forget = never_forget
+    async with conversation_lock(state.conversation.id):
+        if what_happens_next is not None:
+            state.conversation.scenario.what_happens_next = what_happens_next
+        if never_forget is not None:
+            state.conversation.scenario.never_forget = never_forget
+        state.conversation.touch()
     
     return {"status": "success", "scenario": state.conversation.scenario}
 
 
 @router.get("/state")
-async def get_application_state():
-    """Get current application state"""
+async def get_application_state(message_limit: Optional[int] = None):
+    """Get current application state, optionally with only the last `message_limit` messages"""
     state = get_state()
     
+    conversation = state.conversation
+    if conversation and message_limit is not None:
+        conversation = _conversation_view(conversation, message_limit)
+    
     return {
-        "conversation": state.conversation,
+        "conversation": conversation,
         "auto_response_enabled": state.auto_response_enabled,
         "show_reactions": state.show_reactions,
         "current_message_index": state.current_message_index
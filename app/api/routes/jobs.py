@@ -0,0 +1,70 @@
+"""Background job routes"""
+
+import json
+from fastapi import APIRouter, HTTPException, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from typing import Any, Awaitable, Callable
+
+from app.services.job_service import Job, JobQueueFull, job_queue
+
+router = APIRouter()
+
+# Longest a poll may wait for a job to finish
+MAX_WAIT_SECONDS = 30
+
+
+def start_job(response: Response, kind: str, factory: Callable[[], Awaitable[Any]]) -> dict:
+    """Submit a job for a request and answer 202 with where to follow it"""
+    try:
+        job = job_queue.submit(kind, factory)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    response.status_code = 202
+    return {"status": "accepted", "job": job, "poll": f"/api/jobs/{job.id}"}
+
+
+@router.get("/jobs")
+async def list_jobs():
+    """List queued, running and recently finished jobs"""
+    return {"jobs": job_queue.list()}
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """A job's state and, once finished, its result or error.
+
+    With `wait` the request is held for up to that many seconds (at most
+    MAX_WAIT_SECONDS) until the job finishes.
+    """
+    job = await job_queue.wait(job_id, min(max(wait, 0), MAX_WAIT_SECONDS))
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return {"job": job}
+
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events with the job's state on each change, ending when it finishes"""
+    if not job_queue.get(job_id):
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+
+    async def events():
+        async for job in job_queue.subscribe(job_id):
+            yield _event(job)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+@router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job"""
+    if not job_queue.get(job_id):
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return {"status": "success", "cancelled": job_queue.cancel(job_id)}
+
+
+def _event(job: Job) -> str:
+    """One server-sent event carrying a job"""
+    return f"event: {job.status}\ndata: {json.dumps(jsonable_encoder(job))}\n\n"
@@ -0,0 +1,21 @@
+"""Rate limiting for routes that run the model"""
+
+from fastapi import HTTPException, Request
+
+from app.core.state import get_state
+from app.services.rate_limiter import RateLimited, request_limiter
+
+
+async def model_request(request: Request):
+    """Dependency for model-backed routes: refuse with 429 over the rate limits or when the server is busy.
+
+    The request holds an admission slot until the route returns.
+    """
+    state = get_state()
+    conversation_id = state.conversation.id if state.conversation else None
+    client = request.client.host if request.client else "unknown"
+    try:
+        with request_limiter.admit(client, conversation_id):
+            yield
+    except RateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
@@ -1,57 +1,254 @@
 """Message management routes"""
 
-from fastapi import APIRouter, HTTPException, Form
-from typing import Optional
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Form, Header, Request
+from typing import List, Optional
 
-from app.models import Message
+from app.models import Message, new_message_id
+from app.core.config import settings
+from app.core.locks import conversation_lock
 from app.core.state import get_state
 from app.services.ai_service import ai_service
 from app.services.summary_service import summary_service
+from app.services.generation_manager import generation_manager, GenerationCancelled
+from app.services.idempotency import idempotency_cache
+from app.services.metrics import generation_metrics
+from app.services.memory_service import memory_service
+from .limits import model_request
 
 router = APIRouter()
 
 
-@router.post("/message/generate")
-async def generate_message(character_id: Optional[str] = Form(None)):
+@router.post("/message/generate", dependencies=[Depends(model_request)])
+async def generate_message(
+    request: Request,
+    character_id: Optional[str] = Form(None),
+    idempotency_key: Optional[str] = Header(None)
+):
     """Generate an AI response for a character"""
     state = get_state()
     
     if not state.conversation:
         raise HTTPException(status_code=400, detail="No active conversation")
     
-    # Decide which character should respond
-    if state.auto_response_enabled and not character_id:
-        # AI decides who responds
-        character_id = await ai_service.decide_next_character()
-    elif not character_id:
+    key = _request_key("generate", idempotency_key, character_id or "auto")
+    messages = await idempotency_cache.run(
+        key, lambda: _generate_and_summarize(request, _generate_turn(character_id))
+    )
+    
+    return {"status": "success", "message": messages[0]}
+
+
+async def _generate_turn(character_id: Optional[str], replace_last: bool = False,
+                         candidates: int = 1) -> List[Message]:
+    """Generate a response and append it, or replace the last message.
+    
+    A replaced message is kept as an alternative to its replacement, so
+    regenerating never loses the previous answer. When replacing,
+    `candidates` responses are generated concurrently from the same prompt:
+    the first goes on the active branch and each other distinct one is kept
+    as an alternative too. Returns the new messages, the active one first.
+    
+    The prompt is built from a snapshot taken under the conversation lock,
+    and the lock is released while the model runs. If the conversation
+    changed in the meantime the generation is stale: it is rebased onto the
+    new history up to `max_generation_rebases` times, then rejected. In auto
+    mode the speaker is picked before each attempt, outside the lock.
+    """
+    state = get_state()
+    conversation = state.conversation
+    lock = conversation_lock(conversation.id)
+    target_id = None
+    # AI decides who responds
+    auto = not replace_last and not character_id
+    if auto and not state.auto_response_enabled:
         raise HTTPException(status_code=400, detail="Character ID required when auto-response is disabled")
     
-    # Get character
-    character = next((c for c in state.conversation.characters if c.id == character_id), None)
-    if not character:
-        raise HTTPException(status_code=404, detail="Character not found")
+    for attempt in range(settings.max_generation_rebases + 1):
+        speaker_id = character_id
+        if auto:
+            # May ask the model to break a tie, so it runs outside the lock;
+            # a rebase picks again for the new history
+            speaker_id = await ai_service.decide_next_character()
+        async with lock:
+            messages = conversation.messages
+            if replace_last:
+                if not messages or (target_id and messages[-1].id != target_id):
+                    break
+                target_id = messages[-1].id
+                speaker_id = messages[-1].character_id
+                history = messages[:-1]
+            else:
+                history = messages
+            
+            # Get character
+            character = conversation.get_character(speaker_id)
+            if not character:
+                raise HTTPException(status_code=404, detail="Character not found")
+            
+            prompt = ai_service.build_prompt(character, history)
+            version = conversation.version
+        
+        # Generate AI responses; the shared prompt prefix is evaluated once by the server's cache
+        results = await asyncio.gather(*(
+            ai_service.generate_character_response(character, prompt=prompt)
+            for _ in range(candidates)
+        ), return_exceptions=True)
+        # Keep the candidates that made it; fail only if none did
+        responses = [r for r in results if not isinstance(r, BaseException)]
+        if not responses:
+            raise results[0]
+        
+        async with lock:
+            # Every call counts, including ones that turn out stale or duplicate
+            for _, _, usage in responses:
+                conversation.record_usage(usage)
+            if conversation.version != version or state.conversation is not conversation:
+                if attempt < settings.max_generation_rebases:
+                    generation_metrics.record_stale("rebased")
+                continue
+            
+            # Create messages, dropping duplicate candidates
+            messages = []
+            seen = set()
+            for reaction, dialogue, usage in responses:
+                if (reaction, dialogue) in seen:
+                    continue
+                seen.add((reaction, dialogue))
+                messages.append(Message(
+                    id=new_message_id(),
+                    character_id=character.id,
+                    character_name=character.name,
+                    content=dialogue,
+                    reaction=reaction if state.show_reactions else None,
+                    usage=usage
+                ))
+            
+            # Add to conversation
+            if replace_last:
+                conversation.replace_message(target_id, messages[0])
+                for alternative in messages[1:]:
+                    conversation.add_alternative(messages[0].id, alternative)
+            else:
+                conversation.add_message(messages[0])
+            conversation.touch()
+            state.current_message_index = len(conversation.messages) - 1
+            memory_service.enqueue(conversation, messages)
+            return messages
     
-    # Generate AI response
-    reaction, dialogue = await ai_service.generate_character_response(character)
+    generation_metrics.record_stale("rejected")
+    raise HTTPException(status_code=409, detail="Conversation changed during generation")
+
+
+@router.post("/message/scene", dependencies=[Depends(model_request)])
+async def generate_scene(
+    request: Request,
+    turns: Optional[int] = Form(None),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """Generate several turns by different speakers (narrator included) from one model call"""
+    state = get_state()
     
-    # Create message
-    message = Message(
-        id=f"msg_{len(state.conversation.messages)}",
-        character_id=character.id,
-        character_name=character.name,
-        content=dialogue,
-        reaction=reaction if state.show_reactions else None
+    if not state.conversation:
+        raise HTTPException(status_code=400, detail="No active conversation")
+    turns = turns or settings.scene_turns
+    if not 1 <= turns <= settings.max_scene_turns:
+        raise HTTPException(status_code=400,
+                            detail=f"turns must be between 1 and {settings.max_scene_turns}")
+    
+    key = _request_key("scene", idempotency_key, str(turns))
+    messages = await idempotency_cache.run(
+        key, lambda: _generate_and_summarize(request, _generate_scene(turns))
     )
     
-    # Add to conversation
-    state.conversation.messages.append(message)
-    state.current_message_index = len(state.conversation.messages) - 1
+    return {"status": "success", "messages": messages}
+
+
+async def _generate_scene(turns: int) -> List[Message]:
+    """Generate `turns` turns in one call and append them.
+    
+    The model labels each turn with its speaker. Turns are kept up to the
+    first one that fails validation; the rest are generated one call at a
+    time, with speakers picked by the turn scheduler. The call's usage is
+    attached to the first scene message. Staleness is handled as in
+    `_generate_turn`.
+    """
+    state = get_state()
+    conversation = state.conversation
+    lock = conversation_lock(conversation.id)
+    
+    for attempt in range(settings.max_generation_rebases + 1):
+        async with lock:
+            prompt = ai_service.build_scene_prompt(turns, conversation.messages)
+            version = conversation.version
+        
+        generated, usage = await ai_service.generate_scene(turns, prompt)
+        
+        async with lock:
+            conversation.record_usage(usage)
+            if conversation.version != version or state.conversation is not conversation:
+                if attempt < settings.max_generation_rebases:
+                    generation_metrics.record_stale("rebased")
+                continue
+            
+            messages = [Message(
+                id=new_message_id(),
+                character_id=character.id,
+                character_name=character.name,
+                content=text,
+                reaction=reaction if state.show_reactions else None,
+                usage=usage if i == 0 else None
+            ) for i, (character, reaction, text) in enumerate(generated)]
+            for message in messages:
+                conversation.add_message(message)
+            if messages:
+                conversation.touch()
+                state.current_message_index = len(conversation.messages) - 1
+                memory_service.enqueue(conversation, messages)
+            break
+    else:
+        generation_metrics.record_stale("rejected")
+        raise HTTPException(status_code=409, detail="Conversation changed during generation")
     
-    # Check if summary is needed
+    generation_metrics.record_scene(turns, len(messages))
+    for _ in range(turns - len(messages)):
+        character_id = await ai_service.decide_next_character()
+        messages += await _generate_turn(character_id)
+    return messages
+
+
+async def _run_generation(request: Request, coro):
+    """Run a turn generation in the conversation's slot, superseding older ones"""
+    state = get_state()
+    slot = generation_manager.slot_for(state.conversation.id)
+    try:
+        return await generation_manager.run(slot, coro, request)
+    except GenerationCancelled as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+async def _generate_and_summarize(request: Request, coro) -> List[Message]:
+    """Run a turn generation, then summarize if enough messages have accumulated"""
+    messages = await _run_generation(request, coro)
     if summary_service.should_generate_summary():
         await summary_service.generate_summary()
+    return messages
+
+
+def _request_key(action: str, idempotency_key: Optional[str], target: str) -> str:
+    """Key identifying duplicate generate/regenerate requests.
     
-    return {"status": "success", "message": message}
+    An explicit Idempotency-Key header wins. Without one, requests made
+    against the same conversation state collapse together, which catches
+    double-clicks while still letting the next turn start a fresh generation.
+    The version alone does not identify the state, as it starts over when a
+    save is loaded; the last message's id tells those states apart.
+    """
+    if idempotency_key:
+        return f"{action}:key:{idempotency_key}"
+    conversation = get_state().conversation
+    head_id = conversation.messages[-1].id if conversation.messages else ""
+    return f"{action}:{conversation.id}:{conversation.version}:{head_id}:{target}"
 
 
 @router.post("/message/manual")
@@ -66,27 +263,31 @@ async def add_manual_message(
     if not state.conversation:
         raise HTTPException(status_code=400, detail="No active conversation")
     
-    character = next((c for c in state.conversation.characters if c.id == character_id), None)
+    character = state.conversation.get_character(character_id)
     if not character:
         raise HTTPException(status_code=404, detail="Character not found")
     
     message = Message(
-        id=f"msg_{len(state.conversation.messages)}",
+        id=new_message_id(),
         character_id=character.id,
         character_name=character.name,
         content=content,
         reaction=reaction if state.show_reactions else None
     )
     
-    state.conversation.messages.append(message)
-    state.current_message_index = len(state.conversation.messages) - 1
+    async with conversation_lock(state.conversation.id):
+        state.conversation.add_message(message)
+        state.conversation.touch()
+        state.current_message_index = len(state.conversation.messages) - 1
+        memory_service.enqueue(state.conversation, [message])
     
     return {"status": "success", "message": message}
 
 
 @router.put("/message/{message_index}/edit")
-async def edit_message(message_index: int, content: str, reaction: Optional[str] = None):
-    """Edit an existing message"""
+async def edit_message(message_index: int, content: str, reaction: Optional[str] = None,
+                       as_branch: bool = False):
+    """Edit an existing message by position"""
     state = get_state()
     
     if not state.conversation:
@@ -95,27 +296,163 @@ async def edit_message(message_index: int, content: str, reaction: Optional[str]
     if message_index < 0 or message_index >= len(state.conversation.messages):
         raise HTTPException(status_code=404, detail="Message not found")
     
-    message = state.conversation.messages[message_index]
-    message.content = content
-    if reaction is not None:
-        message.reaction = reaction
+    message = await _edit_message(state.conversation.messages[message_index].id, content, reaction, as_branch)
+    return {"status": "success", "message": message}
+
+
+@router.put("/message/{message_id}")
+async def edit_message_by_id(
+    message_id: str,
+    content: str = Form(...),
+    reaction: Optional[str] = Form(None),
+    as_branch: bool = Form(False)
+):
+    """Edit an existing message by id"""
+    state = get_state()
+    
+    if not state.conversation:
+        raise HTTPException(status_code=400, detail="No active conversation")
     
+    message = await _edit_message(message_id, content, reaction, as_branch)
     return {"status": "success", "message": message}
 
 
-@router.post("/message/regenerate")
-async def regenerate_last_message():
-    """Regenerate the last message"""
+async def _edit_message(message_id: str, content: str, reaction: Optional[str],
+                        as_branch: bool = False) -> Message:
+    """Change a message's content and reaction.
+    
+    With `as_branch` the edited message takes the original's place on the
+    active branch. The original is kept as an alternative to it, and
+    anything that followed it on a new branch.
+    """
+    state = get_state()
+    conversation = state.conversation
+    
+    async with conversation_lock(conversation.id):
+        original = conversation.get_message(message_id)
+        if not original:
+            raise HTTPException(status_code=404, detail="Message not found")
+        
+        if as_branch:
+            if conversation.message_position(message_id) < 0:
+                raise HTTPException(status_code=400, detail="Message is not on the active branch")
+            message = original.to_message().model_copy(update={
+                "id": new_message_id(),
+                "content": content,
+                "reaction": original.reaction if reaction is None else reaction
+            })
+            conversation.replace_message(message_id, message)
+            state.current_message_index = len(conversation.messages) - 1
+        else:
+            message = conversation.update_message(message_id, content, reaction).to_message()
+        conversation.touch()
+        memory_service.enqueue(conversation, [message])
+    
+    return message
+
+
+@router.delete("/message/{message_id}")
+async def delete_message(message_id: str):
+    """Delete a message by id"""
+    state = get_state()
+    
+    if not state.conversation:
+        raise HTTPException(status_code=400, detail="No active conversation")
+    
+    async with conversation_lock(state.conversation.id):
+        if state.conversation.message_position(message_id) < 0:
+            raise HTTPException(status_code=404, detail="Message not found")
+        
+        state.conversation.remove_message(message_id)
+        state.conversation.touch()
+        memory_service.forget(state.conversation, [message_id])
+        state.current_message_index = min(state.current_message_index, len(state.conversation.messages) - 1)
+    
+    return {"status": "success", "deleted": message_id}
+
+
+@router.post("/message/regenerate", dependencies=[Depends(model_request)])
+async def regenerate_last_message(
+    request: Request,
+    candidates: int = Form(1),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """Regenerate the last message, keeping the previous one as an alternative.
+    
+    With `candidates` > 1 several responses are generated in parallel. The
+    first replaces the last message and the others are kept as alternatives
+    to it; /message/{message_id}/choose picks one of them instead.
+    """
     state = get_state()
     
     if not state.conversation or not state.conversation.messages:
         raise HTTPException(status_code=400, detail="No messages to regenerate")
+    if not 1 <= candidates <= settings.max_regenerate_candidates:
+        raise HTTPException(
+            status_code=400,
+            detail=f"candidates must be between 1 and {settings.max_regenerate_candidates}"
+        )
+    
+    key = _request_key("regenerate", idempotency_key, f"last:{candidates}")
+    messages = await idempotency_cache.run(
+        key, lambda: _generate_and_summarize(
+            request, _generate_turn(None, replace_last=True, candidates=candidates)
+        )
+    )
     
-    # Remove last message
-    last_message = state.conversation.messages.pop()
+    return {"status": "success", "message": messages[0], "candidates": messages}
+
+
+@router.get("/message/{message_id}/alternatives")
+async def list_alternatives(message_id: str):
+    """List a message and the alternatives kept for it, oldest first"""
+    state = get_state()
+    
+    if not state.conversation:
+        raise HTTPException(status_code=400, detail="No active conversation")
+    
+    try:
+        alternatives = state.conversation.alternatives(message_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return {
+        "alternatives": [{**m.to_message().model_dump(), "active": state.conversation.message_position(m.id) >= 0}
+                         for m in alternatives]
+    }
+
+
+@router.post("/message/{message_id}/choose")
+async def choose_alternative(message_id: str):
+    """Put an alternative to the last message in its place"""
+    state = get_state()
+    conversation = state.conversation
+    
+    if not conversation:
+        raise HTTPException(status_code=400, detail="No active conversation")
+    
+    async with conversation_lock(conversation.id):
+        try:
+            conversation.choose_alternative(message_id)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Message not found")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        conversation.touch()
+        state.current_message_index = len(conversation.messages) - 1
+    
+    return {"status": "success", "message": conversation.messages[-1].to_message()}
+
+
+@router.post("/message/cancel")
+async def cancel_generation():
+    """Cancel the generation in flight for the current conversation"""
+    state = get_state()
+    
+    if not state.conversation:
+        raise HTTPException(status_code=400, detail="No active conversation")
     
-    # Generate new response for the same character
-    return await generate_message(character_id=last_message.character_id)
+    cancelled = generation_manager.cancel(generation_manager.slot_for(state.conversation.id))
+    return {"status": "success", "cancelled": cancelled}
 
 
 @router.post("/message/navigate")
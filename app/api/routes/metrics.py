@@ -0,0 +1,33 @@
+"""Metrics routes"""
+
+from fastapi import APIRouter
+from app.services.metrics import generation_metrics
+
+router = APIRouter()
+
+
+@router.get("/metrics/generation")
+async def get_generation_metrics():
+    """Report tokens generated versus tokens kept per task"""
+    return generation_metrics.report()
+
+
+@router.get("/metrics/routing")
+async def get_model_routing():
+    """Show which model serves each task, the current load and the circuit breaker state"""
+    from app.services.ai_service import ai_service
+    return {**ai_service.router.describe(), "circuit": ai_service.breaker.describe()}
+
+
+@router.post("/metrics/reset")
+async def reset_metrics():
+    """Reset all metrics counters"""
+    generation_metrics.reset()
+    return {"status": "success"}
+
+
+@router.get("/metrics/admission")
+async def get_admission():
+    """Show model-backed requests in progress and the admission limit"""
+    from app.services.rate_limiter import request_limiter
+    return request_limiter.describe()
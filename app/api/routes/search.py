@@ -0,0 +1,38 @@
+"""Search routes"""
+
+import asyncio
+from fastapi import APIRouter, HTTPException
+from typing import Optional
+
+from app.core.config import settings
+from app.services.search_service import search_index
+
+router = APIRouter()
+
+
+@router.get("/search")
+async def search(q: str, limit: int = 20, conversation_id: Optional[str] = None):
+    """Search message text, speakers and summaries across all saved conversations"""
+    if not settings.search_enabled:
+        raise HTTPException(status_code=404, detail="Search is disabled")
+    
+    # SQLite calls block, and wait on a running refresh; keep them off the event loop
+    hits, conversations = await asyncio.to_thread(
+        search_index.search, q, min(max(limit, 1), 100), conversation_id
+    )
+    return {
+        "query": q,
+        "hits": hits,
+        "conversations": conversations,
+        "indexing": search_index.refreshing
+    }
+
+
+@router.post("/search/reindex")
+async def reindex():
+    """Index saves that were added or changed outside the app"""
+    if not settings.search_enabled:
+        raise HTTPException(status_code=404, detail="Search is disabled")
+    
+    updated = await asyncio.to_thread(search_index.refresh)
+    return {"status": "success", "updated": updated}
@@ -1,6 +1,7 @@
 """Application configuration"""
 
 import os
+from typing import Dict
 from pydantic_settings import BaseSettings
 
 
@@ -14,14 +15,105 @@ class Settings(BaseSettings):
     
     # Directories
     save_dir: str = "saved_conversations"
+    # Compression for saved messages: "gzip", "zstd" (needs zstandard) or "none"
+    save_compression: str = "gzip"
     images_dir: str = "character_images"
     static_dir: str = "static"
     
     # AI Model
     ai_model: str = "llama3.2:1b"
+    # Model server: "ollama", "openai" (any OpenAI-compatible server) or "fake"
+    llm_backend: str = "ollama"
+    # Server URL; empty uses the backend's default
+    llm_base_url: str = ""
+    llm_api_key: str = ""
+    # Record API requests and model calls to this file (opt-in; prompts are stored in full)
+    llm_record_path: str = ""
+    # Answer model calls from a recorded session instead of a server
+    llm_replay_path: str = ""
+    # Replay latency: 1.0 as recorded, 2.0 twice as fast, 0 instant
+    llm_replay_speed: float = 1.0
+    # Per-task model overrides, e.g. {"summary": "llama3.2:1b", "dialogue": "llama3.1:8b"}
+    task_models: Dict[str, str] = {}
+    # Cheap model for summaries, descriptions and scenarios; empty uses ai_model
+    small_model: str = ""
+    # Send every task to small_model while this many generations are in flight
+    fallback_under_load: bool = False
+    fallback_load_threshold: int = 4
+    
+    # Generation
+    min_num_ctx: int = 2048
+    max_num_ctx: int = 8192
+    # Per-task deadlines in seconds, overriding the generation profiles', e.g. {"dialogue": 45}
+    task_deadlines: Dict[str, float] = {}
+    # Retries of a model call that failed before producing output; the wait
+    # before retry n is random, up to llm_retry_backoff * 2**n seconds
+    llm_retries: int = 2
+    llm_retry_backoff: float = 0.5
+    # Consecutive failed calls after which model calls fail at once, and for how long
+    circuit_failure_threshold: int = 5
+    circuit_reset_seconds: float = 30
+    
+    # Requests
+    idempotency_ttl_seconds: int = 60
+    # Times a generation is retried when the conversation changed under it
+    max_generation_rebases: int = 1
+    # Upper bound on candidates generated in parallel by one regenerate
+    max_regenerate_candidates: int = 4
+    # Scene mode: turns requested from one generation by default, and at most
+    scene_turns: int = 3
+    max_scene_turns: int = 4
+    
+    # Rate limits on endpoints that run the model: sustained requests per minute
+    # and burst size, per client and per conversation (0 per minute: no limit)
+    client_rate_per_minute: float = 30
+    client_burst: int = 10
+    conversation_rate_per_minute: float = 20
+    conversation_burst: int = 5
+    # Model-backed requests allowed in progress at once; more are refused with 429 (0: no limit)
+    max_active_generations: int = 8
+    
+    # Background jobs (story setup and character creation with background=true)
+    job_workers: int = 2
+    # Jobs allowed to be queued or running at once; more are refused
+    job_max_pending: int = 32
+    # How long a finished job's result stays available
+    job_ttl_seconds: int = 600
     
     # Conversation
     max_messages_before_summary: int = 20
+    # Summaries of a long story without them are made this many at a time
+    summary_backfill_concurrency: int = 2
+    # Summaries folded into one by each step of building the overview
+    summary_reduce_fanin: int = 8
+    # Start a backfill when a loaded story is missing summaries
+    summary_backfill_on_load: bool = True
+    # Token budget for a character's persona in prompts; longer ones are condensed once
+    persona_max_tokens: int = 80
+    # Messages per page for paginated and lazy loading
+    message_page_size: int = 50
+    
+    # Full-text search over saved conversations
+    search_enabled: bool = True
+    
+    # Long-term memory; off by default as it needs an embedding model on the server
+    memory_enabled: bool = False
+    embedding_model: str = "nomic-embed-text"
+    # Embeddings are truncated to this many dimensions (0 keeps them whole)
+    memory_dim: int = 256
+    memory_top_k: int = 4
+    memory_min_score: float = 0.3
+    memory_batch_size: int = 32
+    
+    # Next-speaker scheduling
+    scheduler_mention_window: int = 6
+    scheduler_idle_candidates: int = 3
+    scheduler_weight_direct: float = 3.0
+    scheduler_weight_mention: float = 1.0
+    scheduler_weight_idle: float = 2.0
+    # Let the model choose between candidates scoring within tie_margin
+    scheduler_llm_tiebreak: bool = False
+    scheduler_tie_margin: float = 0.25
     
     class Config:
         env_file = ".env"
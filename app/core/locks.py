@@ -0,0 +1,35 @@
+"""Per-conversation async locks"""
+
+import asyncio
+import weakref
+
+
+class ConversationLocks:
+    """Hands out one asyncio lock per conversation and scope.
+    
+    Locks are only held around mutations, never while waiting on the model,
+    so requests for different conversations never wait on each other and
+    long generations don't block edits. Unused locks are dropped
+    automatically.
+    """
+    
+    def __init__(self):
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+    
+    def get(self, conversation_id: str, scope: str = "messages") -> asyncio.Lock:
+        """Get the lock for a conversation scope"""
+        key = f"{conversation_id}:{scope}"
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+
+# Global lock registry
+conversation_locks = ConversationLocks()
+
+
+def conversation_lock(conversation_id: str, scope: str = "messages") -> asyncio.Lock:
+    """Get the lock guarding a conversation's mutable state"""
+    return conversation_locks.get(conversation_id, scope)
@@ -3,19 +3,89 @@ AI-Powered Role-Playing Web Application
 Runs entirely locally with open-source AI models
 """
 
-from fastapi import FastAPI
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from app.core.config import settings
 from app.api import router
+from app.services.backends import get_session_log
+from app.services.backends.recording import current_request
+from app.services.circuit_breaker import ModelUnavailable
+from app.services.job_service import job_queue
+from app.services.search_service import search_index
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Refresh the search index in the background on startup; cancel jobs on shutdown"""
+    if settings.search_enabled:
+        task = asyncio.create_task(asyncio.to_thread(search_index.refresh))
+    yield
+    await job_queue.shutdown()
+    if get_session_log():
+        get_session_log().close()
+    if settings.search_enabled:
+        search_index.stop()
+        await asyncio.wait([task])
+
 
 # Initialize FastAPI application
-app = FastAPI(title=settings.app_title)
+app = FastAPI(title=settings.app_title, lifespan=lifespan)
 
 # Include API routes
 app.include_router(router)
 
 
+@app.exception_handler(ModelUnavailable)
+async def model_unavailable(request: Request, exc: ModelUnavailable):
+    """A model call failed or was refused: 503 with the failure, never a stored message"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"{exc}. {exc.hint}".strip(), "error": exc.to_dict()},
+        headers={"Retry-After": str(exc.retry_after or 1)},
+    )
+
+
+async def record_requests(request: Request, call_next):
+    """Log state-changing API requests so a session can be replayed"""
+    log = get_session_log()
+    path = request.url.path
+    if (request.method not in ("POST", "PUT", "DELETE")
+            or not path.startswith("/api/") or path.startswith("/api/jobs")):
+        return await call_next(request)
+    
+    index = log.next_request()
+    at_ms = log.elapsed_ms()
+    body = await request.body()
+    token = current_request.set(index)
+    started = time.monotonic()
+    try:
+        response = await call_next(request)
+    finally:
+        current_request.reset(token)
+    log.write({
+        "type": "request",
+        "index": index,
+        "at_ms": at_ms,
+        "method": request.method,
+        "path": path,
+        "query": request.url.query,
+        "content_type": request.headers.get("content-type"),
+        "body": body.decode("utf-8", errors="replace"),
+        "status": response.status_code,
+        "duration_ms": round((time.monotonic() - started) * 1000, 1),
+    })
+    return response
+
+
+# Recording is opt-in; without LLM_RECORD_PATH requests skip the middleware entirely
+if get_session_log():
+    app.middleware("http")(record_requests)
+
+
 @app.get("/")
 async def root():
     """Serve the main HTML page"""
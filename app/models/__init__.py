@@ -1,14 +1,21 @@
 """Data models for the AI RPG Chat application"""
 
+from .branch import Branch
 from .character import Character
-from .message import Message
+from .message import Message, MessageRecord, new_message_id
 from .scenario import Scenario
+from .usage import GenerationUsage, UsageTotals
 from .conversation import Conversation, ConversationState
 
 __all__ = [
+    "Branch",
     "Character",
     "Message",
+    "MessageRecord",
+    "new_message_id",
     "Scenario",
+    "GenerationUsage",
+    "UsageTotals",
     "Conversation",
     "ConversationState",
 ]
@@ -0,0 +1,54 @@
+"""Branch model"""
+
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
+from datetime import datetime
+
+
+class Branch(BaseModel):
+    id: str
+    name: str
+    # Last message on the branch; the branch is the path from the root to it
+    head_id: Optional[str] = None
+    # Summary i covers messages [i * max_messages_before_summary, (i + 1) * ...)
+    summaries: List[str] = []
+    # One summary of the first `overview_covers` summaries, reduced from them
+    overview: str = ""
+    overview_covers: int = 0
+    # Summaries made from messages that have since changed: index -> conversation
+    # version of the change. They are redone lazily (see summary_service); a redo
+    # only counts if no newer change marked them meanwhile.
+    stale_summaries: Dict[int, int] = {}
+    # Same for the overview; 0 when it is current
+    overview_stale: int = 0
+    created_at: str = Field(default_factory=lambda: datetime.now().isoformat())
+    
+    def keep_summaries(self, count: int):
+        """Drop summaries past the first `count`, and an overview that includes them"""
+        del self.summaries[count:]
+        self.stale_summaries = {i: v for i, v in self.stale_summaries.items() if i < count}
+        if self.overview_covers > count:
+            self.overview = ""
+            self.overview_covers = 0
+            self.overview_stale = 0
+    
+    def fork(self, count: int) -> dict:
+        """Summary fields for a new branch sharing this one's first `count` summaries"""
+        fields = {
+            "summaries": self.summaries[:count],
+            "stale_summaries": {i: v for i, v in self.stale_summaries.items() if i < count},
+        }
+        if self.overview_covers <= count:
+            fields.update(overview=self.overview, overview_covers=self.overview_covers,
+                          overview_stale=self.overview_stale)
+        return fields
+    
+    def mark_stale(self, start: int, stop: Optional[int], version: int):
+        """Mark summaries [start, stop) as outdated by the change made at `version`; None: to the last one"""
+        stop = len(self.summaries) if stop is None else min(stop, len(self.summaries))
+        if start >= stop:
+            return
+        for i in range(start, stop):
+            self.stale_summaries[i] = version
+        if start < self.overview_covers:
+            self.overview_stale = version
@@ -13,3 +13,7 @@ class Character(BaseModel):
     motivations: str = ""
     image_path: Optional[str] = None
     is_narrator: bool = False
+    # Condensed description, personality, speech and motivations used in prompts,
+    # and the hash of the fields it was built from (see persona_service)
+    persona: str = ""
+    persona_key: str = ""
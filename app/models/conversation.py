@@ -1,11 +1,16 @@
 """Conversation and state models"""
 
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import Dict, List, Optional, Set, Union
 from datetime import datetime
+import uuid
+from .branch import Branch
 from .character import Character
-from .message import Message
+from .message import Message, MessageRecord, new_message_id
 from .scenario import Scenario
+from .usage import GenerationUsage, UsageTotals
+
+MAIN_BRANCH = "main"
 
 
 class Conversation(BaseModel):
@@ -13,10 +18,329 @@ class Conversation(BaseModel):
     name: str
     scenario: Scenario
     characters: List[Character]
-    messages: List[Message]
+    # The active branch, root first
+    messages: List[MessageRecord]
+    # Summaries of the active branch
     summaries: List[str] = []
     created_at: str = Field(default_factory=lambda: datetime.now().isoformat())
     updated_at: str = Field(default_factory=lambda: datetime.now().isoformat())
+    # Bumped on every change that affects prompts; used to detect stale generations
+    version: int = 0
+    branches: Dict[str, Branch] = {}
+    active_branch_id: str = MAIN_BRANCH
+    # Model usage spent on this conversation, per task
+    usage: Dict[str, UsageTotals] = {}
+    
+    # Messages form a tree through parent links. Every message record exists
+    # once and is shared by all branches passing through it; only the active
+    # branch is materialized in `messages`. Pass Message or MessageRecord to
+    # the methods below; they store records.
+    # Mutate `characters` and `messages` only through the methods below, which
+    # keep these indexes in sync.
+    _characters_by_id: Dict[str, Character] = PrivateAttr(default_factory=dict)
+    _messages_by_id: Dict[str, MessageRecord] = PrivateAttr(default_factory=dict)
+    _positions: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _parents: Dict[str, Optional[str]] = PrivateAttr(default_factory=dict)
+    # Child ids of each message, oldest first; None holds the roots
+    _children: Dict[Optional[str], List[str]] = PrivateAttr(default_factory=dict)
+    # Message ids added, changed or deleted since the last save
+    _dirty: Set[str] = PrivateAttr(default_factory=set)
+    _deleted: Set[str] = PrivateAttr(default_factory=set)
+    
+    def model_post_init(self, __context) -> None:
+        self._characters_by_id = {c.id: c for c in self.characters}
+        self._messages_by_id = {}
+        self._parents = {}
+        self._children = {}
+        parent = None
+        for message in self.messages:
+            if message.id in self._messages_by_id:
+                # Older saves reused msg_{len} ids after regenerate
+                message.id = new_message_id()
+            self._messages_by_id[message.id] = message
+            self._link(message.id, parent)
+            parent = message.id
+        self._reindex_positions()
+        
+        if self.active_branch_id not in self.branches:
+            self.branches[self.active_branch_id] = Branch(id=self.active_branch_id, name=self.active_branch_id)
+        branch = self.branches[self.active_branch_id]
+        if self.messages:
+            branch.head_id = parent
+        # The active branch and the conversation share one summaries list
+        if self.summaries and not branch.summaries:
+            branch.summaries = self.summaries
+        self.summaries = branch.summaries
+        self._dirty = set(self._messages_by_id)
+        self._deleted = set()
+    
+    @classmethod
+    def from_tree(cls, data: dict, nodes: List[MessageRecord], parents: Dict[str, Optional[str]]) -> "Conversation":
+        """Rebuild a conversation from all of its message nodes and their parent links"""
+        data = {**data, "messages": []}
+        conversation = cls(**data)
+        conversation._messages_by_id = {m.id: m for m in nodes}
+        conversation._parents = {}
+        conversation._children = {}
+        for message_id, parent_id in parents.items():
+            conversation._link(message_id, parent_id)
+        branch = conversation.branches[conversation.active_branch_id]
+        conversation.messages = conversation.path_to(branch.head_id)
+        conversation._reindex_positions()
+        conversation._dirty = set()
+        return conversation
+    
+    def touch(self):
+        """Record a change to the message history or scenario"""
+        self.version += 1
+        self.updated_at = datetime.now().isoformat()
+    
+    def record_usage(self, usage: GenerationUsage):
+        """Add a model call made for this conversation to its usage totals"""
+        self.usage.setdefault(usage.task, UsageTotals()).add(usage)
+    
+    @property
+    def active_branch(self) -> Branch:
+        return self.branches[self.active_branch_id]
+    
+    def get_character(self, character_id: str) -> Optional[Character]:
+        """Look up a character by id"""
+        return self._characters_by_id.get(character_id)
+    
+    def get_message(self, message_id: str) -> Optional[MessageRecord]:
+        """Look up a message by id, on any branch"""
+        return self._messages_by_id.get(message_id)
+    
+    def message_position(self, message_id: str) -> int:
+        """Position of a message in the active branch, or -1"""
+        return self._positions.get(message_id, -1)
+    
+    def parent_of(self, message_id: str) -> Optional[str]:
+        """Id of the message a message follows"""
+        return self._parents.get(message_id)
+    
+    def all_messages(self) -> List[MessageRecord]:
+        """Every message on every branch"""
+        return list(self._messages_by_id.values())
+    
+    def path_to(self, message_id: Optional[str]) -> List[MessageRecord]:
+        """Messages from the root up to and including `message_id`"""
+        # Private attribute lookups are slow on pydantic models; bind them once
+        messages, parents = self._messages_by_id, self._parents
+        path = []
+        while message_id is not None:
+            path.append(messages[message_id])
+            message_id = parents.get(message_id)
+        path.reverse()
+        return path
+    
+    def next_character_id(self) -> str:
+        """An unused id of the form char<n>"""
+        n = len(self.characters)
+        while f"char{n}" in self._characters_by_id:
+            n += 1
+        return f"char{n}"
+    
+    def add_character(self, character: Character):
+        """Add a character to the cast"""
+        if character.id in self._characters_by_id:
+            raise ValueError(f"Duplicate character id: {character.id}")
+        self.characters.append(character)
+        self._characters_by_id[character.id] = character
+    
+    def add_message(self, message: Union[Message, MessageRecord]):
+        """Append a message to the active branch"""
+        message = MessageRecord.of(message)
+        if message.id in self._messages_by_id:
+            raise ValueError(f"Duplicate message id: {message.id}")
+        self._link(message.id, self.messages[-1].id if self.messages else None)
+        self._positions[message.id] = len(self.messages)
+        self.messages.append(message)
+        self._messages_by_id[message.id] = message
+        self.active_branch.head_id = message.id
+        self._dirty.add(message.id)
+    
+    def update_message(self, message_id: str, content: str, reaction: Optional[str] = None) -> MessageRecord:
+        """Change a message in place; every branch sharing it sees the change"""
+        message = self._messages_by_id[message_id]
+        if message.content != content:
+            self._invalidate(message_id, to_end=False)
+        message.content = content
+        if reaction is not None:
+            message.reaction = reaction
+        self._dirty.add(message_id)
+        return message
+    
+    def replace_message(self, message_id: str, message: Union[Message, MessageRecord]) -> Optional[Branch]:
+        """Put a new message in place of one on the active branch.
+        
+        Nothing is discarded: the old message stays in the tree as an
+        alternative to the new one (see `alternatives`), and if messages
+        followed it they stay reachable through a new branch, which is
+        returned. The active branch continues from the new message.
+        """
+        message = MessageRecord.of(message)
+        position = self.message_position(message_id)
+        if position < 0:
+            raise KeyError(message_id)
+        active = self.active_branch
+        continuation = None
+        if position < len(self.messages) - 1:
+            continuation = self._new_branch(f"{active.name} alt", active.head_id,
+                                            active.fork(len(active.summaries)))
+        
+        self._link(message.id, self._parents[message_id])
+        self._messages_by_id[message.id] = message
+        self._dirty.add(message.id)
+        for old in self.messages[position:]:
+            self._positions.pop(old.id, None)
+        del self.messages[position:]
+        self._positions[message.id] = len(self.messages)
+        self.messages.append(message)
+        active.head_id = message.id
+        active.keep_summaries(self._summaries_before(position))
+        return continuation
+    
+    def add_alternative(self, message_id: str, message: Union[Message, MessageRecord]) -> MessageRecord:
+        """Add a message as an alternative to one on the active branch.
+        
+        The new message gets the same parent; the active branch is left as
+        it is. `choose_alternative` puts it on the branch instead.
+        """
+        message = MessageRecord.of(message)
+        if self.message_position(message_id) < 0:
+            raise KeyError(message_id)
+        self._link(message.id, self._parents[message_id])
+        self._messages_by_id[message.id] = message
+        self._dirty.add(message.id)
+        return message
+    
+    def alternatives(self, message_id: str) -> List[MessageRecord]:
+        """Messages with the same parent as a message, itself included, oldest first"""
+        if message_id not in self._messages_by_id:
+            raise KeyError(message_id)
+        return [self._messages_by_id[child_id] for child_id in self._children[self._parents[message_id]]]
+    
+    def choose_alternative(self, message_id: str):
+        """Make an alternative to the active branch's last message its last message instead"""
+        if not self.messages or message_id not in self._messages_by_id:
+            raise KeyError(message_id)
+        last = self.messages[-1]
+        if self._parents[message_id] != self._parents[last.id]:
+            raise ValueError("Not an alternative to the last message")
+        position = len(self.messages) - 1
+        del self._positions[last.id]
+        self.messages[position] = self._messages_by_id[message_id]
+        self._positions[message_id] = position
+        self.active_branch.head_id = message_id
+        self.active_branch.keep_summaries(self._summaries_before(position))
+    
+    def remove_message(self, message_id: str) -> MessageRecord:
+        """Delete a message from the active branch.
+        
+        Its children, on any branch, are attached to its parent instead.
+        """
+        position = self.message_position(message_id)
+        if position < 0:
+            raise KeyError(message_id)
+        # Every later message moves up one place, on every branch through this one
+        self._invalidate(message_id, to_end=True)
+        parent_id = self._parents.pop(message_id)
+        self._children[parent_id].remove(message_id)
+        for child_id in self._children.pop(message_id, []):
+            self._link(child_id, parent_id)
+            self._dirty.add(child_id)
+        for branch in self.branches.values():
+            if branch.head_id == message_id:
+                branch.head_id = parent_id
+        del self._messages_by_id[message_id]
+        del self._positions[message_id]
+        self._dirty.discard(message_id)
+        self._deleted.add(message_id)
+        removed = self.messages.pop(position)
+        # Everything after the removed message moves up one place
+        for i in range(position, len(self.messages)):
+            self._positions[self.messages[i].id] = i
+        return removed
+    
+    def create_branch(self, name: str, from_message_id: Optional[str]) -> Branch:
+        """Start a branch that forks after `from_message_id` (None: empty story)"""
+        if from_message_id is not None and from_message_id not in self._messages_by_id:
+            raise KeyError(from_message_id)
+        # Summaries come from the branch sharing the most messages with the new one, up to where they part
+        shared = self._shared_prefixes(from_message_id)
+        source_id = max(shared, key=lambda branch_id: (shared[branch_id], branch_id == self.active_branch_id))
+        source = self.branches[source_id]
+        return self._new_branch(name, from_message_id, source.fork(self._summaries_before(shared[source_id])))
+    
+    def switch_branch(self, branch_id: str):
+        """Make another branch the active one"""
+        branch = self.branches[branch_id]
+        self.active_branch_id = branch_id
+        self.messages = self.path_to(branch.head_id)
+        self.summaries = branch.summaries
+        self._reindex_positions()
+        self.touch()
+    
+    def take_changes(self) -> tuple[List[str], List[str]]:
+        """Message ids changed and deleted since the last call"""
+        changed, deleted = list(self._dirty), list(self._deleted)
+        self._dirty = set()
+        self._deleted = set()
+        return changed, deleted
+    
+    def _link(self, message_id: str, parent_id: Optional[str]):
+        """Record a new message's parent, in both directions"""
+        self._parents[message_id] = parent_id
+        self._children.setdefault(parent_id, []).append(message_id)
+    
+    def _new_branch(self, name: str, head_id: Optional[str], summaries: dict) -> Branch:
+        """Add a branch; `summaries` holds its summary fields (see Branch.fork)"""
+        branch = Branch(id=f"branch_{uuid.uuid4().hex[:8]}", name=name, head_id=head_id, **summaries)
+        self.branches[branch.id] = branch
+        return branch
+    
+    def _invalidate(self, message_id: str, to_end: bool):
+        """Mark summaries made from a message stale on every branch that includes it.
+        
+        Only the summary covering the message is affected, or with `to_end`
+        that one and every later one.
+        """
+        # Each change gets its own version, so a redo can tell if it was overtaken
+        self.touch()
+        depth = len(self.path_to(message_id))
+        index = self._summaries_before(depth - 1)
+        # A branch includes the message if its path shares the whole path to it
+        for branch_id, shared in self._shared_prefixes(message_id).items():
+            if shared == depth:
+                self.branches[branch_id].mark_stale(index, None if to_end else index + 1, self.version)
+    
+    def _shared_prefixes(self, message_id: Optional[str]) -> Dict[str, int]:
+        """How many messages each branch's path shares with the path to `message_id`, by branch id"""
+        # Messages shared with that path by the path to each node seen so far
+        depths: Dict[Optional[str], int] = {m.id: i + 1 for i, m in enumerate(self.path_to(message_id))}
+        depths[None] = 0
+        parents = self._parents
+        shared = {}
+        for branch in self.branches.values():
+            walked = []
+            node = branch.head_id
+            while node not in depths:
+                walked.append(node)
+                node = parents.get(node)
+            # Branches often share a trunk; later walks stop where this one passed
+            for visited in walked:
+                depths[visited] = depths[node]
+            shared[branch.id] = depths[node]
+        return shared
+    
+    def _summaries_before(self, position: int) -> int:
+        """How many summaries only cover messages before `position`"""
+        from app.core.config import settings
+        return position // settings.max_messages_before_summary
+    
+    def _reindex_positions(self):
+        self._positions = {m.id: i for i, m in enumerate(self.messages)}
 
 
 class ConversationState(BaseModel):
@@ -1,14 +1,140 @@
 """Message model"""
 
 from pydantic import BaseModel, Field
-from typing import Optional
-from datetime import datetime
+from pydantic_core import core_schema
+from typing import Any, Dict, Optional, Tuple, Union
+from datetime import datetime, timedelta
+import uuid
+from .usage import GenerationUsage
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# One shared (character_id, character_name) tuple per speaker
+_speakers: Dict[Tuple[str, str], Tuple[str, str]] = {}
+
+
+def new_message_id() -> str:
+    """Generate a unique message id"""
+    return f"msg_{uuid.uuid4().hex[:12]}"
 
 
 class Message(BaseModel):
-    id: str
+    id: str = Field(default_factory=new_message_id)
     character_id: str
     character_name: str
     content: str
     reaction: Optional[str] = None
     timestamp: str = Field(default_factory=lambda: datetime.now().isoformat())
+    # Tokens and time spent generating this message; None for written messages
+    usage: Optional[GenerationUsage] = None
+
+
+class MessageRecord:
+    """Compact in-memory form of a Message.
+
+    Conversations hold these instead of pydantic models: a slotted object
+    with the speaker interned and the timestamp as integer microseconds
+    takes a fraction of a Message's memory. It has the same read attributes
+    as Message; use `to_message()` to get a Message for API responses.
+    """
+
+    __slots__ = ("id", "speaker", "content", "reaction", "created_us", "usage_values")
+
+    def __init__(self, id: str, speaker: Tuple[str, str], content: str,
+                 reaction: Optional[str] = None, created_us: int = 0,
+                 usage_values: Optional[Tuple] = None):
+        self.id = id
+        self.speaker = speaker
+        self.content = content
+        self.reaction = reaction
+        self.created_us = created_us
+        self.usage_values = usage_values
+
+    @property
+    def character_id(self) -> str:
+        return self.speaker[0]
+
+    @property
+    def character_name(self) -> str:
+        return self.speaker[1]
+
+    @property
+    def timestamp(self) -> str:
+        return (_EPOCH + self.created_us * _MICROSECOND).isoformat()
+
+    @property
+    def usage(self) -> Optional[GenerationUsage]:
+        return GenerationUsage.from_tuple(self.usage_values) if self.usage_values else None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MessageRecord":
+        """Build a record from a Message's fields"""
+        usage = data.get("usage")
+        if isinstance(usage, dict):
+            usage = GenerationUsage(**usage)
+        return cls(
+            data.get("id") or new_message_id(),
+            intern_speaker(data["character_id"], data["character_name"]),
+            data["content"],
+            data.get("reaction"),
+            _to_microseconds(data.get("timestamp")),
+            usage.as_tuple() if usage else None,
+        )
+
+    @classmethod
+    def of(cls, message: Union[Message, "MessageRecord"]) -> "MessageRecord":
+        """Convert a Message; records are returned as they are"""
+        if isinstance(message, MessageRecord):
+            return message
+        return cls.from_dict(message.__dict__)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Fields as Message.model_dump() would give them"""
+        return {
+            "id": self.id,
+            "character_id": self.speaker[0],
+            "character_name": self.speaker[1],
+            "content": self.content,
+            "reaction": self.reaction,
+            "timestamp": self.timestamp,
+            "usage": self.usage.model_dump() if self.usage_values else None,
+        }
+
+    def to_message(self) -> Message:
+        """Pydantic view of the record"""
+        data = self.to_dict()
+        data["usage"] = self.usage
+        return Message.model_construct(**data)
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source, handler) -> core_schema.CoreSchema:
+        # Accept Message objects or dicts, and serialize like a Message
+        return core_schema.no_info_plain_validator_function(
+            lambda value: cls.from_dict(value) if isinstance(value, dict) else cls.of(value),
+            serialization=core_schema.plain_serializer_function_ser_schema(lambda record: record.to_dict()),
+        )
+
+    @classmethod
+    def __get_pydantic_json_schema__(cls, schema, handler):
+        return handler(Message.__pydantic_core_schema__)
+
+    def __repr__(self) -> str:
+        return f"MessageRecord(id={self.id!r}, speaker={self.speaker!r}, content={self.content[:40]!r})"
+
+
+def intern_speaker(character_id: str, character_name: str) -> Tuple[str, str]:
+    """The shared speaker tuple for a character id and name"""
+    key = (character_id, character_name)
+    return _speakers.setdefault(key, key)
+
+
+def _to_microseconds(timestamp: Optional[str]) -> int:
+    """Parse an ISO timestamp into microseconds since the epoch, in local time"""
+    try:
+        moment = datetime.fromisoformat(timestamp) if timestamp else datetime.now()
+    except ValueError:
+        moment = datetime.now()
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return (moment - _EPOCH) // _MICROSECOND
@@ -0,0 +1,66 @@
+"""Token and timing usage of model calls"""
+
+from pydantic import BaseModel
+from typing import Optional, Tuple
+
+
+class GenerationUsage(BaseModel):
+    """Tokens and time spent on one model call.
+
+    Token counts come from the server, or are estimated when it reports
+    none. The server's own timings (model load, prompt evaluation and
+    generation, in milliseconds) are None for servers that don't report
+    them; `total_ms` is always the wall-clock time of the call.
+    """
+    task: str
+    model: Optional[str] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    load_ms: Optional[float] = None
+    prompt_ms: Optional[float] = None
+    eval_ms: Optional[float] = None
+    total_ms: float = 0.0
+
+    def as_tuple(self) -> Tuple:
+        """Compact form kept on message records"""
+        return (self.task, self.model, self.prompt_tokens, self.completion_tokens,
+                self.load_ms, self.prompt_ms, self.eval_ms, self.total_ms)
+
+    @classmethod
+    def from_tuple(cls, values: Tuple) -> "GenerationUsage":
+        return cls.model_construct(**dict(zip(cls.model_fields, values)))
+
+
+class UsageTotals(BaseModel):
+    """Usage summed over the calls made for one task"""
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    load_ms: float = 0.0
+    prompt_ms: float = 0.0
+    eval_ms: float = 0.0
+    total_ms: float = 0.0
+
+    def add(self, usage: GenerationUsage):
+        """Count one call"""
+        self.calls += 1
+        self.prompt_tokens += usage.prompt_tokens
+        self.completion_tokens += usage.completion_tokens
+        self.load_ms += usage.load_ms or 0.0
+        self.prompt_ms += usage.prompt_ms or 0.0
+        self.eval_ms += usage.eval_ms or 0.0
+        self.total_ms += usage.total_ms
+
+    def merge(self, other: "UsageTotals"):
+        """Add another set of totals to these"""
+        for field in type(self).model_fields:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+    def rates(self) -> dict:
+        """Throughput in tokens per second, where the server reported timings"""
+        return {
+            "prompt_tokens_per_second":
+                round(self.prompt_tokens / self.prompt_ms * 1000, 1) if self.prompt_ms else None,
+            "completion_tokens_per_second":
+                round(self.completion_tokens / self.eval_ms * 1000, 1) if self.eval_ms else None,
+        }
@@ -1,100 +1,227 @@
 """AI service for generating responses"""
 
-import ollama
-from typing import Optional
+import asyncio
+import time
+from typing import List, Optional, Tuple
 from app.core.config import settings
-from app.models import Character, Message
+from app.models import Character, GenerationUsage, MessageRecord
 from app.core.state import get_state
-from app.utils.prompt_builder import PromptBuilder
+from app.utils.prompt_builder import PromptBuilder, RECENT_MESSAGES
+from app.utils.generation import build_options, estimate_tokens, get_profile, task_deadline
+from app.utils.response_parser import ResponseParser, SceneParser
+from app.services.metrics import generation_metrics
+from app.services.backends import LLMBackend, create_backend
+from app.services.circuit_breaker import CircuitBreaker, ModelUnavailable, retry_delay
+from app.services.model_router import ModelRouter
+from app.services.memory_service import memory_service
+from app.services.turn_scheduler import turn_scheduler
 
 
 class AIService:
     """Service for AI interactions"""
     
-    def __init__(self, model: str = None):
+    def __init__(self, model: str = None, backend: Optional[LLMBackend] = None):
         self.model = model or settings.ai_model
         self.prompt_builder = PromptBuilder()
+        self.backend = backend or create_backend()
+        self.router = ModelRouter(self.model)
+        self.breaker = CircuitBreaker()
     
-    def get_response(self, prompt: str) -> str:
-        """Get response from local Ollama AI model"""
-        try:
-            response = ollama.chat(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                options={
-                    "temperature": 0.7,
-                    "top_p": 0.9,
-                }
-            )
-            return response["message"]["content"]
-        except Exception as e:
-            return f"[AI Error: {str(e)}. Make sure Ollama is running with: ollama serve]"
+    async def get_response(self, prompt: str, task: str = "dialogue") -> str:
+        """Get response from the local AI model; raises ModelUnavailable on failure"""
+        return (await self.complete(prompt, task))[0]
     
-    async def decide_next_character(self) -> str:
-        """Use AI to decide which character should respond next"""
-        state = get_state()
-        
-        if not state.conversation or not state.conversation.messages:
-            # First message - narrator starts
-            return "narrator"
-        
-        # Get the last character who spoke
-        last_message = state.conversation.messages[-1]
-        last_character_id = last_message.character_id
+    async def complete(self, prompt: str, task: str = "dialogue") -> tuple[str, GenerationUsage]:
+        """Get a response and the tokens and time spent on it"""
+        parser = ResponseParser(is_narrator=True, stop_at_blank_line=False)
+        _, usage = await self._chat(prompt, task, parser)
+        return parser.result()[1], usage
+    
+    async def _chat(self, prompt: str, task: str, parser: ResponseParser,
+                    extra_stop: Optional[List[str]] = None) -> tuple[str, GenerationUsage]:
+        """Stream one chat completion through the parser; returns the raw text and usage.
         
-        print(f"Last character who spoke: {last_character_id} ({last_message.character_name})")
+        Closing the stream as soon as the parser is satisfied, or when the
+        calling task is cancelled, makes the model server abort the request.
+        Token usage, and why generation ended early ("length", "complete" or
+        "repetition"), are recorded in the generation metrics. Servers only
+        report their timings in the final chunk, so a generation the parser
+        ended early has wall-clock time but no server timings.
         
-        # Get all non-narrator characters
-        non_narrator_chars = [c for c in state.conversation.characters if not c.is_narrator]
+        The call, retries included, must finish within the task's deadline.
+        Failures before any output are retried with jittered backoff; when
+        they run out, or output had started, ModelUnavailable is raised.
+        While the circuit breaker is open it is raised without calling the
+        server.
+        """
+        model = self.router.model_for(task)
+        options = build_options(task, prompt, extra_stop)
+        started = time.perf_counter()
+        deadline = time.monotonic() + task_deadline(task)
+        usage = GenerationUsage(task=task, model=model)
+        text = ""
+        chunks = 0
+        generated = 0
+        prompt_tokens = 0
+        stop_reason = None
+        attempt = 0
+        while True:
+            self.breaker.check(task, self.backend.unavailable_hint)
+            try:
+                with self.router.track():
+                    async with asyncio.timeout(deadline - time.monotonic()):
+                        stream = self.backend.astream(model, prompt, options)
+                        try:
+                            async for chunk in stream:
+                                if chunk.text:
+                                    chunks += 1
+                                text += chunk.text
+                                parser.feed(chunk.text)
+                                if parser.should_stop:
+                                    stop_reason = parser.stop_reason
+                                    break
+                                if chunk.done:
+                                    generated = chunk.completion_tokens or 0
+                                    prompt_tokens = chunk.prompt_tokens or 0
+                                    usage.load_ms = chunk.load_ms
+                                    usage.prompt_ms = chunk.prompt_ms
+                                    usage.eval_ms = chunk.eval_ms
+                                    if chunk.done_reason == "length":
+                                        stop_reason = "length"
+                        finally:
+                            await stream.aclose()
+            except asyncio.CancelledError:
+                self.breaker.release()
+                # Each streamed chunk is one token
+                generation_metrics.record_cancelled(task, chunks, get_profile(task).num_predict)
+                raise
+            except Exception as e:
+                self.breaker.record_failure()
+                reason = "timeout" if isinstance(e, TimeoutError) else "error"
+                generation_metrics.record_model_failure(task, reason)
+                delay = retry_delay(attempt)
+                # Output already reached the parser (and maybe the client): don't start over
+                if chunks or attempt >= settings.llm_retries or time.monotonic() + delay >= deadline:
+                    usage.total_ms = (time.perf_counter() - started) * 1000
+                    message = f"Model call timed out after {task_deadline(task):g}s" if reason == "timeout" else str(e)
+                    raise ModelUnavailable(task, reason, message, self.backend.unavailable_hint,
+                                           self.breaker.retry_after() or 1) from e
+                attempt += 1
+                generation_metrics.record_model_failure(task, "retried")
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            break
         
-        # If last speaker was the narrator, pick first non-narrator
-        if last_character_id == "narrator":
-            next_char = non_narrator_chars[0].id if non_narrator_chars else "narrator"
-            print(f"Last was narrator, picking: {next_char}")
-            return next_char
+        usage.total_ms = (time.perf_counter() - started) * 1000
+        usage.completion_tokens = generated or estimate_tokens(text)
+        usage.prompt_tokens = prompt_tokens or estimate_tokens(prompt)
+        reaction, content = parser.result()
+        kept = self._kept_tokens(text, (reaction or "") + content, usage.completion_tokens)
+        generation_metrics.record(task, usage.prompt_tokens, usage.completion_tokens,
+                                  kept, stop_reason, model, usage)
+        return text, usage
+    
+    @staticmethod
+    def _kept_tokens(raw: str, kept: str, generated: int) -> int:
+        """Scale the generated token count by the share of text that was kept"""
+        if not raw:
+            return 0
+        return round(generated * len(kept) / len(raw))
+    
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed a batch of texts with the embedding model"""
+        return await self.backend.embed(settings.embedding_model, texts)
+    
+    def build_prompt(self, character: Character, history: Optional[List[MessageRecord]] = None) -> str:
+        """Build a character prompt, recalling relevant earlier messages"""
+        state = get_state()
+        if not state.conversation:
+            return ""
+        if history is None:
+            history = state.conversation.messages
+        memories = memory_service.recall(state.conversation, history, RECENT_MESSAGES)
+        return self.prompt_builder.build_character_prompt(character, history, memories)
+    
+    def build_scene_prompt(self, turns: int, history: Optional[List[MessageRecord]] = None) -> str:
+        """Build a multi-speaker scene prompt, recalling relevant earlier messages"""
+        state = get_state()
+        if not state.conversation:
+            return ""
+        if history is None:
+            history = state.conversation.messages
+        memories = memory_service.recall(state.conversation, history, RECENT_MESSAGES)
+        return self.prompt_builder.build_scene_prompt(turns, history, memories)
+    
+    async def generate_scene(self, turns: int, prompt: str
+                             ) -> tuple[List[Tuple[Character, Optional[str], str]], GenerationUsage]:
+        """Generate up to `turns` turns by different speakers in one call.
         
-        # Get characters who haven't spoken yet or spoke least recently
-        available_chars = [c for c in non_narrator_chars if c.id != last_character_id]
+        Returns the (character, reaction, text) of each turn that checks out,
+        in order, and the usage of the call. Checking stops at the first turn
+        whose speaker is not in the cast, repeats the previous speaker or does
+        not follow that speaker's format; the turns before it are kept.
+        """
+        parser = SceneParser(turns)
+        _, usage = await self._chat(prompt, "scene", parser)
+        return self._scene_turns(parser.turns()), usage
+    
+    def _scene_turns(self, turns: List[Tuple[str, str]]) -> List[Tuple[Character, Optional[str], str]]:
+        """Match scene turns to the cast and parse each in its speaker's format"""
+        state = get_state()
+        if not state.conversation:
+            return []
+        cast = {c.name.lower(): c for c in state.conversation.characters}
+        valid = []
+        previous = None
+        for name, text in turns:
+            character = cast.get(name.lower())
+            if character is None or character is previous:
+                break
+            if character.is_narrator:
+                if not text or text.startswith(("[", '"')):
+                    break
+                valid.append((character, None, text))
+            else:
+                parser = ResponseParser(is_narrator=False)
+                parser.feed(text)
+                if parser.dialogue is None or not parser.dialogue:
+                    break
+                valid.append((character, parser.reaction, parser.dialogue))
+            previous = character
+        return valid
+    
+    async def decide_next_character(self) -> str:
+        """Decide which character should respond next"""
+        state = get_state()
         
-        if not available_chars:
-            # Only one character exists, use narrator
-            print("Only one character, using narrator")
+        if not state.conversation:
             return "narrator"
         
-        # Simple alternation: pick the first available character that's not the last speaker
-        next_char_id = available_chars[0].id
-        print(f"Picking next character: {next_char_id} (avoiding {last_character_id})")
-        
+        next_char_id = await turn_scheduler.next_speaker(state.conversation)
+        print(f"Picking next character: {next_char_id}")
         return next_char_id
     
-    async def generate_character_response(self, character: Character) -> tuple[Optional[str], str]:
-        """Generate an AI response for a character"""
-        prompt = self.prompt_builder.build_character_prompt(character)
-        ai_response = self.get_response(prompt)
-        return self._parse_response(ai_response, character.is_narrator)
-    
-    def _parse_response(self, response: str, is_narrator: bool) -> tuple[Optional[str], str]:
-        """Parse AI response into reaction and dialogue"""
-        if is_narrator:
-            # Narrator doesn't have reactions, just narrative
-            return None, response.strip()
-        
-        # Try to extract [reaction] "dialogue" format
-        if "[" in response and "]" in response and '"' in response:
-            try:
-                reaction_end = response.index("]")
-                reaction = response[response.index("[") + 1:reaction_end].strip()
-                
-                dialogue_start = response.index('"', reaction_end)
-                dialogue_end = response.rindex('"')
-                dialogue = response[dialogue_start + 1:dialogue_end].strip()
-                
-                return reaction, dialogue
-            except (ValueError, IndexError):
-                pass
+    async def generate_character_response(self, character: Character, prompt: Optional[str] = None
+                                          ) -> tuple[Optional[str], str, GenerationUsage]:
+        """Generate an AI response for a character; returns (reaction, dialogue, usage).
         
-        # Fallback: treat entire response as dialogue
-        return None, response.strip()
+        Generation stops as soon as the parser has the complete response. A
+        prebuilt `prompt` can be passed so it is taken from a consistent snapshot.
+        """
+        if prompt is None:
+            prompt = self.build_prompt(character)
+        task = "narration" if character.is_narrator else "dialogue"
+        parser = ResponseParser(is_narrator=character.is_narrator)
+        _, usage = await self._chat(prompt, task, parser, self._speaker_stops(character))
+        return (*parser.result(), usage)
+    
+    def _speaker_stops(self, character: Character) -> List[str]:
+        """Stop sequences that end generation when the model starts another speaker's line"""
+        state = get_state()
+        if not state.conversation:
+            return []
+        return [f"\n{c.name}:" for c in state.conversation.characters if c.id != character.id]
 
 
 # Singleton instance
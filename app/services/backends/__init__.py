@@ -0,0 +1,59 @@
+"""Language model backends"""
+
+from typing import Optional
+from app.core.config import settings
+from .base import GenerationChunk, GenerationResult, LLMBackend
+from .fake import FakeBackend
+from .ollama_backend import OllamaBackend
+from .openai_backend import OpenAICompatibleBackend
+from .recording import RecordingBackend, ReplayBackend, SessionLog, read_session
+
+# Log of the current session's requests and model calls, when LLM_RECORD_PATH is set
+_session_log: Optional[SessionLog] = None
+
+
+def get_session_log() -> Optional[SessionLog]:
+    """The session log calls are recorded to, or None when recording is off"""
+    global _session_log
+    if _session_log is None and settings.llm_record_path:
+        _session_log = SessionLog(settings.llm_record_path, settings.save_compression)
+    return _session_log
+
+
+def create_backend(name: str = None) -> LLMBackend:
+    """Create the backend selected in settings, replaying or recording if configured"""
+    if settings.llm_replay_path:
+        backend = ReplayBackend(settings.llm_replay_path, settings.llm_replay_speed)
+    else:
+        backend = _server_backend((name or settings.llm_backend).lower())
+    log = get_session_log()
+    return RecordingBackend(backend, log) if log else backend
+
+
+def _server_backend(name: str) -> LLMBackend:
+    if name == "ollama":
+        return OllamaBackend(host=settings.llm_base_url or None)
+    if name == "openai":
+        return OpenAICompatibleBackend(
+            base_url=settings.llm_base_url or "http://localhost:8080",
+            api_key=settings.llm_api_key or None,
+        )
+    if name == "fake":
+        return FakeBackend()
+    raise ValueError(f"Unknown LLM backend: {name}")
+
+
+__all__ = [
+    "GenerationChunk",
+    "GenerationResult",
+    "LLMBackend",
+    "FakeBackend",
+    "OllamaBackend",
+    "OpenAICompatibleBackend",
+    "RecordingBackend",
+    "ReplayBackend",
+    "SessionLog",
+    "read_session",
+    "create_backend",
+    "get_session_log",
+]
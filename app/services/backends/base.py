@@ -0,0 +1,60 @@
+"""Backend interface for language model servers"""
+
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, List, Optional
+from pydantic import BaseModel
+
+
+class ServerTimings(BaseModel):
+    """Time the server reports spending on a generation, in milliseconds"""
+    load_ms: Optional[float] = None
+    prompt_ms: Optional[float] = None
+    eval_ms: Optional[float] = None
+
+
+class GenerationChunk(ServerTimings):
+    """A piece of streamed output. The last chunk has `done` set and carries usage"""
+    text: str = ""
+    done: bool = False
+    done_reason: Optional[str] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+
+
+class GenerationResult(ServerTimings):
+    """A complete, non-streamed generation"""
+    text: str
+    done_reason: Optional[str] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+
+
+class LLMBackend(ABC):
+    """A model server that can generate text and embeddings.
+    
+    `options` always uses Ollama option names (temperature, top_p, num_predict,
+    num_ctx, stop, seed); adapters translate them for their server.
+    """
+    
+    name = "backend"
+    # Shown to the user when the server can't be reached
+    unavailable_hint = "Make sure the model server is running"
+    
+    @abstractmethod
+    def generate(self, model: str, prompt: str, options: dict) -> GenerationResult:
+        """Generate a complete response, blocking"""
+    
+    @abstractmethod
+    async def agenerate(self, model: str, prompt: str, options: dict) -> GenerationResult:
+        """Generate a complete response"""
+    
+    @abstractmethod
+    def astream(self, model: str, prompt: str, options: dict) -> AsyncIterator[GenerationChunk]:
+        """Stream a response chunk by chunk.
+        
+        Closing the iterator early must abort the request on the server.
+        """
+    
+    @abstractmethod
+    async def embed(self, model: str, texts: List[str]) -> List[List[float]]:
+        """Embed a batch of texts"""
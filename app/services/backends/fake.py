@@ -0,0 +1,117 @@
+"""Deterministic in-process backend for tests and benchmarks"""
+
+import asyncio
+import hashlib
+import math
+from typing import AsyncIterator, List, Optional
+from .base import GenerationChunk, GenerationResult, LLMBackend
+
+EMBEDDING_DIM = 64
+
+_REACTIONS = ["nods", "smiles", "frowns", "shrugs", "laughs softly", "raises an eyebrow"]
+_LINES = [
+    "I didn't expect to find you here.",
+    "We should keep moving before it gets dark.",
+    "That's exactly what I was thinking!",
+    "Are you sure about that?",
+    "Tell me everything you know.",
+]
+
+
+class FakeBackend(LLMBackend):
+    """Backend that answers without a model server.
+    
+    Responses are picked from `responses` in order, cycling, or derived from
+    a hash of the prompt, so the same prompt always gets the same answer.
+    Output is streamed one word at a time with `token_delay` seconds between
+    words, and honours `num_predict` and `stop` like a real server.
+    """
+    
+    name = "fake"
+    unavailable_hint = "The fake backend is always available"
+    
+    def __init__(self, responses: Optional[List[str]] = None, token_delay: float = 0.0):
+        self.responses = list(responses or [])
+        self.token_delay = token_delay
+        self.calls = 0
+    
+    def generate(self, model: str, prompt: str, options: dict) -> GenerationResult:
+        tokens, done_reason = self._complete(prompt, options)
+        return GenerationResult(
+            text="".join(tokens),
+            done_reason=done_reason,
+            prompt_tokens=_count_words(prompt),
+            completion_tokens=len(tokens),
+        )
+    
+    async def agenerate(self, model: str, prompt: str, options: dict) -> GenerationResult:
+        result = self.generate(model, prompt, options)
+        if self.token_delay:
+            await asyncio.sleep(self.token_delay * (result.completion_tokens or 0))
+        return result
+    
+    async def astream(self, model: str, prompt: str, options: dict) -> AsyncIterator[GenerationChunk]:
+        tokens, done_reason = self._complete(prompt, options)
+        for token in tokens:
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            yield GenerationChunk(text=token)
+        yield GenerationChunk(
+            done=True,
+            done_reason=done_reason,
+            prompt_tokens=_count_words(prompt),
+            completion_tokens=len(tokens),
+        )
+    
+    async def embed(self, model: str, texts: List[str]) -> List[List[float]]:
+        return [_embed(text) for text in texts]
+    
+    def _complete(self, prompt: str, options: dict) -> tuple[List[str], str]:
+        """Pick the response and cut it like the server would"""
+        self.calls += 1
+        if self.responses:
+            text = self.responses[(self.calls - 1) % len(self.responses)]
+        else:
+            text = _default_response(prompt)
+        
+        for stop in options.get("stop") or []:
+            index = text.find(stop)
+            if index != -1:
+                text = text[:index]
+        
+        # One token per word, keeping the whitespace in front of it
+        tokens = [word if i == 0 else " " + word for i, word in enumerate(text.split(" "))]
+        limit = options.get("num_predict")
+        if limit is not None and 0 <= limit < len(tokens):
+            return tokens[:limit], "length"
+        return tokens, "stop"
+
+
+def _digest(text: str) -> int:
+    """Stable integer hash of a string"""
+    return int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "big")
+
+
+def _default_response(prompt: str) -> str:
+    """Deterministic response in the format the prompt asks for"""
+    seed = _digest(prompt)
+    line = _LINES[seed % len(_LINES)]
+    if "Your narration:" in prompt:
+        return "The wind picks up as the light fades. " + line
+    if "Your response:" in prompt:
+        return f'[{_REACTIONS[seed % len(_REACTIONS)]}] "{line}"'
+    return line
+
+
+def _count_words(text: str) -> int:
+    return len(text.split())
+
+
+def _embed(text: str) -> List[float]:
+    """Hashed bag-of-words embedding, L2-normalized"""
+    vector = [0.0] * EMBEDDING_DIM
+    for word in text.lower().split():
+        digest = _digest(word)
+        vector[digest % EMBEDDING_DIM] += 1.0 if (digest >> 32) & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
@@ -0,0 +1,72 @@
+"""Ollama backend"""
+
+from typing import AsyncIterator, List, Optional
+import ollama
+from .base import GenerationChunk, GenerationResult, LLMBackend
+
+
+class OllamaBackend(LLMBackend):
+    """Backend for a local Ollama server"""
+    
+    name = "ollama"
+    unavailable_hint = "Make sure Ollama is running with: ollama serve"
+    
+    def __init__(self, host: Optional[str] = None):
+        self.client = ollama.Client(host=host)
+        self.async_client = ollama.AsyncClient(host=host)
+    
+    def generate(self, model: str, prompt: str, options: dict) -> GenerationResult:
+        response = self.client.chat(model=model, messages=_messages(prompt), options=options)
+        return _result(response)
+    
+    async def agenerate(self, model: str, prompt: str, options: dict) -> GenerationResult:
+        response = await self.async_client.chat(model=model, messages=_messages(prompt), options=options)
+        return _result(response)
+    
+    async def astream(self, model: str, prompt: str, options: dict) -> AsyncIterator[GenerationChunk]:
+        stream = await self.async_client.chat(
+            model=model, messages=_messages(prompt), options=options, stream=True
+        )
+        try:
+            async for part in stream:
+                yield GenerationChunk(
+                    text=part["message"]["content"],
+                    done=bool(part.get("done")),
+                    done_reason=part.get("done_reason"),
+                    prompt_tokens=part.get("prompt_eval_count"),
+                    completion_tokens=part.get("eval_count"),
+                    **_timings(part),
+                )
+        finally:
+            # Closing the HTTP stream makes Ollama stop generating
+            await stream.aclose()
+    
+    async def embed(self, model: str, texts: List[str]) -> List[List[float]]:
+        response = await self.async_client.embed(model=model, input=texts)
+        return [list(vector) for vector in response["embeddings"]]
+
+
+def _messages(prompt: str) -> list:
+    """Wrap a prompt as a single user message"""
+    return [{"role": "user", "content": prompt}]
+
+
+def _result(response) -> GenerationResult:
+    """Convert an Ollama chat response"""
+    return GenerationResult(
+        text=response["message"]["content"],
+        done_reason=response.get("done_reason"),
+        prompt_tokens=response.get("prompt_eval_count"),
+        completion_tokens=response.get("eval_count"),
+        **_timings(response),
+    )
+
+
+def _timings(response) -> dict:
+    """Ollama's nanosecond durations as milliseconds"""
+    durations = {
+        "load_ms": response.get("load_duration"),
+        "prompt_ms": response.get("prompt_eval_duration"),
+        "eval_ms": response.get("eval_duration"),
+    }
+    return {key: value / 1e6 for key, value in durations.items() if value is not None}
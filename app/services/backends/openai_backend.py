@@ -0,0 +1,113 @@
+"""Backend for OpenAI-compatible HTTP servers (llama.cpp server, vLLM, ...)"""
+
+import json
+from typing import AsyncIterator, List, Optional
+import httpx
+from .base import GenerationChunk, GenerationResult, LLMBackend
+
+# Generous read timeout: local servers can take a while to load a model
+TIMEOUT = httpx.Timeout(10.0, read=300.0)
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    """Backend speaking the /v1/chat/completions and /v1/embeddings protocol"""
+    
+    name = "openai"
+    unavailable_hint = "Make sure the OpenAI-compatible server is running"
+    
+    def __init__(self, base_url: str, api_key: Optional[str] = None):
+        base_url = base_url.rstrip("/")
+        if not base_url.endswith("/v1"):
+            base_url += "/v1"
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.client = httpx.Client(base_url=base_url, headers=headers, timeout=TIMEOUT)
+        self.async_client = httpx.AsyncClient(base_url=base_url, headers=headers, timeout=TIMEOUT)
+    
+    def generate(self, model: str, prompt: str, options: dict) -> GenerationResult:
+        response = self.client.post("/chat/completions", json=_payload(model, prompt, options))
+        response.raise_for_status()
+        return _result(response.json())
+    
+    async def agenerate(self, model: str, prompt: str, options: dict) -> GenerationResult:
+        response = await self.async_client.post("/chat/completions", json=_payload(model, prompt, options))
+        response.raise_for_status()
+        return _result(response.json())
+    
+    async def astream(self, model: str, prompt: str, options: dict) -> AsyncIterator[GenerationChunk]:
+        payload = _payload(model, prompt, options)
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
+        done_reason = None
+        # Leaving the `async with` closes the connection, which aborts generation
+        async with self.async_client.stream("POST", "/chat/completions", json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                event = json.loads(data)
+                choices = event.get("choices") or []
+                if choices:
+                    text = (choices[0].get("delta") or {}).get("content") or ""
+                    done_reason = choices[0].get("finish_reason") or done_reason
+                    if text:
+                        yield GenerationChunk(text=text)
+                usage = event.get("usage")
+                if usage:
+                    yield GenerationChunk(
+                        done=True,
+                        done_reason=done_reason,
+                        prompt_tokens=usage.get("prompt_tokens"),
+                        completion_tokens=usage.get("completion_tokens"),
+                        **_timings(event),
+                    )
+                    return
+        yield GenerationChunk(done=True, done_reason=done_reason)
+    
+    async def embed(self, model: str, texts: List[str]) -> List[List[float]]:
+        response = await self.async_client.post("/embeddings", json={"model": model, "input": texts})
+        response.raise_for_status()
+        data = sorted(response.json()["data"], key=lambda item: item["index"])
+        return [item["embedding"] for item in data]
+
+
+def _payload(model: str, prompt: str, options: dict) -> dict:
+    """Translate Ollama-style options into a chat completions request"""
+    payload = {"model": model, "messages": [{"role": "user", "content": prompt}]}
+    if "temperature" in options:
+        payload["temperature"] = options["temperature"]
+    if "top_p" in options:
+        payload["top_p"] = options["top_p"]
+    if "num_predict" in options:
+        payload["max_tokens"] = options["num_predict"]
+    if options.get("stop"):
+        payload["stop"] = options["stop"]
+    if "seed" in options:
+        payload["seed"] = options["seed"]
+    # num_ctx is fixed when an OpenAI-compatible server starts; nothing to send
+    return payload
+
+
+def _result(body: dict) -> GenerationResult:
+    """Convert a chat completions response"""
+    choice = body["choices"][0]
+    usage = body.get("usage") or {}
+    return GenerationResult(
+        text=choice["message"]["content"] or "",
+        done_reason=choice.get("finish_reason"),
+        prompt_tokens=usage.get("prompt_tokens"),
+        completion_tokens=usage.get("completion_tokens"),
+        **_timings(body),
+    )
+
+
+def _timings(body: dict) -> dict:
+    """Server timings, for servers that report them (llama.cpp adds a `timings` object)"""
+    timings = body.get("timings") or {}
+    return {
+        key: timings[name]
+        for key, name in (("prompt_ms", "prompt_ms"), ("eval_ms", "predicted_ms"))
+        if timings.get(name) is not None
+    }
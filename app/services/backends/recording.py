@@ -0,0 +1,267 @@
+"""Recording model calls and replaying them without a model server"""
+
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import AsyncIterator, Deque, Dict, Iterator, List, Optional
+from app.utils.frames import get_codec, iter_frames, read_header, write_frame, write_header
+from .base import GenerationChunk, GenerationResult, LLMBackend
+
+# Index of the API request a model call is made for, set by the recording middleware
+current_request: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("current_request", default=None)
+
+
+class SessionLog:
+    """Append-only log of a session's API requests and model calls.
+
+    Each record is one compressed frame (see app.utils.frames) holding a
+    JSON object: `{"type": "request", ...}` for a state-changing API call
+    and `{"type": "call", ...}` for a model call, with the prompt, options,
+    output, token counts and the time each chunk arrived. Records are
+    written as they happen, so an interrupted session keeps everything up
+    to its last call.
+    """
+
+    def __init__(self, path: str, compression: str = "gzip"):
+        self.path = path
+        self._codec = get_codec(compression)
+        self._lock = threading.Lock()
+        self._file = None
+        self._started = time.monotonic()
+        self._requests = 0
+
+    def next_request(self) -> int:
+        """Number the next recorded API request"""
+        with self._lock:
+            self._requests += 1
+            return self._requests
+
+    def elapsed_ms(self) -> float:
+        """Milliseconds since the session started"""
+        return round((time.monotonic() - self._started) * 1000, 1)
+
+    def write(self, record: dict):
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "ab+")
+                if self._file.tell() == 0:
+                    write_header(self._file, self._codec)
+                else:
+                    self._file.seek(0)
+                    self._codec = read_header(self._file)
+                    self._file.seek(0, os.SEEK_END)
+            write_frame(self._file, self._codec, json.dumps(record, ensure_ascii=False).encode("utf-8"))
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+def read_session(path: str) -> Iterator[dict]:
+    """Stream the records of a session log"""
+    with open(path, "rb") as f:
+        codec = read_header(f)
+        for _, frame in iter_frames(f, codec):
+            yield json.loads(frame)
+
+
+class RecordingBackend(LLMBackend):
+    """Backend wrapper that logs every call made through it to a SessionLog"""
+
+    def __init__(self, inner: LLMBackend, log: SessionLog):
+        self.inner = inner
+        self.log = log
+        self.name = inner.name
+        self.unavailable_hint = inner.unavailable_hint
+
+    def generate(self, model: str, prompt: str, options: dict) -> GenerationResult:
+        started = time.monotonic()
+        result = self.inner.generate(model, prompt, options)
+        self._record_result("generate", model, prompt, options, result, started)
+        return result
+
+    async def agenerate(self, model: str, prompt: str, options: dict) -> GenerationResult:
+        started = time.monotonic()
+        result = await self.inner.agenerate(model, prompt, options)
+        self._record_result("generate", model, prompt, options, result, started)
+        return result
+
+    async def astream(self, model: str, prompt: str, options: dict) -> AsyncIterator[GenerationChunk]:
+        started = time.monotonic()
+        chunks: List[str] = []
+        offsets: List[float] = []
+        final: Optional[GenerationChunk] = None
+        stream = self.inner.astream(model, prompt, options)
+        try:
+            async for chunk in stream:
+                if chunk.text:
+                    chunks.append(chunk.text)
+                    offsets.append(_since(started))
+                if chunk.done:
+                    final = chunk
+                yield chunk
+        finally:
+            await stream.aclose()
+            # Streams closed early are recorded too; `done` tells them apart
+            self._record("stream", model, prompt, options, started, {
+                "chunks": chunks,
+                "offsets_ms": offsets,
+                "done": final is not None,
+                "done_reason": final.done_reason if final else None,
+                "prompt_tokens": final.prompt_tokens if final else None,
+                "completion_tokens": final.completion_tokens if final else None,
+                "timings": _timings(final),
+            })
+
+    async def embed(self, model: str, texts: List[str]) -> List[List[float]]:
+        started = time.monotonic()
+        vectors = await self.inner.embed(model, texts)
+        self._record("embed", model, "\n".join(texts), {}, started, {
+            "texts": len(texts),
+            "vectors": [[round(v, 5) for v in vector] for vector in vectors],
+        })
+        return vectors
+
+    def _record_result(self, kind: str, model: str, prompt: str, options: dict,
+                       result: GenerationResult, started: float):
+        self._record(kind, model, prompt, options, started, {
+            "chunks": [result.text],
+            "offsets_ms": [_since(started)],
+            "done": True,
+            "done_reason": result.done_reason,
+            "prompt_tokens": result.prompt_tokens,
+            "completion_tokens": result.completion_tokens,
+            "timings": _timings(result),
+        })
+
+    def _record(self, kind: str, model: str, prompt: str, options: dict, started: float, output: dict):
+        self.log.write({
+            "type": "call",
+            "kind": kind,
+            "request": current_request.get(),
+            "at_ms": self.log.elapsed_ms(),
+            "model": model,
+            "key": call_key(kind, model, prompt),
+            "prompt": prompt,
+            "prompt_chars": len(prompt),
+            "options": options,
+            "total_ms": _since(started),
+            **output,
+        })
+
+
+class ReplayBackend(LLMBackend):
+    """Backend that answers from a session log instead of a model server.
+
+    A call gets the recorded response to the same model and prompt. When the
+    prompt has changed (a new build builds prompts differently), the next
+    unused recording of the same kind is served instead and counted as a
+    miss. Chunks are delivered at their recorded times divided by `speed`:
+    1.0 reproduces the original latency, 2.0 halves it and 0 serves
+    everything at once.
+    """
+
+    name = "replay"
+    unavailable_hint = "The session log has no recording for this call"
+
+    def __init__(self, path: str, speed: float = 1.0):
+        self.path = path
+        self.speed = speed
+        self._by_key: Dict[str, Deque[dict]] = defaultdict(deque)
+        self._in_order: Dict[str, Deque[dict]] = defaultdict(deque)
+        for record in read_session(path):
+            if record["type"] == "call":
+                self._by_key[record["key"]].append(record)
+                self._in_order[record["kind"]].append(record)
+        self._used = set()
+        self.hits = 0
+        self.misses = 0
+
+    def generate(self, model: str, prompt: str, options: dict) -> GenerationResult:
+        return self._result(self._take("generate", model, prompt))
+
+    async def agenerate(self, model: str, prompt: str, options: dict) -> GenerationResult:
+        record = self._take("generate", model, prompt)
+        await self._sleep(record["total_ms"])
+        return self._result(record)
+
+    async def astream(self, model: str, prompt: str, options: dict) -> AsyncIterator[GenerationChunk]:
+        record = self._take("stream", model, prompt)
+        previous = 0.0
+        for text, offset in zip(record["chunks"], record["offsets_ms"]):
+            await self._sleep(offset - previous)
+            previous = offset
+            yield GenerationChunk(text=text)
+        await self._sleep(record["total_ms"] - previous)
+        yield GenerationChunk(
+            done=True,
+            done_reason=record.get("done_reason") or "stop",
+            prompt_tokens=record.get("prompt_tokens"),
+            completion_tokens=record.get("completion_tokens"),
+            **(record.get("timings") or {}),
+        )
+
+    async def embed(self, model: str, texts: List[str]) -> List[List[float]]:
+        record = self._take("embed", model, "\n".join(texts))
+        await self._sleep(record["total_ms"])
+        vectors = record["vectors"]
+        if len(vectors) != len(texts):
+            raise RuntimeError("Recorded embedding batch does not match the request")
+        return vectors
+
+    def _take(self, kind: str, model: str, prompt: str) -> dict:
+        """The recording to serve for a call"""
+        candidates = self._by_key.get(call_key(kind, model, prompt))
+        while candidates:
+            record = candidates.popleft()
+            if id(record) not in self._used:
+                self.hits += 1
+                self._used.add(id(record))
+                return record
+        queue = self._in_order[kind]
+        while queue:
+            record = queue.popleft()
+            if id(record) not in self._used:
+                self.misses += 1
+                self._used.add(id(record))
+                return record
+        raise RuntimeError(f"No recorded {kind} calls left to replay")
+
+    async def _sleep(self, ms: float):
+        if self.speed > 0 and ms > 0:
+            await asyncio.sleep(ms / 1000 / self.speed)
+
+    @staticmethod
+    def _result(record: dict) -> GenerationResult:
+        return GenerationResult(
+            text="".join(record["chunks"]),
+            done_reason=record.get("done_reason"),
+            prompt_tokens=record.get("prompt_tokens"),
+            completion_tokens=record.get("completion_tokens"),
+            **(record.get("timings") or {}),
+        )
+
+
+def call_key(kind: str, model: str, prompt: str) -> str:
+    """Identifies calls that should get the same recorded answer"""
+    return hashlib.blake2b(f"{kind}\x00{model}\x00{prompt}".encode("utf-8"), digest_size=12).hexdigest()
+
+
+def _since(started: float) -> float:
+    return round((time.monotonic() - started) * 1000, 1)
+
+
+def _timings(result) -> Optional[dict]:
+    """Server timings of a result or final chunk, if it has any"""
+    if result is None:
+        return None
+    timings = {key: getattr(result, key) for key in ("load_ms", "prompt_ms", "eval_ms")}
+    return {key: value for key, value in timings.items() if value is not None} or None
@@ -0,0 +1,100 @@
+"""Failure handling for model calls: structured errors, retry backoff and a circuit breaker"""
+
+import math
+import random
+import time
+from app.core.config import settings
+
+# Circuit states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ModelUnavailable(Exception):
+    """A model call failed, ran past its deadline, or was refused while the backend is unhealthy.
+
+    Raised instead of returning error text, so failures never end up stored
+    as messages or summaries. `reason` is "error", "timeout" or
+    "circuit_open"; `retry_after` is a hint in whole seconds.
+    """
+
+    def __init__(self, task: str, reason: str, message: str, hint: str = "", retry_after: int = 0):
+        super().__init__(message)
+        self.task = task
+        self.reason = reason
+        self.hint = hint
+        self.retry_after = retry_after
+
+    def to_dict(self) -> dict:
+        return {
+            "task": self.task,
+            "reason": self.reason,
+            "message": str(self),
+            "hint": self.hint,
+            "retry_after": self.retry_after,
+        }
+
+
+class CircuitBreaker:
+    """Fails model calls at once while the backend is unhealthy.
+
+    After `circuit_failure_threshold` failed calls in a row the circuit
+    opens and calls are refused without reaching the backend. Once
+    `circuit_reset_seconds` have passed one call is let through as a probe:
+    if it succeeds the circuit closes, otherwise it opens again.
+    """
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def check(self, task: str, hint: str = ""):
+        """Let a call through, or raise ModelUnavailable while the circuit is open"""
+        if self.state == CLOSED:
+            return
+        wait = self.opened_at + settings.circuit_reset_seconds - time.monotonic()
+        if self.state == OPEN and wait <= 0:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return
+        raise ModelUnavailable(task, "circuit_open",
+                               f"Model server unavailable after {self.failures} failed calls",
+                               hint, max(1, math.ceil(wait)))
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == HALF_OPEN or self.failures >= settings.circuit_failure_threshold:
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """End a call that neither succeeded nor failed, e.g. one that was cancelled"""
+        self._probing = False
+
+    def retry_after(self) -> int:
+        """Seconds until the circuit lets a call through again; 0 if it does now"""
+        if self.state != OPEN:
+            return 0
+        return max(0, math.ceil(self.opened_at + settings.circuit_reset_seconds - time.monotonic()))
+
+    def describe(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_after": self.retry_after(),
+        }
+
+
+def retry_delay(attempt: int) -> float:
+    """Random wait before retry number `attempt` (from 0): full jitter over an exponential cap"""
+    return random.uniform(0, settings.llm_retry_backoff * 2 ** attempt)
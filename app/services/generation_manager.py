@@ -0,0 +1,102 @@
+"""Cancellable generation tasks keyed by conversation slot"""
+
+import asyncio
+from typing import Awaitable, Dict, Optional, TypeVar
+from fastapi import Request
+from app.services.metrics import generation_metrics
+
+T = TypeVar("T")
+
+# How often to check whether the client is still connected
+DISCONNECT_POLL_SECONDS = 0.5
+
+
+class GenerationCancelled(Exception):
+    """Raised when a generation was cancelled before it finished"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Generation cancelled: {reason}")
+        self.reason = reason
+
+
+class GenerationManager:
+    """Runs model generations as tasks that can be cancelled.
+
+    Each generation occupies a slot such as "<conversation_id>:turn". Starting
+    a new generation in an occupied slot supersedes the old one, and a
+    generation is cancelled when the client that requested it disconnects.
+    """
+
+    def __init__(self):
+        self._slots: Dict[str, asyncio.Task] = {}
+        self._reasons: Dict[asyncio.Task, str] = {}
+
+    @staticmethod
+    def slot_for(conversation_id: str, name: str = "turn") -> str:
+        """Build the slot key for a conversation"""
+        return f"{conversation_id}:{name}"
+
+    async def run(self, slot: str, coro: Awaitable[T], request: Optional[Request] = None) -> T:
+        """Run a generation in a slot, superseding whatever is already running there"""
+        previous = self._slots.get(slot)
+        if previous and not previous.done():
+            self._cancel(previous, "superseded")
+            # Let the old task unwind (and undo its changes) before starting
+            await asyncio.wait([previous])
+
+        task = asyncio.ensure_future(coro)
+        self._slots[slot] = task
+        watcher = asyncio.create_task(self._watch_disconnect(request, task)) if request else None
+        try:
+            return await task
+        except asyncio.CancelledError:
+            current = asyncio.current_task()
+            if current and current.cancelling():
+                # The request handler itself is being cancelled
+                self._cancel(task, "disconnected")
+                raise
+            raise GenerationCancelled(self._reasons.get(task, "cancelled")) from None
+        finally:
+            if watcher:
+                watcher.cancel()
+            self._reasons.pop(task, None)
+            if self._slots.get(slot) is task:
+                del self._slots[slot]
+
+    def cancel(self, slot: str, reason: str = "cancelled") -> bool:
+        """Cancel the generation running in a slot"""
+        task = self._slots.get(slot)
+        if not task or task.done():
+            return False
+        self._cancel(task, reason)
+        return True
+
+    def cancel_conversation(self, conversation_id: str, reason: str = "conversation_closed") -> int:
+        """Cancel every generation belonging to a conversation"""
+        prefix = f"{conversation_id}:"
+        slots = [slot for slot in self._slots if slot.startswith(prefix)]
+        return sum(self.cancel(slot, reason) for slot in slots)
+
+    def active_slots(self) -> list:
+        """List slots with a generation in flight"""
+        return [slot for slot, task in self._slots.items() if not task.done()]
+
+    def _cancel(self, task: asyncio.Task, reason: str):
+        """Cancel a task and record why"""
+        if task.done() or task in self._reasons:
+            return
+        self._reasons[task] = reason
+        generation_metrics.record_cancel_reason(reason)
+        task.cancel()
+
+    async def _watch_disconnect(self, request: Request, task: asyncio.Task):
+        """Cancel the task if the client goes away before it finishes"""
+        while not task.done():
+            if await request.is_disconnected():
+                self._cancel(task, "disconnected")
+                return
+            await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+
+# Singleton instance
+generation_manager = GenerationManager()
@@ -0,0 +1,77 @@
+"""Idempotency keys and single-flight collapsing for model-backed requests"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Tuple
+from app.core.config import settings
+from app.services.metrics import generation_metrics
+
+# Upper bound on remembered results, regardless of TTL
+MAX_CACHED_RESULTS = 1024
+
+
+class IdempotencyCache:
+    """Collapses duplicate requests onto one piece of work.
+    
+    Concurrent requests with the same key share the in-flight result instead
+    of starting their own generation. Completed results are kept for a short
+    window so client retries with the same key get the same answer back.
+    Failures are shared with concurrent waiters but never cached.
+    """
+    
+    def __init__(self, ttl_seconds: float = None):
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else settings.idempotency_ttl_seconds
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._results: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+    
+    async def run(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Run `factory` once per key, sharing or replaying its result"""
+        self._evict()
+        
+        cached = self._results.get(key)
+        if cached is not None:
+            generation_metrics.record_deduplicated("replayed")
+            return cached[1]
+        
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            generation_metrics.record_deduplicated("collapsed")
+            # Shield so a follower disconnecting does not cancel the leader's work
+            return await asyncio.shield(inflight)
+        
+        future = asyncio.get_running_loop().create_future()
+        # Nobody may be waiting on the future; don't warn about unretrieved errors
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        try:
+            result = await factory()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            self._results[key] = (time.monotonic() + self.ttl_seconds, result)
+            return result
+        finally:
+            del self._inflight[key]
+    
+    def clear(self):
+        """Forget completed results, e.g. once the state they were made from is gone"""
+        self._results.clear()
+    
+    def _evict(self):
+        """Drop expired results, oldest first"""
+        now = time.monotonic()
+        while self._results:
+            key, (expires_at, _) = next(iter(self._results.items()))
+            if expires_at > now and len(self._results) <= MAX_CACHED_RESULTS:
+                break
+            del self._results[key]
+
+
+# Singleton instance
+idempotency_cache = IdempotencyCache()
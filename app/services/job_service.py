@@ -0,0 +1,194 @@
+"""Background jobs for slow, AI-assisted operations"""
+
+import asyncio
+import contextvars
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+from fastapi import HTTPException
+from pydantic import BaseModel, Field
+from app.core.config import settings
+from app.services.circuit_breaker import ModelUnavailable
+
+# Job states; the last three are final
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+# The job the current task is running for
+_current_job: contextvars.ContextVar[Optional["Job"]] = contextvars.ContextVar("current_job", default=None)
+
+
+class JobQueueFull(Exception):
+    """Raised when too many jobs are already waiting"""
+
+
+class Job(BaseModel):
+    """A unit of background work and its outcome"""
+    id: str = Field(default_factory=lambda: f"job_{uuid.uuid4().hex[:12]}")
+    kind: str
+    status: str = QUEUED
+    created_at: str = Field(default_factory=lambda: datetime.now().isoformat())
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    # Set by the work itself through JobQueue.report_progress
+    progress: Optional[Dict[str, Any]] = None
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    # HTTP status the work would have failed with if run in the request
+    error_status: Optional[int] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+
+class JobQueue:
+    """Runs submitted coroutines in the background, a bounded number at a time.
+
+    `submit()` returns a queued Job at once; at most `job_workers` jobs run
+    concurrently and the rest wait their turn. Clients poll `get()`, wait on
+    `wait()` or follow `subscribe()` for state changes. Job state lives in
+    memory only: finished jobs are dropped `job_ttl_seconds` after they end.
+    """
+
+    def __init__(self, workers: int = None, ttl_seconds: float = None, max_pending: int = None):
+        self.workers = workers or settings.job_workers
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else settings.job_ttl_seconds
+        self.max_pending = max_pending or settings.job_max_pending
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._jobs: Dict[str, Job] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # Set and replaced whenever a job changes state
+        self._changed: Dict[str, asyncio.Event] = {}
+        # Finished job ids with their expiry, oldest first
+        self._expiry: "OrderedDict[str, float]" = OrderedDict()
+
+    def submit(self, kind: str, factory: Callable[[], Awaitable[Any]]) -> Job:
+        """Queue `factory()` to run in the background"""
+        self._evict()
+        if len(self._tasks) >= self.max_pending:
+            raise JobQueueFull(f"{len(self._tasks)} jobs are already queued or running")
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+        job = Job(kind=kind)
+        self._jobs[job.id] = job
+        self._changed[job.id] = asyncio.Event()
+        task = asyncio.create_task(self._run(job, factory))
+        task.add_done_callback(lambda task: self._finish(job, task))
+        self._tasks[job.id] = task
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Look up a job that has not expired"""
+        self._evict()
+        return self._jobs.get(job_id)
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Job]:
+        """The job once it finishes, or as it is when `timeout` runs out"""
+        job = self.get(job_id)
+        deadline = time.monotonic() + timeout
+        while job and not job.finished:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._changed[job_id].wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        return job
+
+    async def subscribe(self, job_id: str) -> AsyncIterator[Job]:
+        """Yield the job now and after each state change, ending once it finishes"""
+        job = self.get(job_id)
+        while job:
+            changed = self._changed[job_id]
+            yield job
+            if job.finished:
+                return
+            await changed.wait()
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job"""
+        task = self._tasks.get(job_id)
+        if not task or task.done():
+            return False
+        task.cancel()
+        return True
+
+    def report_progress(self, **progress):
+        """Update the progress of the job the caller is running in; does nothing outside a job"""
+        job = _current_job.get()
+        if job is not None and not job.finished:
+            job.progress = progress
+            self._notify(job)
+
+    def list(self) -> list:
+        """All jobs that have not expired, newest first"""
+        self._evict()
+        return sorted(self._jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    async def shutdown(self):
+        """Cancel every unfinished job and wait for them to end"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
+
+    async def _run(self, job: Job, factory: Callable[[], Awaitable[Any]]):
+        _current_job.set(job)
+        async with self._semaphore:
+            job.status = RUNNING
+            job.started_at = datetime.now().isoformat()
+            self._notify(job)
+            try:
+                job.result = await factory()
+                job.status = SUCCEEDED
+            except HTTPException as e:
+                job.status = FAILED
+                job.error = str(e.detail)
+                job.error_status = e.status_code
+            except ModelUnavailable as e:
+                job.status = FAILED
+                job.error = str(e)
+                job.error_status = 503
+            except Exception as e:
+                job.status = FAILED
+                job.error = str(e)
+                job.error_status = 500
+
+    def _finish(self, job: Job, task: asyncio.Task):
+        """Record a job's end; a done callback, so it also runs for jobs cancelled before starting"""
+        if task.cancelled():
+            job.status = CANCELLED
+        job.finished_at = datetime.now().isoformat()
+        del self._tasks[job.id]
+        self._expiry[job.id] = time.monotonic() + self.ttl_seconds
+        self._notify(job)
+
+    def _notify(self, job: Job):
+        """Wake everyone waiting on a job's next state change"""
+        self._changed[job.id].set()
+        if not job.finished:
+            self._changed[job.id] = asyncio.Event()
+
+    def _evict(self):
+        """Drop finished jobs whose TTL has passed"""
+        now = time.monotonic()
+        while self._expiry:
+            job_id, expires_at = next(iter(self._expiry.items()))
+            if expires_at > now:
+                break
+            del self._expiry[job_id]
+            self._jobs.pop(job_id, None)
+            self._changed.pop(job_id, None)
+
+
+# Singleton instance
+job_queue = JobQueue()
@@ -0,0 +1,230 @@
+"""Semantic long-term memory over past messages"""
+
+import asyncio
+import os
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+import numpy as np
+from app.core.config import settings
+from app.models import Conversation, MessageRecord
+
+# Initial row capacity of an index; grows by doubling
+INITIAL_CAPACITY = 256
+
+
+class MemoryIndex:
+    """Normalized embedding vectors for one conversation's messages.
+
+    Rows live in one preallocated float32 matrix that grows by doubling, so
+    appends are amortized O(1) and a search is a single matrix-vector product.
+    """
+
+    def __init__(self, dim: int = 0):
+        self._reset(dim)
+    
+    def _reset(self, dim: int):
+        """Drop all rows and switch to a new dimension"""
+        self.dim = dim
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.vectors = np.zeros((INITIAL_CAPACITY, dim), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, message_id: str) -> bool:
+        return message_id in self.rows
+
+    def add(self, message_ids: List[str], vectors: np.ndarray):
+        """Add or replace vectors for a batch of messages"""
+        vectors = _normalize(vectors)
+        if self.dim != vectors.shape[1]:
+            # Embedding model or dimension changed: start over
+            self._reset(vectors.shape[1])
+        for message_id, vector in zip(message_ids, vectors):
+            row = self.rows.get(message_id)
+            if row is None:
+                row = len(self.ids)
+                if row == len(self.vectors):
+                    self.vectors = np.concatenate([self.vectors, np.zeros_like(self.vectors)])
+                self.ids.append(message_id)
+                self.rows[message_id] = row
+            self.vectors[row] = vector
+
+    def discard(self, message_id: str):
+        """Remove a message's vector by moving the last row into its place"""
+        row = self.rows.pop(message_id, None)
+        if row is None:
+            return
+        last_id = self.ids.pop()
+        if last_id != message_id:
+            self.ids[row] = last_id
+            self.rows[last_id] = row
+            self.vectors[row] = self.vectors[len(self.ids)]
+
+    def vector(self, message_id: str) -> Optional[np.ndarray]:
+        """Get the stored vector for a message"""
+        row = self.rows.get(message_id)
+        return None if row is None else self.vectors[row]
+
+    def search(self, query: np.ndarray, k: int, exclude: List[str] = ()) -> List[Tuple[str, float]]:
+        """Top-k most similar messages by cosine similarity"""
+        n = len(self.ids)
+        if n == 0 or k <= 0:
+            return []
+        scores = self.vectors[:n] @ query
+        for message_id in exclude:
+            row = self.rows.get(message_id)
+            if row is not None:
+                scores[row] = -np.inf
+        k = min(k, n)
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(self.ids[i], float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def save(self, path: str):
+        """Write the index as float16 to keep files small"""
+        n = len(self.ids)
+        np.savez_compressed(path, ids=np.array(self.ids, dtype=str),
+                            vectors=self.vectors[:n].astype(np.float16))
+
+    @classmethod
+    def load(cls, path: str) -> "MemoryIndex":
+        """Read an index written by save()"""
+        with np.load(path) as data:
+            ids = [str(i) for i in data["ids"]]
+            vectors = data["vectors"].astype(np.float32)
+        index = cls(vectors.shape[1])
+        index.ids = ids
+        index.rows = {message_id: row for row, message_id in enumerate(ids)}
+        index.vectors = np.zeros((max(INITIAL_CAPACITY, len(ids)), vectors.shape[1]), dtype=np.float32)
+        index.vectors[:len(ids)] = vectors
+        return index
+
+
+class MemoryService:
+    """Embeds messages in the background and recalls relevant past turns.
+
+    New and edited messages are queued and embedded in batches by a single
+    background task. At prompt-build time the most recent message's vector is
+    used as the query, so recall never waits on the model server.
+    """
+
+    def __init__(self):
+        self.indexes: Dict[str, MemoryIndex] = {}
+        self._pending: Deque[Tuple[str, str, str]] = deque()
+        self._worker: Optional[asyncio.Task] = None
+
+    def index_for(self, conversation_id: str) -> MemoryIndex:
+        """Get (or create) a conversation's index"""
+        index = self.indexes.get(conversation_id)
+        if index is None:
+            index = self.indexes[conversation_id] = MemoryIndex()
+        return index
+
+    def enqueue(self, conversation: Conversation, messages: List[MessageRecord]):
+        """Queue messages for (re-)embedding"""
+        if not settings.memory_enabled:
+            return
+        for message in messages:
+            if message.content:
+                self._pending.append((conversation.id, message.id, _memory_text(message)))
+        if self._pending and (self._worker is None or self._worker.done()):
+            self._worker = asyncio.get_running_loop().create_task(self._drain())
+
+    def recall(self, conversation: Conversation, history: List[MessageRecord],
+               window: int, k: Optional[int] = None) -> List[MessageRecord]:
+        """Past messages relevant to the latest turn, oldest first.
+
+        The last `window` messages are already in the prompt and are skipped,
+        as are messages that only exist on other branches.
+        """
+        if not settings.memory_enabled or len(history) <= window:
+            return []
+        index = self.indexes.get(conversation.id)
+        if not index:
+            return []
+        recent = history[-window:]
+        query = next((index.vector(m.id) for m in reversed(recent) if m.id in index), None)
+        if query is None:
+            return []
+
+        hits = index.search(query, k or settings.memory_top_k, exclude=[m.id for m in recent])
+        # Only messages before the prompt window; on regenerate the message
+        # being replaced sits past the end of `history` and must not come back
+        cutoff = len(history) - window
+        found = []
+        for message_id, score in hits:
+            position = conversation.message_position(message_id)
+            if 0 <= position < cutoff and score >= settings.memory_min_score:
+                found.append((position, conversation.get_message(message_id)))
+        found.sort(key=lambda item: item[0])
+        return [message for _, message in found]
+
+    def forget(self, conversation: Conversation, message_ids: List[str]):
+        """Drop messages that are no longer part of the conversation"""
+        index = self.indexes.get(conversation.id)
+        if index is not None:
+            for message_id in message_ids:
+                index.discard(message_id)
+
+    def activate(self, conversation: Conversation):
+        """Load a conversation's saved index and queue anything missing from it"""
+        self.indexes = {}
+        self._pending.clear()
+        path = memory_path(conversation.id)
+        if os.path.exists(path):
+            self.indexes[conversation.id] = MemoryIndex.load(path)
+        index = self.index_for(conversation.id)
+        missing = [m for m in conversation.messages if m.id not in index]
+        if missing:
+            self.enqueue(conversation, missing)
+
+    def save(self, conversation: Conversation):
+        """Persist a conversation's index next to its save file"""
+        index = self.indexes.get(conversation.id)
+        if index:
+            index.save(memory_path(conversation.id))
+
+    async def _drain(self):
+        """Embed queued messages in batches until the queue is empty"""
+        from app.services.ai_service import ai_service
+
+        while self._pending:
+            batch = [self._pending.popleft()
+                     for _ in range(min(settings.memory_batch_size, len(self._pending)))]
+            try:
+                vectors = await ai_service.embed([text for _, _, text in batch])
+            except Exception as e:
+                print(f"Memory embedding failed, dropping {len(batch)} messages: {e}")
+                continue
+            vectors = np.asarray(vectors, dtype=np.float32)
+            if settings.memory_dim and vectors.shape[1] > settings.memory_dim:
+                # Matryoshka-style truncation keeps search fast on long stories
+                vectors = vectors[:, :settings.memory_dim]
+            by_conversation: Dict[str, List[int]] = {}
+            for i, (conversation_id, _, _) in enumerate(batch):
+                by_conversation.setdefault(conversation_id, []).append(i)
+            for conversation_id, rows in by_conversation.items():
+                self.index_for(conversation_id).add([batch[i][1] for i in rows], vectors[rows])
+
+
+def memory_path(conversation_id: str) -> str:
+    """Path of a conversation's saved memory index"""
+    return os.path.join(settings.save_dir, f"{conversation_id}.memory.npz")
+
+
+def _memory_text(message: MessageRecord) -> str:
+    """Text that gets embedded for a message"""
+    return f"{message.character_name}: {message.content}"
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize rows so dot products are cosine similarities"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# Singleton instance
+memory_service = MemoryService()
@@ -0,0 +1,154 @@
+"""In-memory metrics for model usage"""
+
+from typing import Dict, Optional
+from pydantic import BaseModel
+from app.models import GenerationUsage, UsageTotals
+
+
+class TaskUsage(BaseModel):
+    """Token counters for one generation task"""
+    calls: int = 0
+    prompt_tokens: int = 0
+    generated_tokens: int = 0
+    kept_tokens: int = 0
+    truncated: int = 0
+    early_stops: int = 0
+    degenerate: int = 0
+    # Time summed over the calls: server-reported where available, plus wall clock
+    timing: UsageTotals = UsageTotals()
+
+
+class CancellationUsage(BaseModel):
+    """Counters for generations cancelled before they finished"""
+    cancelled: int = 0
+    reasons: Dict[str, int] = {}
+    tokens_generated: int = 0
+    tokens_avoided: int = 0
+
+
+class GenerationMetrics:
+    """Tracks tokens generated versus tokens kept per task"""
+    
+    def __init__(self):
+        self.tasks: Dict[str, TaskUsage] = {}
+        self.cancellations = CancellationUsage()
+        self.deduplicated: Dict[str, int] = {}
+        self.stale: Dict[str, int] = {}
+        self.models: Dict[str, TaskUsage] = {}
+        self.fallbacks: Dict[str, int] = {}
+        self.scenes: Dict[str, int] = {}
+        self.rejections: Dict[str, int] = {}
+        self.model_failures: Dict[str, Dict[str, int]] = {}
+    
+    def record(self, task: str, prompt_tokens: int, generated_tokens: int,
+               kept_tokens: int, stop_reason: Optional[str] = None, model: Optional[str] = None,
+               usage: Optional[GenerationUsage] = None):
+        """Record the outcome of one generation.
+        
+        `stop_reason` is "length" when the num_predict cap was hit, "complete"
+        when the parser ended generation once the format was done and
+        "repetition" when it ended a degenerate loop. `usage` adds the call's
+        timings.
+        """
+        buckets = [self.tasks.setdefault(task, TaskUsage())]
+        if model:
+            buckets.append(self.models.setdefault(model, TaskUsage()))
+        for bucket in buckets:
+            bucket.calls += 1
+            bucket.prompt_tokens += prompt_tokens
+            bucket.generated_tokens += generated_tokens
+            bucket.kept_tokens += min(kept_tokens, generated_tokens)
+            if stop_reason == "length":
+                bucket.truncated += 1
+            elif stop_reason == "complete":
+                bucket.early_stops += 1
+            elif stop_reason == "repetition":
+                bucket.degenerate += 1
+            if usage:
+                bucket.timing.add(usage)
+    
+    def record_cancelled(self, task: str, tokens_generated: int, num_predict: int):
+        """Record the tokens spent on, and saved by, a cancelled generation.
+        
+        Saved tokens are an upper bound: the generation could have stopped
+        before reaching its num_predict cap.
+        """
+        self.cancellations.cancelled += 1
+        self.cancellations.tokens_generated += tokens_generated
+        self.cancellations.tokens_avoided += max(num_predict - tokens_generated, 0)
+    
+    def record_cancel_reason(self, reason: str):
+        """Count why a generation task was cancelled"""
+        reasons = self.cancellations.reasons
+        reasons[reason] = reasons.get(reason, 0) + 1
+    
+    def record_deduplicated(self, kind: str):
+        """Count a request served from another request's generation"""
+        self.deduplicated[kind] = self.deduplicated.get(kind, 0) + 1
+    
+    def record_stale(self, outcome: str):
+        """Count a generation whose conversation changed while it ran"""
+        self.stale[outcome] = self.stale.get(outcome, 0) + 1
+    
+    def record_fallback(self, task: str):
+        """Count a task rerouted to the small model because of load"""
+        self.fallbacks[task] = self.fallbacks.get(task, 0) + 1
+    
+    def record_scene(self, requested: int, generated: int):
+        """Count a scene generation by how many of its turns could be used"""
+        outcome = "complete" if generated >= requested else "partial" if generated else "fallback"
+        self.scenes[outcome] = self.scenes.get(outcome, 0) + 1
+        self.scenes["turns_requested"] = self.scenes.get("turns_requested", 0) + requested
+        self.scenes["turns_generated"] = self.scenes.get("turns_generated", 0) + generated
+    
+    def record_rejection(self, reason: str):
+        """Count a model-backed request refused by rate limits or admission control"""
+        self.rejections[reason] = self.rejections.get(reason, 0) + 1
+    
+    def record_model_failure(self, task: str, outcome: str):
+        """Count a failed model call by outcome: "error", "timeout" or "retried" """
+        counts = self.model_failures.setdefault(task, {})
+        counts[outcome] = counts.get(outcome, 0) + 1
+    
+    def report(self) -> dict:
+        """Summarize usage per task and overall"""
+        tasks = {}
+        for task, usage in self.tasks.items():
+            tasks[task] = {
+                **usage.model_dump(),
+                "discarded_tokens": usage.generated_tokens - usage.kept_tokens,
+                "kept_ratio": round(usage.kept_tokens / usage.generated_tokens, 3) if usage.generated_tokens else None,
+                **usage.timing.rates(),
+            }
+        generated = sum(u.generated_tokens for u in self.tasks.values())
+        kept = sum(u.kept_tokens for u in self.tasks.values())
+        return {
+            "tasks": tasks,
+            "total_generated_tokens": generated,
+            "total_kept_tokens": kept,
+            "total_discarded_tokens": generated - kept,
+            "cancellations": self.cancellations.model_dump(),
+            "deduplicated_requests": dict(self.deduplicated),
+            "stale_generations": dict(self.stale),
+            "models": {model: usage.model_dump() for model, usage in self.models.items()},
+            "load_fallbacks": dict(self.fallbacks),
+            "scenes": dict(self.scenes),
+            "rejected_requests": dict(self.rejections),
+            "model_failures": {task: dict(counts) for task, counts in self.model_failures.items()},
+        }
+    
+    def reset(self):
+        """Clear all counters"""
+        self.tasks.clear()
+        self.cancellations = CancellationUsage()
+        self.deduplicated.clear()
+        self.stale.clear()
+        self.models.clear()
+        self.fallbacks.clear()
+        self.scenes.clear()
+        self.rejections.clear()
+        self.model_failures.clear()
+
+
+# Singleton instance
+generation_metrics = GenerationMetrics()
@@ -0,0 +1,67 @@
+"""Per-task model routing"""
+
+from contextlib import contextmanager
+from typing import Optional
+from app.core.config import settings
+from app.services.metrics import generation_metrics
+
+# Tasks whose output the user never reads directly; cheap models are fine
+BOOKKEEPING_TASKS = {"summary", "description", "scenario", "next_speaker", "persona"}
+
+
+class ModelRouter:
+    """Chooses which model serves each generation task.
+    
+    Resolution order: an explicit entry in `task_models`, then `small_model`
+    for bookkeeping tasks, then the default model. When `fallback_under_load`
+    is on and at least `fallback_load_threshold` generations are in flight,
+    every task is sent to `small_model`.
+    """
+    
+    def __init__(self, default_model: Optional[str] = None):
+        self.default_model = default_model or settings.ai_model
+        self.in_flight = 0
+    
+    def model_for(self, task: str) -> str:
+        """Get the model for a task at current load"""
+        if self._overloaded():
+            model = settings.small_model
+            if model != self._configured_model(task):
+                generation_metrics.record_fallback(task)
+            return model
+        return self._configured_model(task)
+    
+    def _configured_model(self, task: str) -> str:
+        """Model configured for a task, ignoring load"""
+        if task in settings.task_models:
+            return settings.task_models[task]
+        if settings.small_model and task in BOOKKEEPING_TASKS:
+            return settings.small_model
+        return self.default_model
+    
+    def _overloaded(self) -> bool:
+        return (
+            bool(settings.small_model)
+            and settings.fallback_under_load
+            and self.in_flight >= settings.fallback_load_threshold
+        )
+    
+    @contextmanager
+    def track(self):
+        """Count a generation as in flight for load-based fallback"""
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+    
+    def describe(self) -> dict:
+        """Current routing table and load"""
+        tasks = ["dialogue", "narration", "scene"] + sorted(BOOKKEEPING_TASKS)
+        return {
+            "default_model": self.default_model,
+            "small_model": settings.small_model or None,
+            "routes": {task: self._configured_model(task) for task in tasks},
+            "in_flight": self.in_flight,
+            "falling_back": self._overloaded(),
+        }
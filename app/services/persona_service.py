@@ -0,0 +1,132 @@
+"""Compact persona digests for character prompts"""
+
+import asyncio
+import hashlib
+import re
+from typing import Dict, Optional
+from app.core.config import settings
+from app.models import Character, Conversation
+from app.services.circuit_breaker import ModelUnavailable
+from app.utils.generation import CHARS_PER_TOKEN, estimate_tokens
+
+
+class PersonaService:
+    """Turns all of a character's fields into one short digest for prompts.
+
+    The digest combines description, personality, speech patterns and
+    motivations. When the combination fits `persona_max_tokens` it is used
+    as is. Longer personas are condensed by the model once, in the
+    background; until that finishes, prompts get the combination cut at a
+    sentence boundary. Digests are cached by a hash of the character's
+    fields and kept on the character, so they survive saves and are only
+    rebuilt when the character changes.
+    """
+
+    def __init__(self):
+        self._digests: Dict[str, str] = {}
+        self._pending: Dict[str, asyncio.Task] = {}
+
+    def digest(self, character: Character, conversation: Optional[Conversation] = None) -> str:
+        """The persona text to put in a prompt, starting a condense if one is needed"""
+        key = persona_key(character)
+        if character.persona and character.persona_key == key:
+            return character.persona
+        cached = self._digests.get(key)
+        if cached:
+            _store(character, key, cached)
+            return cached
+
+        combined = combine_fields(character)
+        if estimate_tokens(combined) <= settings.persona_max_tokens:
+            self._digests[key] = combined
+            _store(character, key, combined)
+            return combined
+        self.prepare(character, conversation)
+        return truncate(combined, settings.persona_max_tokens)
+
+    def prepare(self, character: Character, conversation: Optional[Conversation] = None):
+        """Condense a long persona in the background if it isn't already"""
+        key = persona_key(character)
+        if key in self._digests or key in self._pending or character.is_narrator:
+            return
+        if estimate_tokens(combine_fields(character)) <= settings.persona_max_tokens:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(self.compile(character, conversation))
+        self._pending[key] = task
+        task.add_done_callback(lambda _: self._pending.pop(key, None))
+
+    async def compile(self, character: Character, conversation: Optional[Conversation] = None) -> str:
+        """Have the model condense a character's fields into a digest"""
+        from app.services.ai_service import ai_service
+
+        key = persona_key(character)
+        combined = combine_fields(character)
+        words = int(settings.persona_max_tokens * CHARS_PER_TOKEN / 6)
+        prompt = f"""Condense this character profile for {character.name} into at most {words} words.
+Keep what matters for playing the character: who they are, how they behave, how they talk and what they want.
+
+Profile:
+{combined}
+
+Condensed profile:"""
+        try:
+            text, usage = await ai_service.complete(prompt, task="persona")
+        except ModelUnavailable:
+            return truncate(combined, settings.persona_max_tokens)
+        if conversation:
+            conversation.record_usage(usage)
+        text = " ".join(text.split())
+        if not text:
+            return truncate(combined, settings.persona_max_tokens)
+
+        digest = truncate(text, settings.persona_max_tokens)
+        self._digests[key] = digest
+        # The character may have been edited while the model ran
+        if persona_key(character) == key:
+            _store(character, key, digest)
+        return digest
+
+
+def combine_fields(character: Character) -> str:
+    """All of a character's descriptive fields as one paragraph"""
+    parts = [character.description.strip()]
+    for label, value in (("Personality", character.personality),
+                         ("Speaks", character.speech_patterns),
+                         ("Wants", character.motivations)):
+        value = value.strip()
+        if value:
+            parts.append(f"{label}: {value.rstrip('.')}.")
+    return " ".join(" ".join(part.split()) for part in parts if part)
+
+
+def persona_key(character: Character) -> str:
+    """Hash of the fields a digest is built from, and the digest budget"""
+    fields = "\x00".join((character.name, character.description, character.personality,
+                          character.speech_patterns, character.motivations,
+                          str(settings.persona_max_tokens)))
+    return hashlib.blake2b(fields.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def truncate(text: str, max_tokens: int) -> str:
+    """Cut text to about `max_tokens`, at the last sentence end that fits if there is one"""
+    limit = int(max_tokens * CHARS_PER_TOKEN)
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    ends = [m.end() for m in re.finditer(r"[.!?](?=\s|$)", cut)]
+    if ends and ends[-1] > limit // 2:
+        return cut[:ends[-1]]
+    return cut.rsplit(" ", 1)[0] + "..."
+
+
+def _store(character: Character, key: str, digest: str):
+    character.persona = digest
+    character.persona_key = key
+
+
+# Singleton instance
+persona_service = PersonaService()
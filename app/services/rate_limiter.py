@@ -0,0 +1,130 @@
+"""Rate limits and admission control for model-backed requests"""
+
+import math
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional
+from app.core.config import settings
+from app.services.metrics import generation_metrics
+
+# Upper bound on remembered buckets; the least recently used are dropped
+MAX_BUCKETS = 4096
+# Weight of the newest request in the running average of request duration
+DURATION_SMOOTHING = 0.2
+
+
+class RateLimited(Exception):
+    """Raised when a request is refused; `retry_after` is in whole seconds"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allows `capacity` requests at once, refilled at `rate` per second"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def wait(self, now: float) -> float:
+        """Seconds until a token is available; 0 if one is now"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class RequestLimiter:
+    """Guards the endpoints that run the model.
+
+    Each request takes a token from its client's bucket and from its
+    conversation's bucket, and is refused if either is empty. On top of
+    that, at most `max_active_generations` such requests may be in progress
+    at once: when the backend is saturated, more are refused at once
+    rather than queued until they time out. Refusals carry the number of
+    seconds to wait before retrying.
+    """
+
+    def __init__(self):
+        self.active = 0
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        # Running average of how long an admitted request takes, in seconds
+        self._duration: Optional[float] = None
+
+    @contextmanager
+    def admit(self, client: str, conversation_id: Optional[str]):
+        """Hold a slot for a model-backed request, or raise RateLimited"""
+        # Busy first: a request refused for load must not use up its client's rate budget
+        limit = settings.max_active_generations
+        if limit and self.active >= limit:
+            generation_metrics.record_rejection("busy")
+            raise RateLimited(f"Server busy: {self.active} generations in progress", self._busy_retry_after())
+        self._check_rates(client, conversation_id)
+        self.active += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            elapsed = time.monotonic() - started
+            self._duration = elapsed if self._duration is None else (
+                DURATION_SMOOTHING * elapsed + (1 - DURATION_SMOOTHING) * self._duration)
+
+    def describe(self) -> dict:
+        """Current load and limits"""
+        return {
+            "active": self.active,
+            "max_active": settings.max_active_generations or None,
+            "average_request_seconds": round(self._duration, 2) if self._duration is not None else None,
+            "tracked_buckets": len(self._buckets),
+        }
+
+    def _check_rates(self, client: str, conversation_id: Optional[str]):
+        """Take a token from each bucket the request counts against; all or none"""
+        now = time.monotonic()
+        buckets = []
+        if settings.client_rate_per_minute > 0:
+            buckets.append(("client", self._bucket(f"client:{client}", settings.client_rate_per_minute,
+                                                   settings.client_burst, now)))
+        if conversation_id and settings.conversation_rate_per_minute > 0:
+            buckets.append(("conversation", self._bucket(f"conversation:{conversation_id}",
+                                                         settings.conversation_rate_per_minute,
+                                                         settings.conversation_burst, now)))
+        for scope, bucket in buckets:
+            wait = bucket.wait(now)
+            if wait:
+                generation_metrics.record_rejection(scope)
+                raise RateLimited(f"Too many requests for this {scope}", math.ceil(wait))
+        for _, bucket in buckets:
+            bucket.take()
+
+    def _bucket(self, key: str, per_minute: float, burst: int, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        rate = per_minute / 60
+        if bucket is None or bucket.rate != rate or bucket.capacity != max(burst, 1):
+            # New, or the limits were changed
+            bucket = TokenBucket(rate, max(burst, 1), now)
+            self._buckets[key] = bucket
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > MAX_BUCKETS:
+            self._buckets.popitem(last=False)
+        return bucket
+
+    def _busy_retry_after(self) -> int:
+        """Rough time until a slot frees up: the average request duration"""
+        return max(1, math.ceil(self._duration or 1))
+
+
+# Singleton instance
+request_limiter = RequestLimiter()
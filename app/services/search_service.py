@@ -0,0 +1,232 @@
+"""Full-text search across saved conversations"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.models import Conversation
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    conversation_id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    name TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS docs (
+    rowid INTEGER PRIMARY KEY,
+    conversation_id TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    digest INTEGER NOT NULL,
+    UNIQUE (conversation_id, doc_id)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(
+    content, speaker, tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+
+class SearchIndex:
+    """SQLite FTS5 index over message content, speakers and summaries.
+
+    Every saved conversation's active branch and summaries are indexed. Each
+    indexed text keeps a digest, so re-indexing a conversation only touches
+    the rows whose text changed. `refresh()` brings the whole save directory
+    up to date, skipping files whose size and mtime are unchanged. Saves
+    made through the app are indexed right away by `update()`.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.refreshing = False
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            path = self.path or os.path.join(settings.save_dir, "search.sqlite3")
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def update(self, conversation: Conversation, filename: str):
+        """Index a conversation that was just saved to `filename`"""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                self._sync(conn, conversation)
+                self._record_file(conn, conversation.id, filename, conversation.name)
+
+    def refresh(self) -> int:
+        """Index new and changed saves and drop deleted ones; returns saves re-indexed"""
+        from app.services.storage_service import conversation_store
+
+        self.refreshing = True
+        self._stop.clear()
+        try:
+            with self._lock:
+                known = {row[1]: row for row in self._connection().execute(
+                    "SELECT conversation_id, filename, mtime, size FROM files")}
+            seen = set()
+            updated = 0
+            for filename in os.listdir(settings.save_dir):
+                if self._stop.is_set():
+                    return updated
+                if not filename.endswith(".json"):
+                    continue
+                seen.add(filename)
+                stat = os.stat(os.path.join(settings.save_dir, filename))
+                row = known.get(filename)
+                if row and row[2] == stat.st_mtime and row[3] == stat.st_size:
+                    continue
+                try:
+                    conversation = conversation_store.read(filename)
+                except Exception as e:
+                    print(f"Search indexing skipped {filename}: {e}")
+                    continue
+                self.update(conversation, filename)
+                updated += 1
+            with self._lock:
+                conn = self._connection()
+                with conn:
+                    for filename, row in known.items():
+                        if filename not in seen:
+                            self._remove(conn, row[0])
+            return updated
+        finally:
+            self.refreshing = False
+
+    def stop(self):
+        """Make a running refresh return early"""
+        self._stop.set()
+
+    def search(self, query: str, limit: int = 20,
+               conversation_id: Optional[str] = None) -> Tuple[List[dict], List[dict]]:
+        """Ranked message and summary hits, and the conversations with the most hits"""
+        match = _match_expression(query)
+        if not match:
+            return [], []
+        where = "docs_fts MATCH ?"
+        params: list = [match]
+        if conversation_id:
+            where += " AND d.conversation_id = ?"
+            params.append(conversation_id)
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute(f"""
+                SELECT d.conversation_id, f.filename, f.name, d.doc_id, d.kind, d.position,
+                       docs_fts.speaker, snippet(docs_fts, 0, '[', ']', '...', 12), bm25(docs_fts)
+                FROM docs_fts
+                JOIN docs d ON d.rowid = docs_fts.rowid
+                JOIN files f ON f.conversation_id = d.conversation_id
+                WHERE {where}
+                ORDER BY bm25(docs_fts)
+                LIMIT ?""", params + [limit]).fetchall()
+            # bm25() is not allowed inside an aggregate, so rank in a materialized subquery
+            groups = conn.execute(f"""
+                WITH h AS MATERIALIZED (
+                    SELECT d.conversation_id AS conversation_id, bm25(docs_fts) AS score
+                    FROM docs_fts
+                    JOIN docs d ON d.rowid = docs_fts.rowid
+                    WHERE {where}
+                )
+                SELECT h.conversation_id, f.filename, f.name, COUNT(*), MIN(h.score)
+                FROM h
+                JOIN files f ON f.conversation_id = h.conversation_id
+                GROUP BY h.conversation_id
+                ORDER BY MIN(h.score)
+                LIMIT ?""", params + [limit]).fetchall()
+
+        hits = [{
+            "conversation_id": row[0],
+            "filename": row[1],
+            "conversation_name": row[2],
+            "message_id": row[3] if row[4] == "message" else None,
+            "kind": row[4],
+            "position": row[5],
+            "character_name": row[6],
+            "snippet": row[7],
+            "score": -row[8],
+        } for row in rows]
+        conversations = [{
+            "conversation_id": row[0],
+            "filename": row[1],
+            "name": row[2],
+            "hits": row[3],
+            "score": -row[4],
+        } for row in groups]
+        return hits, conversations
+
+    def _sync(self, conn: sqlite3.Connection, conversation: Conversation):
+        """Bring one conversation's rows in line with its active branch and summaries"""
+        existing: Dict[str, Tuple[int, int, int]] = {
+            row[0]: (row[1], row[2], row[3]) for row in conn.execute(
+                "SELECT doc_id, rowid, position, digest FROM docs WHERE conversation_id = ?",
+                (conversation.id,))
+        }
+        documents = [(m.id, "message", i, m.character_name, m.content)
+                     for i, m in enumerate(conversation.messages)]
+        documents += [(f"summary:{i}", "summary", i, "", text)
+                      for i, text in enumerate(conversation.summaries)]
+
+        for doc_id, kind, position, speaker, content in documents:
+            digest = _digest(speaker, content)
+            current = existing.pop(doc_id, None)
+            if current is None:
+                rowid = conn.execute(
+                    "INSERT INTO docs (conversation_id, doc_id, kind, position, digest) VALUES (?, ?, ?, ?, ?)",
+                    (conversation.id, doc_id, kind, position, digest)).lastrowid
+                conn.execute("INSERT INTO docs_fts (rowid, content, speaker) VALUES (?, ?, ?)",
+                             (rowid, content, speaker))
+                continue
+            rowid, old_position, old_digest = current
+            if old_digest != digest:
+                conn.execute("UPDATE docs_fts SET content = ?, speaker = ? WHERE rowid = ?",
+                             (content, speaker, rowid))
+            if old_digest != digest or old_position != position:
+                conn.execute("UPDATE docs SET position = ?, digest = ? WHERE rowid = ?",
+                             (position, digest, rowid))
+
+        stale = [(rowid,) for rowid, _, _ in existing.values()]
+        conn.executemany("DELETE FROM docs_fts WHERE rowid = ?", stale)
+        conn.executemany("DELETE FROM docs WHERE rowid = ?", stale)
+
+    def _record_file(self, conn: sqlite3.Connection, conversation_id: str, filename: str, name: str):
+        """Remember the file state an index entry was built from"""
+        stat = os.stat(os.path.join(settings.save_dir, filename))
+        conn.execute(
+            "INSERT OR REPLACE INTO files (conversation_id, filename, name, mtime, size) VALUES (?, ?, ?, ?, ?)",
+            (conversation_id, filename, name, stat.st_mtime, stat.st_size))
+
+    def _remove(self, conn: sqlite3.Connection, conversation_id: str):
+        """Drop a conversation from the index"""
+        rows = conn.execute("SELECT rowid FROM docs WHERE conversation_id = ?", (conversation_id,)).fetchall()
+        conn.executemany("DELETE FROM docs_fts WHERE rowid = ?", rows)
+        conn.execute("DELETE FROM docs WHERE conversation_id = ?", (conversation_id,))
+        conn.execute("DELETE FROM files WHERE conversation_id = ?", (conversation_id,))
+
+
+def _digest(speaker: str, content: str) -> int:
+    """Stable 63-bit hash of an indexed text"""
+    data = f"{speaker}\x00{content}".encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big") >> 1
+
+
+def _match_expression(query: str) -> str:
+    """Turn user input into an FTS5 query matching all words, the last as a prefix"""
+    terms = ['"' + term.replace('"', '""') + '"' for term in query.split()]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+# Singleton instance
+search_index = SearchIndex()
@@ -0,0 +1,304 @@
+"""Saving and loading conversations"""
+
+import json
+import os
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from app.core.config import settings
+from app.models import Conversation, MessageRecord
+from app.utils.frames import frames_end, get_codec, iter_frames, read_frame, read_header, write_frame, write_header
+
+# Version written to the metadata file of each save
+FORMAT_VERSION = 3
+# Rewrite a node log once it holds this many more records than live nodes
+COMPACT_SLACK = 64
+# Records per frame when a log is written in full; small frames keep page reads cheap
+FRAME_RECORDS = 256
+
+# Where a record lives in a node log: (frame offset, line within the frame)
+Location = Tuple[int, int]
+
+
+class ConversationStore:
+    """Conversation saves as a metadata file, an append-only node log and an offset index.
+
+    `{id}.json` holds everything except the messages and is rewritten on each
+    save. `{id}.nodes` holds the message tree as JSON lines, one record per
+    line: `{"id", "parent", "message"}` for a new or changed node and
+    `{"id", "deleted": true}` for a removed one. The lines are stored in
+    length-prefixed frames compressed with SAVE_COMPRESSION (see
+    app.utils.frames). A save appends one frame with the nodes changed since
+    the previous save; when reading, the last record for an id wins. The log
+    is rewritten once superseded records outnumber live ones.
+
+    `{id}.idx.npy` gives the location of each message on the active branch,
+    root first, so any page of a saved story can be read by decompressing a
+    few frames instead of the whole log.
+
+    Both the log and the load are streamed frame by frame. Older saves load
+    transparently: format 2 (uncompressed `{id}.nodes.jsonl`) and the
+    original single-file format with messages inline. They are rewritten in
+    the current format on their next save, or in bulk by convert_saves.py.
+    """
+
+    def __init__(self):
+        # Records in each current-format node log this process has written or read
+        self._log_records: Dict[str, int] = {}
+        # Location of each node's latest record in its log
+        self._locations: Dict[str, Dict[str, Location]] = {}
+
+    def save(self, conversation: Conversation) -> str:
+        """Write a conversation and return the metadata file path"""
+        changed, deleted = conversation.take_changes()
+        nodes = conversation.all_messages()
+        records = self._log_records.get(conversation.id)
+        try:
+            if records is None or records + len(changed) + len(deleted) > 2 * len(nodes) + COMPACT_SLACK:
+                self._write_log(conversation, nodes)
+            else:
+                self._append_log(conversation, changed, deleted)
+            self._write_index(conversation)
+        except OSError:
+            # The changes were taken; rewrite the whole log next time
+            self._log_records.pop(conversation.id, None)
+            raise
+
+        data = conversation.model_dump(exclude={"messages"})
+        data["format"] = FORMAT_VERSION
+        data["compression"] = settings.save_compression
+        data["message_count"] = len(conversation.messages)
+        path = meta_path(conversation.id)
+        _write_atomic(path, json.dumps(data, ensure_ascii=False).encode("utf-8"))
+        if os.path.exists(legacy_log_path(conversation.id)):
+            os.remove(legacy_log_path(conversation.id))
+        return path
+
+    def load(self, filename: str) -> Conversation:
+        """Read a conversation saved in any format, for saving again later"""
+        conversation, records, locations = self._read(filename)
+        if records is not None:
+            self._log_records[conversation.id] = records
+            self._locations[conversation.id] = locations
+        return conversation
+
+    def read(self, filename: str) -> Conversation:
+        """Read a conversation without touching the store's state; safe to call from worker threads"""
+        return self._read(filename)[0]
+
+    def _read(self, filename: str) -> Tuple[Conversation, Optional[int], Dict[str, Location]]:
+        """Read a save; also returns its record count and node locations (None and {} unless current format)"""
+        data = self.read_meta(filename)
+        if "messages" in data:
+            return Conversation(**data), None, {}
+
+        nodes: Dict[str, MessageRecord] = {}
+        parents: Dict[str, Optional[str]] = {}
+        locations: Dict[str, Location] = {}
+        records = 0
+        for location, record in self._iter_records(data):
+            records += 1
+            if record.get("deleted"):
+                nodes.pop(record["id"], None)
+                parents.pop(record["id"], None)
+                locations.pop(record["id"], None)
+            else:
+                nodes[record["id"]] = MessageRecord.from_dict(record["message"])
+                parents[record["id"]] = record["parent"]
+                locations[record["id"]] = location
+        conversation = Conversation.from_tree(data, list(nodes.values()), parents)
+        if data.get("format") != FORMAT_VERSION or not self._log_intact(data["id"]):
+            # Appending would go after a frame cut short by a crash; the next save rewrites the log
+            return conversation, None, {}
+        return conversation, records, locations
+
+    def convert(self, filename: str) -> str:
+        """Rewrite a save in the current format and return the new metadata path"""
+        conversation = self.load(filename)
+        self._log_records.pop(conversation.id, None)
+        path = self.save(conversation)
+        if os.path.join(settings.save_dir, filename) != path:
+            os.remove(os.path.join(settings.save_dir, filename))
+        return path
+
+    def read_meta(self, filename: str) -> dict:
+        """Read a save's metadata file (the whole document for old saves)"""
+        with open(os.path.join(settings.save_dir, filename), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def read_page(self, filename: str, offset: Optional[int], limit: int) -> Tuple[int, int, List[dict]]:
+        """Read a page of a saved conversation's active branch.
+
+        `offset=None` reads the last page. Returns (total, offset, messages).
+        Only the frames holding the requested records are read; saves without
+        a usable index are loaded in full.
+        """
+        data = self.read_meta(filename)
+        if "messages" in data:
+            messages = data["messages"]
+            offset = page_start(len(messages), offset, limit)
+            return len(messages), offset, messages[offset:offset + limit]
+
+        total = data.get("message_count", 0)
+        index = self._read_index(data, total)
+        if index is None:
+            messages = self.load(filename).messages
+            offset = page_start(len(messages), offset, limit)
+            return len(messages), offset, [m.to_dict() for m in messages[offset:offset + limit]]
+
+        offset = page_start(total, offset, limit)
+        page = []
+        frames: Dict[int, List[bytes]] = {}
+        with open(log_path(data["id"]), "rb") as f:
+            codec = read_header(f)
+            for frame_offset, line in index[offset:offset + limit].tolist():
+                if frame_offset not in frames:
+                    frames[frame_offset] = read_frame(f, codec, frame_offset).splitlines()
+                page.append(json.loads(frames[frame_offset][line])["message"])
+        return total, offset, page
+
+    def list(self) -> List[dict]:
+        """Summaries of all saved conversations"""
+        conversations = []
+        for filename in os.listdir(settings.save_dir):
+            if not filename.endswith(".json"):
+                continue
+            data = self.read_meta(filename)
+            conversations.append({
+                "filename": filename,
+                "name": data.get("name", "Unnamed"),
+                "created_at": data.get("created_at", ""),
+                "message_count": data.get("message_count", len(data.get("messages", [])))
+            })
+        return conversations
+
+    def _iter_records(self, data: dict) -> Iterator[Tuple[Location, dict]]:
+        """Stream the node records of a format 2 or current save"""
+        if data.get("format") != FORMAT_VERSION:
+            path = legacy_log_path(data["id"])
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    for line in f:
+                        if line.strip():
+                            yield (0, 0), json.loads(line)
+            return
+        path = log_path(data["id"])
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            codec = read_header(f)
+            for frame_offset, frame in iter_frames(f, codec):
+                for line_number, line in enumerate(frame.splitlines()):
+                    yield (frame_offset, line_number), json.loads(line)
+
+    def _log_intact(self, conversation_id: str) -> bool:
+        """Whether a node log ends with a complete frame (a missing log counts as intact)"""
+        path = log_path(conversation_id)
+        if not os.path.exists(path):
+            return True
+        with open(path, "rb") as f:
+            return frames_end(f) == os.path.getsize(path)
+
+    def _write_log(self, conversation: Conversation, nodes: List[MessageRecord]):
+        """Rewrite a conversation's node log from scratch, one frame at a time"""
+        codec = get_codec(settings.save_compression)
+        locations: Dict[str, Location] = {}
+        path = log_path(conversation.id)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            write_header(f, codec)
+            for start in range(0, len(nodes), FRAME_RECORDS):
+                frame = nodes[start:start + FRAME_RECORDS]
+                frame_offset = write_frame(f, codec, b"".join(_node_record(conversation, m) for m in frame))
+                for line, message in enumerate(frame):
+                    locations[message.id] = (frame_offset, line)
+        os.replace(tmp, path)
+        self._log_records[conversation.id] = len(nodes)
+        self._locations[conversation.id] = locations
+
+    def _append_log(self, conversation: Conversation, changed: List[str], deleted: List[str]):
+        """Append changed and deleted nodes to a conversation's node log as one frame"""
+        locations = self._locations[conversation.id]
+        lines = [json.dumps({"id": message_id, "deleted": True}).encode("utf-8") + b"\n"
+                 for message_id in deleted]
+        written = []
+        for message_id in changed:
+            message = conversation.get_message(message_id)
+            if message:
+                written.append(message_id)
+                lines.append(_node_record(conversation, message))
+        if not lines:
+            return
+        with open(log_path(conversation.id), "rb+") as f:
+            codec = read_header(f)
+            f.seek(0, os.SEEK_END)
+            frame_offset = write_frame(f, codec, b"".join(lines))
+        for message_id in deleted:
+            locations.pop(message_id, None)
+        for line, message_id in enumerate(written, start=len(deleted)):
+            locations[message_id] = (frame_offset, line)
+        self._log_records[conversation.id] += len(lines)
+
+    def _write_index(self, conversation: Conversation):
+        """Write the log locations of the active branch"""
+        locations = self._locations[conversation.id]
+        index = np.array([locations[m.id] for m in conversation.messages], dtype=np.int64).reshape(-1, 2)
+        if not len(index) or index.max() < 2 ** 32:
+            index = index.astype(np.uint32)
+        tmp = f"{index_path(conversation.id)}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, index)
+        os.replace(tmp, index_path(conversation.id))
+
+    def _read_index(self, data: dict, total: int) -> Optional[np.ndarray]:
+        """Memory-map a save's index, or None if it is missing or out of date"""
+        path = index_path(data["id"])
+        if data.get("format") != FORMAT_VERSION or not os.path.exists(path):
+            return None
+        index = np.load(path, mmap_mode="r")
+        return index if index.shape == (total, 2) else None
+
+
+def meta_path(conversation_id: str) -> str:
+    """Path of a conversation's metadata file"""
+    return os.path.join(settings.save_dir, f"{conversation_id}.json")
+
+
+def log_path(conversation_id: str) -> str:
+    """Path of a conversation's framed node log"""
+    return os.path.join(settings.save_dir, f"{conversation_id}.nodes")
+
+
+def legacy_log_path(conversation_id: str) -> str:
+    """Path of a format 2 (uncompressed JSON lines) node log"""
+    return os.path.join(settings.save_dir, f"{conversation_id}.nodes.jsonl")
+
+
+def index_path(conversation_id: str) -> str:
+    """Path of a conversation's active-branch index"""
+    return os.path.join(settings.save_dir, f"{conversation_id}.idx.npy")
+
+
+def page_start(total: int, offset: Optional[int], limit: int) -> int:
+    """First position of a page; None means the last page"""
+    if offset is None:
+        return max(0, total - limit)
+    return max(0, min(offset, total))
+
+
+def _node_record(conversation: Conversation, message: MessageRecord) -> bytes:
+    """One node log line for a message"""
+    record = {"id": message.id, "parent": conversation.parent_of(message.id),
+              "message": message.to_dict()}
+    return json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def _write_atomic(path: str, data: bytes):
+    """Replace a file without leaving it half-written"""
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+# Singleton instance
+conversation_store = ConversationStore()
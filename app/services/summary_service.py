@@ -1,12 +1,36 @@
 """Service for generating conversation summaries"""
 
+import asyncio
+import hashlib
+from typing import Dict, List, Optional, Set
 from app.core.config import settings
+from app.core.locks import conversation_lock
 from app.core.state import get_state
+from app.models import Branch, Conversation, MessageRecord
 from app.services.ai_service import ai_service
+from app.services.circuit_breaker import ModelUnavailable
+from app.services.job_service import job_queue
 
 
 class SummaryService:
-    """Service for generating summaries of conversations"""
+    """Service for generating summaries of conversations.
+    
+    Summary i of a branch covers its messages [i * M, (i + 1) * M), with M
+    `max_messages_before_summary`. Summaries are made as the story grows,
+    or all at once by `backfill()` for stories that have none. Every
+    `summary_reduce_fanin` summaries are folded into the branch's overview,
+    so prompts get a short "story so far" however long the story is.
+    Editing or deleting a message marks only the summaries covering it stale
+    (see Conversation._invalidate); they, and the overview if it included
+    them, are redone at the next summary step.
+    """
+    
+    def __init__(self):
+        # Branches being backfilled, as "<conversation_id>:<branch_id>"
+        self._backfilling: Set[str] = set()
+        # Chunk summaries finished out of order, by chunk digest; kept so an
+        # interrupted backfill does not redo them
+        self._chunk_results: Dict[str, str] = {}
     
     async def generate_summary(self) -> str:
         """Generate a summary of recent messages"""
@@ -15,30 +39,40 @@ class SummaryService:
         if not state.conversation or len(state.conversation.messages) < settings.max_messages_before_summary:
             return ""
         
-        # Get messages since last summary
-        start_idx = len(state.conversation.summaries) * settings.max_messages_before_summary
-        messages_to_summarize = state.conversation.messages[start_idx:]
-        
-        context = "\n".join([
-            f"{m.character_name}: {m.content}"
-            for m in messages_to_summarize
-        ])
-        
-        prompt = f"""Summarize this section of the story, preserving:
-1. Key events and developments
-2. Character emotions and relationships
-3. Important dialogue and decisions
-4. Current scenario state
-
-Conversation:
-{context}
-
-Write a concise summary (3-4 sentences)."""
-        
-        summary = ai_service.get_response(prompt)
-        state.conversation.summaries.append(summary)
-        
-        return summary
+        conversation = state.conversation
+        branch = conversation.active_branch
+        # One summary at a time per conversation, so concurrent turns don't duplicate it
+        async with conversation_lock(conversation.id, "summary"):
+            try:
+                await self._refresh(conversation, branch)
+                summary = await self._generate_summary(conversation)
+                await self._extend_overview(conversation, branch)
+            except ModelUnavailable as e:
+                # The turn itself succeeded; what is missing is made at a later step
+                print(f"Summary skipped: {e}")
+                return ""
+            return summary
+    
+    async def _generate_summary(self, conversation: Conversation) -> str:
+        """Summarize each complete chunk of messages that has no summary yet; returns the last summary made"""
+        size = settings.max_messages_before_summary
+        # Summaries belong to the branch they were made on, even if it is switched meanwhile
+        branch = conversation.active_branch
+        summary = ""
+        while True:
+            index = len(branch.summaries)
+            chunk = conversation.path_to(branch.head_id)[index * size:(index + 1) * size]
+            if len(chunk) < size:
+                return summary
+            digest = _chunk_digest(chunk)
+            
+            text, usage = await ai_service.complete(_summary_prompt(chunk), task="summary")
+            conversation.record_usage(usage)
+            # Edited or taken off the branch while summarizing: leave it for the next summary step
+            if len(branch.summaries) != index or not _on_branch(conversation, branch, index * size, digest):
+                return summary
+            branch.summaries.append(text)
+            summary = text
     
     def should_generate_summary(self) -> bool:
         """Check if a summary should be generated"""
@@ -46,13 +80,268 @@ Write a concise summary (3-4 sentences)."""
         
         if not state.conversation:
             return False
+        if self.is_backfilling(state.conversation):
+            return False
+        if self.is_stale(state.conversation):
+            return True
         
         message_count = len(state.conversation.messages)
         
         if message_count < settings.max_messages_before_summary:
             return False
         
-        return message_count % settings.max_messages_before_summary == 0
+        # Scenes add several messages at once, so check what is unsummarized rather than exact multiples
+        summarized = len(state.conversation.summaries) * settings.max_messages_before_summary
+        return message_count - summarized >= settings.max_messages_before_summary
+    
+    def is_backfilling(self, conversation: Conversation) -> bool:
+        """Whether a backfill is running for the conversation's active branch"""
+        return f"{conversation.id}:{conversation.active_branch_id}" in self._backfilling
+    
+    def is_stale(self, conversation: Conversation) -> bool:
+        """Whether the active branch has summaries or an overview to redo"""
+        branch = conversation.active_branch
+        return bool(branch.stale_summaries or branch.overview_stale)
+    
+    def missing_summaries(self, conversation: Conversation) -> int:
+        """Complete chunks of the active branch that have no summary yet"""
+        chunks = len(conversation.messages) // settings.max_messages_before_summary
+        return max(chunks - len(conversation.summaries), 0)
+    
+    async def backfill(self, conversation: Conversation) -> dict:
+        """Summarize every unsummarized chunk of the active branch, then rebuild its overview.
+        
+        Map: chunks are summarized concurrently, `summary_backfill_concurrency`
+        at a time. Summaries are appended in order as soon as all chunks
+        before them are done, so a backfill that is interrupted keeps its
+        contiguous progress (and, in this process, the out-of-order chunks
+        too) and the next one resumes from there. A chunk edited while the
+        backfill ran is left for the next run.
+        Reduce: the summaries are folded into the overview `summary_reduce_fanin`
+        at a time, level by level, the groups of a level concurrently.
+        Progress is reported to the job the backfill runs in.
+        """
+        branch = conversation.active_branch
+        key = f"{conversation.id}:{branch.id}"
+        if key in self._backfilling:
+            raise ValueError("A summary backfill is already running for this branch")
+        self._backfilling.add(key)
+        try:
+            async with conversation_lock(conversation.id, "summary"):
+                redone = await self._refresh(conversation, branch)
+                added = await self._map(conversation, branch)
+                if len(branch.summaries) > branch.overview_covers:
+                    await self._reduce(conversation, branch, len(branch.summaries))
+        finally:
+            self._backfilling.discard(key)
+        return {
+            "summaries_added": added,
+            "summaries_redone": redone,
+            "summaries": len(branch.summaries),
+            "missing": self.missing_summaries(conversation) if conversation.active_branch is branch else None,
+            "overview": branch.overview,
+        }
+    
+    async def _map(self, conversation: Conversation, branch: Branch) -> int:
+        """Summarize the branch's missing chunks; returns how many summaries were added"""
+        size = settings.max_messages_before_summary
+        messages = conversation.path_to(branch.head_id)
+        first = len(branch.summaries)
+        chunks = [messages[i * size:(i + 1) * size] for i in range(first, len(messages) // size)]
+        if not chunks:
+            return 0
+        digests = [_chunk_digest(chunk) for chunk in chunks]
+        done = sum(1 for digest in digests if digest in self._chunk_results)
+        job_queue.report_progress(stage="map", done=done, total=len(chunks))
+        semaphore = asyncio.Semaphore(settings.summary_backfill_concurrency)
+        added = 0
+        
+        async def summarize(index: int):
+            nonlocal done
+            chunk, digest = chunks[index], digests[index]
+            # Cached chunks may have been committed already by the chunk before them
+            committed = len(branch.summaries) - first > index
+            if not committed and digest not in self._chunk_results:
+                async with semaphore:
+                    summary, usage = await ai_service.complete(_summary_prompt(chunk), task="summary")
+                conversation.record_usage(usage)
+                self._chunk_results[digest] = summary
+                done += 1
+                job_queue.report_progress(stage="map", done=done, total=len(chunks))
+            await commit()
+        
+        async def commit():
+            """Append finished summaries that are next in line and still match the story"""
+            nonlocal added
+            async with conversation_lock(conversation.id):
+                while True:
+                    index = len(branch.summaries) - first
+                    # Summaries dropped meanwhile (a message before the chunks was replaced)
+                    if index < 0 or index >= len(chunks) or digests[index] not in self._chunk_results:
+                        return
+                    if not _on_branch(conversation, branch, (first + index) * size, digests[index]):
+                        # Edited or taken off the branch since it was summarized; the next backfill redoes it
+                        self._chunk_results.pop(digests[index])
+                        return
+                    branch.summaries.append(self._chunk_results.pop(digests[index]))
+                    added += 1
+        
+        await _gather(summarize(index) for index in range(len(chunks)))
+        return added
+    
+    async def _refresh(self, conversation: Conversation, branch: Branch) -> int:
+        """Redo the branch's stale summaries, then its overview if it is stale; returns how many were redone"""
+        size = settings.max_messages_before_summary
+        async with conversation_lock(conversation.id):
+            messages = conversation.path_to(branch.head_id)
+            # Deletions can leave the last summaries without a full chunk of messages
+            branch.keep_summaries(min(len(branch.summaries), len(messages) // size))
+            stale = dict(branch.stale_summaries)
+            chunks = {i: messages[i * size:(i + 1) * size] for i in stale}
+        if not stale and not branch.overview_stale:
+            return 0
+        semaphore = asyncio.Semaphore(settings.summary_backfill_concurrency)
+        redone = 0
+        
+        async def redo(index: int):
+            nonlocal redone
+            try:
+                async with semaphore:
+                    summary, usage = await ai_service.complete(_summary_prompt(chunks[index]), task="summary")
+            except ModelUnavailable:
+                # Stays stale; redone at a later step
+                return
+            conversation.record_usage(usage)
+            async with conversation_lock(conversation.id):
+                # Changed again while this ran: the newer change needs its own redo
+                if branch.stale_summaries.get(index) == stale[index]:
+                    branch.summaries[index] = summary
+                    del branch.stale_summaries[index]
+                    redone += 1
+        
+        await asyncio.gather(*(redo(index) for index in stale))
+        if branch.overview_stale and branch.overview_covers:
+            await self._reduce(conversation, branch, branch.overview_covers)
+        return redone
+    
+    async def _reduce(self, conversation: Conversation, branch: Branch, covers: int):
+        """Rebuild the branch overview from its first `covers` summaries"""
+        if any(i < covers for i in branch.stale_summaries):
+            return
+        fanin = max(settings.summary_reduce_fanin, 2)
+        version = branch.overview_stale
+        level = branch.summaries[:covers]
+        total = 0
+        count = covers
+        while count > 1:
+            count = -(-count // fanin)
+            total += count
+        done = 0
+        job_queue.report_progress(stage="reduce", done=done, total=total)
+        semaphore = asyncio.Semaphore(settings.summary_backfill_concurrency)
+        
+        async def combine(group: List[str]) -> str:
+            nonlocal done
+            async with semaphore:
+                text = await self._combine(conversation, group)
+            done += 1
+            job_queue.report_progress(stage="reduce", done=done, total=total)
+            return text
+        
+        while len(level) > 1:
+            groups = [level[i:i + fanin] for i in range(0, len(level), fanin)]
+            level = await _gather(combine(group) for group in groups)
+        # Summaries it was made from may have been changed or dropped meanwhile
+        if len(branch.summaries) >= covers and not any(i < covers for i in branch.stale_summaries):
+            branch.overview = level[0]
+            branch.overview_covers = covers
+            if branch.overview_stale == version:
+                branch.overview_stale = 0
+    
+    async def _extend_overview(self, conversation: Conversation, branch: Branch):
+        """Fold summaries made since the overview into it once there are enough of them"""
+        pending = branch.summaries[branch.overview_covers:]
+        if len(pending) < settings.summary_reduce_fanin or branch.stale_summaries or branch.overview_stale:
+            return
+        covers = len(branch.summaries)
+        group = ([branch.overview] if branch.overview else []) + pending
+        overview = await self._combine(conversation, group)
+        if len(branch.summaries) >= covers and not branch.stale_summaries and not branch.overview_stale:
+            branch.overview = overview
+            branch.overview_covers = covers
+    
+    async def _combine(self, conversation: Conversation, summaries: List[str]) -> str:
+        """Reduce consecutive summaries to one"""
+        parts = "\n\n".join(f"Part {i + 1}: {text}" for i, text in enumerate(summaries))
+        prompt = f"""These are summaries of consecutive parts of a story, in order:
+
+{parts}
+
+Combine them into one summary of the whole, keeping the main events, how the characters and their relationships changed, and where the story stands now.
+
+Write a concise summary (4-6 sentences)."""
+        text, usage = await ai_service.complete(prompt, task="summary")
+        conversation.record_usage(usage)
+        return text
+
+
+def story_so_far(conversation: Conversation) -> str:
+    """The active branch's overview and the summaries made after it.
+    
+    Stale summaries are left out until redone; a stale overview is kept, as
+    one edit rarely changes the gist of a long story.
+    """
+    branch = conversation.active_branch
+    parts = [branch.overview] if branch.overview else []
+    parts += [summary for i, summary in enumerate(branch.summaries[branch.overview_covers:], branch.overview_covers)
+              if i not in branch.stale_summaries]
+    return " ".join(parts)
+
+
+async def _gather(coros) -> list:
+    """Run coroutines concurrently; if one fails, cancel the rest before raising"""
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def _summary_prompt(messages: List[MessageRecord]) -> str:
+    context = "\n".join([
+        f"{m.character_name}: {m.content}"
+        for m in messages
+    ])
+    
+    return f"""Summarize this section of the story, preserving:
+1. Key events and developments
+2. Character emotions and relationships
+3. Important dialogue and decisions
+4. Current scenario state
+
+Conversation:
+{context}
+
+Write a concise summary (3-4 sentences)."""
+
+
+def _on_branch(conversation: Conversation, branch: Branch, start: int, digest: str) -> bool:
+    """Whether the chunk of the branch starting at `start` is still the one with `digest`"""
+    chunk = conversation.path_to(branch.head_id)[start:start + settings.max_messages_before_summary]
+    return _chunk_digest(chunk) == digest
+
+
+def _chunk_digest(chunk: List[Optional[MessageRecord]]) -> str:
+    """Identifies a chunk of messages and their text"""
+    h = hashlib.blake2b(digest_size=12)
+    for message in chunk:
+        if message is None:
+            return ""
+        h.update(f"{message.id}\x00{message.character_name}\x00{message.content}\x01".encode("utf-8"))
+    return h.hexdigest()
 
 
 # Singleton instance
@@ -0,0 +1,244 @@
+"""Next-speaker scheduling for large casts"""
+
+import re
+from collections import Counter, OrderedDict, deque
+from typing import Deque, Dict, FrozenSet, List, Optional, Tuple
+from app.core.config import settings
+from app.models import Character, Conversation, MessageRecord
+from app.services.circuit_breaker import ModelUnavailable
+
+_WORD = re.compile(r"[\w']+")
+
+
+class SpeakerTracker:
+    """Incrementally maintained speaker state for one conversation.
+
+    - `order` keeps non-narrator characters from least to most recently
+      spoken; a new turn is an O(1) move_to_end.
+    - `names` maps lowercase names (full name and first name) to ids.
+    - `recent` holds the mentions of the last `scheduler_mention_window`
+      messages, with running counts in `mention_counts`.
+
+    Each new message is applied once; the tracker rebuilds itself only when
+    history was rewritten (edits, regenerates, loads).
+    """
+
+    def __init__(self, conversation: Conversation):
+        self.conversation_id = conversation.id
+        self.order: "OrderedDict[str, None]" = OrderedDict()
+        self.names: Dict[str, str] = {}
+        self.recent: Deque[Tuple[str, FrozenSet[str]]] = deque()
+        self.mention_counts: Counter = Counter()
+        self.character_count = 0
+        self.synced_count = 0
+        self.synced_version = -1
+        self.last_message_id: Optional[str] = None
+        self.rebuild(conversation)
+
+    def rebuild(self, conversation: Conversation):
+        """Recompute everything from the conversation"""
+        self.order.clear()
+        self.names.clear()
+        self.recent.clear()
+        self.mention_counts.clear()
+        self.character_count = 0
+        self._add_characters(conversation.characters)
+
+        # Replay speakers from the most recent backwards until everyone is placed
+        messages = conversation.messages
+        seen = []
+        for message in reversed(messages):
+            if message.character_id in self.order and message.character_id not in seen:
+                seen.append(message.character_id)
+                if len(seen) == len(self.order):
+                    break
+        for character_id in reversed(seen):
+            self.order.move_to_end(character_id)
+
+        window = settings.scheduler_mention_window
+        for message in messages[-window:] if window else []:
+            self._push_mentions(message)
+        self._mark_synced(conversation)
+
+    def sync(self, conversation: Conversation):
+        """Apply messages and characters added since the last sync"""
+        if len(conversation.characters) != self.character_count:
+            self._add_characters(conversation.characters[self.character_count:], front=True)
+
+        messages = conversation.messages
+        in_sync = (
+            self.synced_count <= len(messages)
+            and (self.synced_count == 0 or messages[self.synced_count - 1].id == self.last_message_id)
+        )
+        if not in_sync or (conversation.version != self.synced_version and self._rewritten(conversation)):
+            self.rebuild(conversation)
+            return
+        for message in messages[self.synced_count:]:
+            if message.character_id in self.order:
+                self.order.move_to_end(message.character_id)
+            self._push_mentions(message)
+        self._mark_synced(conversation)
+
+    def mentions_in(self, text: str) -> FrozenSet[str]:
+        """Ids of characters named in a piece of text"""
+        words = [w.lower() for w in _WORD.findall(text)]
+        found = set()
+        for i, word in enumerate(words):
+            character_id = self.names.get(word)
+            if character_id is None and i + 1 < len(words):
+                character_id = self.names.get(f"{word} {words[i + 1]}")
+            if character_id is not None:
+                found.add(character_id)
+        return frozenset(found)
+
+    def least_recent(self, count: int, exclude: str) -> List[str]:
+        """The `count` characters who spoke least recently"""
+        result = []
+        for character_id in self.order:
+            if character_id != exclude:
+                result.append(character_id)
+                if len(result) == count:
+                    break
+        return result
+
+    def _rewritten(self, conversation: Conversation) -> bool:
+        """Whether a version bump came from an in-place change rather than an append"""
+        return len(conversation.messages) == self.synced_count
+
+    def _add_characters(self, characters: List[Character], front: bool = False):
+        """Register characters in cast order, optionally ahead of everyone who has spoken"""
+        for character in reversed(characters) if front else characters:
+            self.character_count += 1
+            if character.is_narrator:
+                continue
+            self.order[character.id] = None
+            if front:
+                self.order.move_to_end(character.id, last=False)
+            name = character.name.lower().strip()
+            if name:
+                self.names[name] = character.id
+                self.names.setdefault(name.split()[0], character.id)
+
+    def _push_mentions(self, message: MessageRecord):
+        """Add a message's mentions to the sliding window"""
+        mentions = self.mentions_in(message.content) - {message.character_id}
+        self.recent.append((message.character_id, mentions))
+        self.mention_counts.update(mentions)
+        window = settings.scheduler_mention_window
+        while len(self.recent) > window:
+            _, dropped = self.recent.popleft()
+            for character_id in dropped:
+                self.mention_counts[character_id] -= 1
+                if self.mention_counts[character_id] <= 0:
+                    del self.mention_counts[character_id]
+
+    def _mark_synced(self, conversation: Conversation):
+        messages = conversation.messages
+        self.synced_count = len(messages)
+        self.synced_version = conversation.version
+        self.last_message_id = messages[-1].id if messages else None
+
+
+class TurnScheduler:
+    """Picks who speaks next.
+
+    Candidates are the characters mentioned in recent messages plus the few
+    who spoke least recently, so the work per turn does not grow with the
+    size of the cast. Each candidate is scored as:
+
+        weight_direct * (named in the last message)
+        + weight_mention * (mentions in the recent window)
+        + weight_idle * (how long ago they last spoke, among the candidates)
+
+    When the top two scores are within `scheduler_tie_margin`, the model can
+    optionally break the tie.
+    """
+
+    def __init__(self):
+        self._trackers: Dict[str, SpeakerTracker] = {}
+
+    def tracker_for(self, conversation: Conversation) -> SpeakerTracker:
+        """Get the synced tracker for a conversation"""
+        tracker = self._trackers.get(conversation.id)
+        if tracker is None:
+            # Only the active conversation is tracked
+            self._trackers = {conversation.id: SpeakerTracker(conversation)}
+            return self._trackers[conversation.id]
+        tracker.sync(conversation)
+        return tracker
+
+    def rank(self, conversation: Conversation) -> List[Tuple[str, float]]:
+        """Score candidate speakers, best first"""
+        tracker = self.tracker_for(conversation)
+        messages = conversation.messages
+        last = messages[-1] if messages else None
+        last_speaker = last.character_id if last else None
+
+        idle = tracker.least_recent(settings.scheduler_idle_candidates, exclude=last_speaker)
+        candidates = dict.fromkeys(idle)
+        for character_id in tracker.mention_counts:
+            if character_id != last_speaker:
+                candidates[character_id] = None
+        direct = tracker.recent[-1][1] if tracker.recent else frozenset()
+
+        scores = []
+        for character_id in candidates:
+            score = settings.scheduler_weight_mention * tracker.mention_counts.get(character_id, 0)
+            if character_id in direct:
+                score += settings.scheduler_weight_direct
+            if character_id in idle:
+                # 1.0 for whoever waited longest, falling towards 0
+                score += settings.scheduler_weight_idle * (1 - idle.index(character_id) / len(idle))
+            scores.append((character_id, score))
+        scores.sort(key=lambda item: item[1], reverse=True)
+        return scores
+
+    async def next_speaker(self, conversation: Conversation) -> str:
+        """Choose the id of the character who should speak next"""
+        messages = conversation.messages
+        if not messages:
+            # First message - narrator starts
+            return "narrator"
+
+        ranked = self.rank(conversation)
+        if not ranked:
+            # Only one character exists, use narrator
+            return "narrator"
+
+        best = ranked[0][0]
+        if (
+            settings.scheduler_llm_tiebreak
+            and len(ranked) > 1
+            and ranked[0][1] - ranked[1][1] <= settings.scheduler_tie_margin
+        ):
+            tied = [cid for cid, score in ranked if ranked[0][1] - score <= settings.scheduler_tie_margin]
+            best = await self._break_tie(conversation, tied) or best
+        return best
+
+    async def _break_tie(self, conversation: Conversation, tied: List[str]) -> Optional[str]:
+        """Ask the model which of the tied characters should speak"""
+        from app.services.ai_service import ai_service
+
+        names = ", ".join(conversation.get_character(cid).name for cid in tied)
+        recent = "\n".join(f"{m.character_name}: {m.content}" for m in conversation.messages[-4:])
+        prompt = f"""Recent conversation:
+{recent}
+
+Who should speak next? Choose one of: {names}
+Answer with the name only.
+
+Next speaker:"""
+        try:
+            answer, usage = await ai_service.complete(prompt, task="next_speaker")
+        except ModelUnavailable:
+            return None
+        conversation.record_usage(usage)
+        answer = answer.strip().lower()
+        for cid in tied:
+            if conversation.get_character(cid).name.lower() in answer:
+                return cid
+        return None
+
+
+# Singleton instance
+turn_scheduler = TurnScheduler()
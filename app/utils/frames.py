@@ -0,0 +1,115 @@
+"""Length-prefixed, optionally compressed frames for save files"""
+
+import gzip
+import os
+import struct
+from typing import BinaryIO, Callable, Iterator, Tuple
+from pydantic import BaseModel
+
+# File header: magic, frame format version, codec id
+MAGIC = b"RPGF"
+FRAME_VERSION = 1
+_HEADER = struct.Struct("<4sBB")
+# Frame header: compressed length
+_FRAME = struct.Struct("<I")
+
+
+class Codec(BaseModel):
+    """A compression method for frame payloads"""
+    id: int
+    name: str
+    compress: Callable[[bytes], bytes]
+    decompress: Callable[[bytes], bytes]
+
+
+def _zstd_codec() -> Codec:
+    """zstd through the optional `zstandard` package"""
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("SAVE_COMPRESSION=zstd needs the zstandard package (pip install zstandard)")
+    return Codec(
+        id=2,
+        name="zstd",
+        compress=zstandard.ZstdCompressor(level=6).compress,
+        decompress=lambda data: zstandard.ZstdDecompressor().decompress(data),
+    )
+
+
+_CODECS = {
+    "none": lambda: Codec(id=0, name="none", compress=bytes, decompress=bytes),
+    "gzip": lambda: Codec(
+        id=1,
+        name="gzip",
+        compress=lambda data: gzip.compress(data, compresslevel=6, mtime=0),
+        decompress=gzip.decompress,
+    ),
+    "zstd": _zstd_codec,
+}
+_CODEC_NAMES = {0: "none", 1: "gzip", 2: "zstd"}
+
+
+def get_codec(name: str) -> Codec:
+    """Look up a codec by name"""
+    factory = _CODECS.get(name.lower())
+    if factory is None:
+        raise ValueError(f"Unknown save compression: {name}")
+    return factory()
+
+
+def write_header(f: BinaryIO, codec: Codec):
+    """Start a framed file"""
+    f.write(_HEADER.pack(MAGIC, FRAME_VERSION, codec.id))
+
+
+def read_header(f: BinaryIO) -> Codec:
+    """Check a framed file's header and return its codec"""
+    magic, version, codec_id = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != MAGIC or version != FRAME_VERSION or codec_id not in _CODEC_NAMES:
+        raise ValueError("Not a supported save file")
+    return get_codec(_CODEC_NAMES[codec_id])
+
+
+def write_frame(f: BinaryIO, codec: Codec, data: bytes) -> int:
+    """Append one frame and return its offset"""
+    offset = f.tell()
+    payload = codec.compress(data)
+    f.write(_FRAME.pack(len(payload)))
+    f.write(payload)
+    return offset
+
+
+def read_frame(f: BinaryIO, codec: Codec, offset: int) -> bytes:
+    """Read and decompress the frame at an offset"""
+    f.seek(offset)
+    (length,) = _FRAME.unpack(f.read(_FRAME.size))
+    return codec.decompress(f.read(length))
+
+
+def iter_frames(f: BinaryIO, codec: Codec) -> Iterator[Tuple[int, bytes]]:
+    """Yield (offset, data) for each frame after the header, one at a time"""
+    f.seek(_HEADER.size)
+    while True:
+        offset = f.tell()
+        head = f.read(_FRAME.size)
+        if len(head) < _FRAME.size:
+            return
+        (length,) = _FRAME.unpack(head)
+        payload = f.read(length)
+        if len(payload) < length:
+            # A save interrupted mid-frame; everything before it is intact
+            return
+        yield offset, codec.decompress(payload)
+
+
+def frames_end(f: BinaryIO) -> int:
+    """Offset just past the last complete frame, reading only frame headers"""
+    size = f.seek(0, os.SEEK_END)
+    end = _HEADER.size
+    while end + _FRAME.size <= size:
+        f.seek(end)
+        (length,) = _FRAME.unpack(f.read(_FRAME.size))
+        if end + _FRAME.size + length > size:
+            break
+        end += _FRAME.size + length
+    return end
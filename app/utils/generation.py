@@ -0,0 +1,77 @@
+"""Generation profiles and Ollama option building"""
+
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+from app.core.config import settings
+
+
+class GenerationProfile(BaseModel):
+    """Sampling and length limits for one kind of generation task"""
+    num_predict: int
+    temperature: float = 0.7
+    top_p: float = 0.9
+    stop: List[str] = []
+    # Longest a call may take, retries included, before it fails (seconds)
+    deadline: float = 90.0
+
+
+# Per-task profiles. Dialogue stops at the end of the `[reaction] "dialogue"`
+# line; everything else stops at the first blank line.
+GENERATION_PROFILES: Dict[str, GenerationProfile] = {
+    "dialogue": GenerationProfile(num_predict=120, stop=['"\n', "\n\n", "\n["]),
+    "narration": GenerationProfile(num_predict=160, stop=["\n\n"]),
+    "summary": GenerationProfile(num_predict=256, temperature=0.5, deadline=180.0),
+    "description": GenerationProfile(num_predict=120, stop=["\n\n"]),
+    "scenario": GenerationProfile(num_predict=120, stop=["\n\n"]),
+    # Only breaks ties; the scheduler has a fallback
+    "next_speaker": GenerationProfile(num_predict=8, temperature=0.2, stop=["\n"], deadline=20.0),
+    # Several labeled turns in one call (scene mode); the parser stops after the last one
+    "scene": GenerationProfile(num_predict=480, deadline=180.0),
+    "persona": GenerationProfile(num_predict=160, temperature=0.3, stop=["\n\n"]),
+}
+
+DEFAULT_TASK = "dialogue"
+
+# Rough characters-per-token ratio for llama-style tokenizers, kept on the
+# low side so context estimates err towards being too large
+CHARS_PER_TOKEN = 3.5
+
+
+def get_profile(task: str) -> GenerationProfile:
+    """Get the generation profile for a task"""
+    return GENERATION_PROFILES.get(task, GENERATION_PROFILES[DEFAULT_TASK])
+
+
+def task_deadline(task: str) -> float:
+    """Seconds a task's model call may take, retries included"""
+    return settings.task_deadlines.get(task, get_profile(task).deadline)
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of a piece of text"""
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def size_num_ctx(prompt: str, num_predict: int) -> int:
+    """Pick a context window that fits the prompt plus the generation budget.
+    
+    Sizes are rounded up to a power of two so the server only ever sees a
+    handful of distinct values and does not reload the model on every call.
+    """
+    needed = estimate_tokens(prompt) + num_predict
+    num_ctx = settings.min_num_ctx
+    while num_ctx < needed and num_ctx < settings.max_num_ctx:
+        num_ctx *= 2
+    return min(num_ctx, settings.max_num_ctx)
+
+
+def build_options(task: str, prompt: str, extra_stop: Optional[List[str]] = None) -> dict:
+    """Build request options (Ollama option names) for a task and prompt"""
+    profile = get_profile(task)
+    return {
+        "temperature": profile.temperature,
+        "top_p": profile.top_p,
+        "num_predict": profile.num_predict,
+        "num_ctx": size_num_ctx(prompt, profile.num_predict),
+        "stop": profile.stop + (extra_stop or []),
+    }
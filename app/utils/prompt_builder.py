@@ -1,22 +1,88 @@
 """Prompt building utilities for AI interactions"""
 
-from app.models import Character
+from typing import List, Optional, Tuple
+from app.models import Character, MessageRecord
 from app.core.state import get_state
 
+# Number of most recent messages included verbatim in every prompt
+RECENT_MESSAGES = 10
+
 
 class PromptBuilder:
     """Builder for AI prompts"""
     
-    def build_character_prompt(self, character: Character) -> str:
-        """Build a prompt for generating character response"""
+    def build_character_prompt(self, character: Character, messages: Optional[List[MessageRecord]] = None,
+                               memories: Optional[List[MessageRecord]] = None) -> str:
+        """Build a prompt for generating character response.
+        
+        `messages` is the history to respond to; defaults to the whole conversation.
+        `memories` are earlier messages recalled as relevant to the current turn.
+        """
+        state = get_state()
+        
+        if not state.conversation:
+            return ""
+        
+        if messages is None:
+            messages = state.conversation.messages
+        
+        recent_messages, context = self._context(messages, memories)
+        
+        if character.is_narrator:
+            return self._build_narrator_prompt(context, recent_messages)
+        else:
+            return self._build_character_prompt(character, context, recent_messages)
+    
+    def build_scene_prompt(self, turns: int, messages: Optional[List[MessageRecord]] = None,
+                           memories: Optional[List[MessageRecord]] = None) -> str:
+        """Build a prompt asking for the next `turns` turns of the scene, each labeled with its speaker"""
+        from app.services.persona_service import persona_service
         state = get_state()
         
         if not state.conversation:
             return ""
         
+        conversation = state.conversation
+        if messages is None:
+            messages = conversation.messages
+        
+        _, context = self._context(messages, memories)
+        cast = "\n".join(
+            f"- {c.name}: the narrator; describes the scene, never speaks for characters" if c.is_narrator
+            else f"- {c.name}: {persona_service.digest(c, conversation)}"
+            for c in conversation.characters
+        )
+        narrator = next((c.name for c in conversation.characters if c.is_narrator), "Narrator")
+        speaker = next((c.name for c in conversation.characters if not c.is_narrator), "Name")
+        
+        prompt = f"""Continue this story as a scene.
+
+Setting: {conversation.scenario.description}
+
+Cast:
+{cast}
+
+Conversation:
+{context if context else '(Just starting)'}
+
+Write the next {turns} turns, one per line. Start each line with the speaker's name and a colon.
+Characters write: Name: [physical action or emotion] "what they say"
+{narrator} writes: {narrator}: 1-2 sentences of narration without dialogue
+
+Example:
+{speaker}: [smiles warmly] "That's exactly what I was thinking!"
+
+Next {turns} turns:
+"""
+        
+        return prompt
+    
+    def _context(self, messages: List[MessageRecord],
+                 memories: Optional[List[MessageRecord]]) -> Tuple[List[MessageRecord], str]:
+        """The recent messages and the conversation context built from them and any memories"""
         # Get more context - last 10 messages or all if fewer
-        message_count = min(10, len(state.conversation.messages))
-        recent_messages = state.conversation.messages[-message_count:] if message_count > 0 else []
+        message_count = min(RECENT_MESSAGES, len(messages))
+        recent_messages = messages[-message_count:] if message_count > 0 else []
         
         # Build context with clear speaker labels
         context = "\n".join([
@@ -24,10 +90,24 @@ class PromptBuilder:
             for m in recent_messages
         ])
         
-        if character.is_narrator:
-            return self._build_narrator_prompt(context, recent_messages)
-        else:
-            return self._build_character_prompt(character, context, recent_messages)
+        if memories:
+            recalled = "\n".join(f"{m.character_name}: {m.content}" for m in memories)
+            context = f"(Earlier in the story)\n{recalled}\n(Recently)\n{context}"
+        
+        # Summaries stand in for everything before the recent messages
+        story = self._story_so_far(len(messages) - len(recent_messages))
+        if story:
+            context = f"(Story so far) {story}\n{context}"
+        return recent_messages, context
+    
+    def _story_so_far(self, earlier: int) -> str:
+        """The active branch's overview and later summaries, if there are messages before the recent ones"""
+        from app.services.summary_service import story_so_far
+        state = get_state()
+        
+        if earlier <= 0 or not state.conversation:
+            return ""
+        return story_so_far(state.conversation)
     
     def _build_narrator_prompt(self, context: str, recent_messages: list) -> str:
         """Build prompt for narrator"""
@@ -49,6 +129,7 @@ Your narration:"""
     
     def _build_character_prompt(self, character: Character, context: str, recent_messages: list) -> str:
         """Build prompt for regular character"""
+        from app.services.persona_service import persona_service
         state = get_state()
         scenario = state.conversation.scenario
         
@@ -57,9 +138,10 @@ Your narration:"""
         last_speaker = last_msg.character_name if last_msg else "unknown"
         last_content = last_msg.content if last_msg else "nothing yet"
         
+        persona = persona_service.digest(character, state.conversation)
         prompt = f"""You are {character.name}.
 
-Character: {character.description}
+Character: {persona}
 Setting: {scenario.description}
 
 Conversation:
@@ -0,0 +1,213 @@
+"""Incremental parser for streamed model output"""
+
+import re
+from typing import List, Optional, Tuple
+from pydantic import BaseModel
+
+
+class ParseEvent(BaseModel):
+    """A field completed by the parser, or a request to stop generating"""
+    kind: str  # "reaction", "dialogue", "narration" or "stop"
+    text: str = ""
+
+
+# Parser states for the `[reaction] "dialogue"` format
+START = "start"
+REACTION = "reaction"
+AFTER_REACTION = "after_reaction"
+DIALOGUE = "dialogue"
+DONE = "done"
+
+# Repetition detection: a block of MIN..MAX words repeated back to back
+MIN_REPEAT_WORDS = 2
+MAX_REPEAT_WORDS = 12
+REPEAT_COUNT = 3
+# Single words (or a single character with no spaces) looping this many times
+SINGLE_REPEAT_COUNT = 6
+MAX_CHAR_RUN = 24
+
+
+class ResponseParser:
+    """State machine that consumes streamed tokens and emits completed fields.
+
+    For characters it follows the `[reaction] "dialogue"` format and signals
+    that generation can stop as soon as the closing quote arrives. For the
+    narrator and free-form tasks it passes text through and stops at a blank
+    line. In both modes it stops when the output degenerates into a loop.
+    """
+
+    def __init__(self, is_narrator: bool = False, stop_at_blank_line: bool = True):
+        self.is_narrator = is_narrator
+        self.stop_at_blank_line = stop_at_blank_line
+        self.state = START
+        self.text = ""
+        self.reaction: Optional[str] = None
+        self.dialogue: Optional[str] = None
+        self.stop_reason: Optional[str] = None
+        self._reaction_buf: List[str] = []
+        self._dialogue_buf: List[str] = []
+        self._words: List[str] = []
+        self._partial_word = ""
+        self._char_run = 0
+        self._last_char = ""
+
+    @property
+    def should_stop(self) -> bool:
+        """Whether the caller can stop generating"""
+        return self.stop_reason is not None
+
+    def feed(self, chunk: str) -> List[ParseEvent]:
+        """Consume a chunk of streamed output and return any new events"""
+        events: List[ParseEvent] = []
+        for ch in chunk:
+            if self.should_stop:
+                break
+            self.text += ch
+            if self.is_narrator:
+                self._step_narration(events)
+            else:
+                self._step_dialogue(ch, events)
+            if not self.should_stop and self._track_repetition(ch):
+                self.stop_reason = "repetition"
+                events.append(ParseEvent(kind="stop", text="repetition"))
+        return events
+
+    def result(self) -> Tuple[Optional[str], str]:
+        """Return the (reaction, dialogue) pair parsed so far"""
+        if self.is_narrator:
+            return None, self._narration().strip()
+        if self.dialogue is not None:
+            return self.reaction, self.dialogue
+        if self.state == DIALOGUE:
+            # Stream ended (or was cut by a stop sequence) before the closing quote
+            return self.reaction, "".join(self._dialogue_buf).strip()
+        # Fallback: treat entire response as dialogue
+        return None, self.text.strip()
+
+    def _narration(self) -> str:
+        """Narration text without a trailing blank line"""
+        if self.stop_reason == "complete":
+            return self.text.rstrip("\n")
+        return self.text
+
+    def _step_narration(self, events: List[ParseEvent]):
+        """Advance the narrator state by one character"""
+        if self.stop_at_blank_line and self.text.endswith("\n\n") and self.text.strip():
+            self._complete(events, ParseEvent(kind="narration", text=self.text.strip()))
+
+    def _step_dialogue(self, ch: str, events: List[ParseEvent]):
+        """Advance the reaction/dialogue state machine by one character"""
+        if self.state == START:
+            if ch == "[":
+                self.state = REACTION
+            elif ch == '"':
+                self.state = DIALOGUE
+        elif self.state == REACTION:
+            if ch == "]":
+                self.reaction = "".join(self._reaction_buf).strip()
+                self.state = AFTER_REACTION
+                events.append(ParseEvent(kind="reaction", text=self.reaction))
+            else:
+                self._reaction_buf.append(ch)
+        elif self.state == AFTER_REACTION:
+            if ch == '"':
+                self.state = DIALOGUE
+        elif self.state == DIALOGUE:
+            if ch == '"':
+                self.dialogue = "".join(self._dialogue_buf).strip()
+                self._complete(events, ParseEvent(kind="dialogue", text=self.dialogue))
+            else:
+                self._dialogue_buf.append(ch)
+
+    def _complete(self, events: List[ParseEvent], event: ParseEvent):
+        """Emit the final field and signal that the format is complete"""
+        self.state = DONE
+        self.stop_reason = "complete"
+        events.append(event)
+        events.append(ParseEvent(kind="stop", text="complete"))
+
+    def _track_repetition(self, ch: str) -> bool:
+        """Update the word window and report whether the output is looping"""
+        if ch == self._last_char and not ch.isspace():
+            self._char_run += 1
+        else:
+            self._char_run = 1
+        self._last_char = ch
+        if self._char_run >= MAX_CHAR_RUN:
+            return True
+
+        if not ch.isspace():
+            self._partial_word += ch
+            return False
+        if not self._partial_word:
+            return False
+        self._words.append(self._partial_word.lower())
+        self._partial_word = ""
+        # Only the tail matters for detection
+        window = MAX_REPEAT_WORDS * REPEAT_COUNT
+        if len(self._words) > window * 2:
+            del self._words[:-window]
+        return self._is_looping()
+
+    def _is_looping(self) -> bool:
+        """Check whether the last words repeat a block back to back"""
+        words = self._words
+        if len(words) >= SINGLE_REPEAT_COUNT and len(set(words[-SINGLE_REPEAT_COUNT:])) == 1:
+            return True
+        for size in range(MIN_REPEAT_WORDS, MAX_REPEAT_WORDS + 1):
+            span = size * REPEAT_COUNT
+            if len(words) < span:
+                break
+            block = words[-size:]
+            if all(words[-span + i * size:-span + (i + 1) * size or None] == block
+                   for i in range(REPEAT_COUNT - 1)):
+                return True
+        return False
+
+
+# A scene line: "Speaker: text"
+_SCENE_LINE = re.compile(r"^\s*\**([^:\[\]\"*]{1,40}?)\**\s*:\s*(.*)$")
+
+
+class SceneParser(ResponseParser):
+    """Parser for several speaker-labeled turns generated in one go.
+
+    Text passes through as in narrator mode; generation stops once `turns`
+    lines have been completed, or when the output loops. `turns()` splits
+    the text into (speaker, text) pairs; lines without a label continue the
+    previous turn.
+    """
+
+    def __init__(self, turns: int):
+        super().__init__(is_narrator=True, stop_at_blank_line=False)
+        self.max_turns = turns
+        self._completed = 0
+
+    def feed(self, chunk: str) -> List[ParseEvent]:
+        events: List[ParseEvent] = []
+        for ch in chunk:
+            if self.should_stop:
+                break
+            events.extend(super().feed(ch))
+            if ch != "\n" or not self.text.endswith("\n"):
+                continue
+            # Only the line this newline ends; blank lines between turns are not turns
+            line = self.text[:-1].rsplit("\n", 1)[-1]
+            if line.strip() and _SCENE_LINE.match(line):
+                self._completed += 1
+                if self._completed >= self.max_turns:
+                    self._complete(events, ParseEvent(kind="narration", text=self.text.strip()))
+        return events
+
+    def turns(self) -> List[Tuple[str, str]]:
+        """The (speaker, text) pairs generated so far"""
+        turns: List[Tuple[str, str]] = []
+        for line in self.text.splitlines():
+            if not line.strip():
+                continue
+            match = _SCENE_LINE.match(line)
+            if match:
+                turns.append((match.group(1).strip(), match.group(2).strip()))
+            elif turns:
+                turns[-1] = (turns[-1][0], f"{turns[-1][1]} {line.strip()}")
+        return turns[:self.max_turns]
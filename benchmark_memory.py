@@ -0,0 +1,77 @@
+"""
+Message Memory Benchmark
+Compares the memory used by a long conversation held as pydantic Message
+objects with the compact MessageRecord store used by Conversation.
+
+Usage: python benchmark_memory.py [message_count]
+"""
+
+import gc
+import json
+import sys
+import tracemalloc
+
+from app.models import Character, Conversation, Message, MessageRecord, Scenario
+
+
+def sample_messages(count: int) -> str:
+    """JSON for `count` messages shaped like a saved conversation"""
+    speakers = [("narrator", "Narrator"), ("char1", "Ann"), ("char2", "Bob")]
+    messages = []
+    for i in range(count):
+        character_id, name = speakers[i % len(speakers)]
+        messages.append({
+            "id": f"msg_{i:012x}",
+            "character_id": character_id,
+            "character_name": name,
+            "content": f"Line {i}: " + "the story goes on " * (3 + i % 5),
+            "reaction": "smiles" if i % 2 else None,
+            "timestamp": f"2025-01-01T12:{i // 60 % 60:02d}:{i % 60:02d}.{i % 1000000:06d}",
+        })
+    return json.dumps(messages)
+
+
+def measure(build) -> int:
+    """Bytes still allocated after `build()` returns, while its result is alive"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    raw = sample_messages(count)
+
+    def as_models():
+        return [Message(**m) for m in json.loads(raw)]
+
+    def as_records():
+        return [MessageRecord.from_dict(m) for m in json.loads(raw)]
+
+    def as_conversation():
+        return Conversation(
+            id="bench",
+            name="Benchmark",
+            scenario=Scenario(description=""),
+            characters=[Character(id="char1", name="Ann", description="")],
+            messages=json.loads(raw),
+        )
+
+    models = measure(as_models)
+    records = measure(as_records)
+    conversation = measure(as_conversation)
+    content = sum(len(m["content"]) for m in json.loads(raw))
+
+    print(f"{count} messages, {content / count:.0f} characters of content each on average")
+    print(f"  pydantic Message list:   {models / count:8.0f} bytes/message")
+    print(f"  MessageRecord list:      {records / count:8.0f} bytes/message ({records / models:.0%})")
+    print(f"  Conversation (indexed):  {conversation / count:8.0f} bytes/message ({conversation / models:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Save Conversion Script
+Rewrites every conversation in the save directory in the current compressed
+save format. Old single-file .json saves and uncompressed node logs are
+converted; saves already in the current format are left alone unless
+--force is given (e.g. to switch SAVE_COMPRESSION).
+
+Usage: python convert_saves.py [--force]
+"""
+
+import os
+import sys
+
+from app.core.config import settings
+from app.services.storage_service import (
+    FORMAT_VERSION, conversation_store, index_path, legacy_log_path, log_path,
+)
+
+
+def save_size(conversation_id: str, filename: str) -> int:
+    """Bytes on disk used by a save's files"""
+    paths = [os.path.join(settings.save_dir, filename), log_path(conversation_id),
+             legacy_log_path(conversation_id), index_path(conversation_id)]
+    return sum(os.path.getsize(p) for p in set(paths) if os.path.exists(p))
+
+
+def main():
+    force = "--force" in sys.argv[1:]
+    if not os.path.isdir(settings.save_dir):
+        print(f"[FAIL] Save directory not found: {settings.save_dir}")
+        return 1
+
+    converted = skipped = failed = 0
+    before_total = after_total = 0
+    for filename in sorted(os.listdir(settings.save_dir)):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            data = conversation_store.read_meta(filename)
+            conversation_id = data["id"]
+            if data.get("format") == FORMAT_VERSION and not force:
+                skipped += 1
+                continue
+            before = save_size(conversation_id, filename)
+            path = conversation_store.convert(filename)
+            after = save_size(conversation_id, os.path.basename(path))
+        except Exception as e:
+            print(f"[FAIL] {filename}: {e}")
+            failed += 1
+            continue
+        converted += 1
+        before_total += before
+        after_total += after
+        print(f"[OK] {filename}: {before / 1024:.1f} KB -> {after / 1024:.1f} KB")
+
+    print(f"\nConverted {converted}, already current {skipped}, failed {failed}")
+    if converted:
+        print(f"Total: {before_total / 1024:.1f} KB -> {after_total / 1024:.1f} KB")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
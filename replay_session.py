@@ -0,0 +1,115 @@
+"""
+Session Replay Harness
+Replays a session recorded with LLM_RECORD_PATH against the current build.
+The recorded API requests are sent in order to an in-process app whose
+model calls are answered from the recording, with the original chunk
+timings scaled by --speed. The run is recorded to --out, and end-to-end
+latency, model calls and prompt sizes are compared per request.
+
+Requests that name message or branch ids from the original session, and
+image uploads, may not replay; they are reported with their status.
+
+Usage: python replay_session.py session.rec [--speed 1.0] [--out replay.rec]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from collections import defaultdict
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay a recorded session against this build")
+    parser.add_argument("recording", help="session log written with LLM_RECORD_PATH")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="latency scale: 1.0 as recorded, 2.0 twice as fast, 0 instant")
+    parser.add_argument("--out", default="replay.rec", help="where to record the replay")
+    return parser.parse_args()
+
+
+def summarize(records):
+    """Requests by index, and the model calls made for each"""
+    requests = {}
+    calls = defaultdict(list)
+    for record in records:
+        if record["type"] == "request":
+            requests[record["index"]] = record
+        elif record["request"] is not None:
+            calls[record["request"]].append(record)
+    return requests, calls
+
+
+def call_stats(calls):
+    prompt_chars = sum(c["prompt_chars"] for c in calls if c["kind"] != "embed")
+    prompt_tokens = sum(c.get("prompt_tokens") or 0 for c in calls)
+    return len(calls), prompt_chars, prompt_tokens
+
+
+def main():
+    args = parse_args()
+    if not os.path.exists(args.recording):
+        print(f"[FAIL] Recording not found: {args.recording}")
+        return 1
+    if os.path.exists(args.out):
+        os.remove(args.out)
+
+    # Configure the app before it is imported; saves go to a scratch directory
+    os.environ["LLM_REPLAY_PATH"] = args.recording
+    os.environ["LLM_REPLAY_SPEED"] = str(args.speed)
+    os.environ["LLM_RECORD_PATH"] = args.out
+    os.environ["SAVE_DIR"] = tempfile.mkdtemp(prefix="replay_saves_")
+    # Requests are sent back to back, faster than any user; don't rate limit them
+    os.environ["CLIENT_RATE_PER_MINUTE"] = "0"
+    os.environ["CONVERSATION_RATE_PER_MINUTE"] = "0"
+
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.services.ai_service import ai_service
+    from app.services.backends import read_session
+
+    original, original_calls = summarize(read_session(args.recording))
+    print(f"Replaying {len(original)} requests from {args.recording} at speed {args.speed}\n")
+
+    with TestClient(app) as client:
+        for index in sorted(original):
+            request = original[index]
+            url = request["path"] + (f"?{request['query']}" if request["query"] else "")
+            headers = {"content-type": request["content_type"]} if request["content_type"] else {}
+            response = client.request(request["method"], url, content=request["body"].encode("utf-8"),
+                                      headers=headers)
+            if response.status_code == 202 and "job" in response.json():
+                # Wait for background work so its model calls are part of the comparison
+                job_id = response.json()["job"]["id"]
+                while client.get(f"/api/jobs/{job_id}?wait=30").json()["job"]["status"] in ("queued", "running"):
+                    pass
+            if response.status_code != request["status"]:
+                print(f"[WARN] #{index} {request['method']} {request['path']}: "
+                      f"status {request['status']} -> {response.status_code}")
+
+    replayed, replayed_calls = summarize(read_session(args.out))
+    print(f"{'request':<40} {'latency ms':>21} {'calls':>9} {'prompt chars':>17}")
+    totals = [0.0, 0.0, 0, 0, 0, 0]
+    for index in sorted(original):
+        before, after = original[index], replayed.get(index)
+        if after is None:
+            continue
+        calls_before, chars_before, _ = call_stats(original_calls[index])
+        calls_after, chars_after, _ = call_stats(replayed_calls[index])
+        name = f"#{index} {before['method']} {before['path']}"[:40]
+        print(f"{name:<40} {before['duration_ms']:>10.0f}{after['duration_ms']:>11.0f} "
+              f"{calls_before:>4}{calls_after:>5} {chars_before:>8}{chars_after:>9}")
+        for i, value in enumerate((before["duration_ms"], after["duration_ms"], calls_before,
+                                   calls_after, chars_before, chars_after)):
+            totals[i] += value
+
+    print(f"{'total':<40} {totals[0]:>10.0f}{totals[1]:>11.0f} "
+          f"{totals[2]:>4}{totals[3]:>5} {totals[4]:>8}{totals[5]:>9}")
+    backend = ai_service.backend.inner
+    print(f"\nModel calls matched by prompt: {backend.hits}, served in order after a prompt change: {backend.misses}")
+    print(f"Replay recorded to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -73,6 +73,35 @@ async function apiCall(endpoint, method = 'GET', data = null) {
     }
 }
 
+// Submit a form as a background job and wait for its result
+async function runJob(endpoint, formData) {
+    formData.append('background', 'true');
+    const response = await fetch(endpoint, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/x-www-form-urlencoded' },
+        body: formData
+    });
+    let body = await response.json();
+    if (!response.ok) {
+        throw new Error(body.detail || 'API Error');
+    }
+
+    // Long-poll until the job finishes
+    let job = body.job;
+    while (job.status === 'queued' || job.status === 'running') {
+        const poll = await fetch(`/api/jobs/${job.id}?wait=20`);
+        body = await poll.json();
+        if (!poll.ok) {
+            throw new Error(body.detail || 'API Error');
+        }
+        job = body.job;
+    }
+    if (job.status !== 'succeeded') {
+        throw new Error(job.error || `Job ${job.status}`);
+    }
+    return job.result;
+}
+
 // Load current state
 async function loadState() {
     try {
@@ -146,11 +175,7 @@ async function createNewConversation() {
             character2_description: char2Desc || ''
         });
 
-        await fetch('/api/conversation/new', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/x-www-form-urlencoded' },
-            body: formData
-        });
+        await runJob('/api/conversation/new', formData);
 
         closeModal('newConversationModal');
         await loadState();
@@ -187,11 +212,7 @@ async function addCharacter() {
             description: description || '' 
         });
         
-        await fetch('/api/character/add', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/x-www-form-urlencoded' },
-            body: formData
-        });
+        await runJob('/api/character/add', formData);
 
         closeModal('addCharacterModal');
         await loadState();
@@ -241,7 +262,7 @@ async function generateAIResponse() {
         });
 
         if (!response.ok) {
-            throw new Error('Failed to generate message');
+            throw new Error(await generationError(response));
         }
 
         await loadState();
@@ -254,6 +275,17 @@ async function generateAIResponse() {
     }
 }
 
+// Error text for a failed generate request; rate-limited or unavailable ones say when to retry
+async function generationError(response) {
+    const errorData = await response.json().catch(() => ({}));
+    const message = errorData.detail || 'Failed to generate message';
+    const retryAfter = response.headers.get('Retry-After');
+    if ((response.status === 429 || response.status === 503) && retryAfter) {
+        return `${message}. Try again in ${retryAfter}s.`;
+    }
+    return message;
+}
+
 // Send manual message
 async function sendManualMessage() {
     const content = document.getElementById('messageInput').value.trim();
@@ -528,8 +560,7 @@ async function selectCharacter(characterId) {
         });
 
         if (!response.ok) {
-            const errorData = await response.json();
-            throw new Error(errorData.detail || 'Failed to generate message');
+            throw new Error(await generationError(response));
         }
 
         await loadState();
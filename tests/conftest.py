@@ -0,0 +1,53 @@
+"""Shared fixtures: the app runs on the fake backend with saves in a temp dir"""
+
+import os
+import tempfile
+
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("SAVE_DIR", tempfile.mkdtemp(prefix="rpg_saves_"))
+
+from collections import OrderedDict
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.core.state import get_state
+from app.models import Character, Conversation, Message, Scenario, new_message_id
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Test client with rate limits off and no results remembered from other tests"""
+    from app.main import app
+    from app.services.idempotency import idempotency_cache
+
+    monkeypatch.setattr(settings, "client_rate_per_minute", 0)
+    monkeypatch.setattr(settings, "conversation_rate_per_minute", 0)
+    monkeypatch.setattr(settings, "max_active_generations", 0)
+    monkeypatch.setattr(idempotency_cache, "_results", OrderedDict())
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def conversation(monkeypatch):
+    """Make an active conversation with a narrator and two characters; `count` numbered messages"""
+    state = get_state()
+
+    def make(count: int) -> Conversation:
+        characters = [
+            Character(id="narrator", name="Narrator", description="Tells the story", is_narrator=True),
+            Character(id="char1", name="Ann", description="A sailor"),
+            Character(id="char2", name="Bob", description="A baker"),
+        ]
+        conversation = Conversation(id="test", name="Test", scenario=Scenario(description="A harbour town"),
+                                    characters=characters, messages=[])
+        for i in range(count):
+            character = characters[i % len(characters)]
+            conversation.add_message(Message(id=new_message_id(), character_id=character.id,
+                                             character_name=character.name, content=f"line {i}"))
+        monkeypatch.setattr(state, "conversation", conversation)
+        return conversation
+
+    return make
@@ -0,0 +1,70 @@
+"""Branches and their summaries"""
+
+from app.core.config import settings
+
+CHUNK = 4
+
+
+def test_branch_from_inactive_message_forks_summaries_of_branch_holding_it(conversation, monkeypatch):
+    monkeypatch.setattr(settings, "max_messages_before_summary", CHUNK)
+    conv = conversation(2 * CHUNK + 2)
+    conv.summaries.extend(["first", "second"])
+    main = list(conv.messages)
+    side = conv.create_branch("side", main[1].id)
+    conv.switch_branch(side.id)
+
+    branch = conv.create_branch("later", main[2 * CHUNK].id)
+
+    assert branch.summaries == ["first", "second"]
+    assert conv.create_branch("earlier", main[CHUNK + 1].id).summaries == ["first"]
+
+
+def test_regenerate_keeps_replaced_messages_as_alternatives(client, conversation):
+    conv = conversation(3)
+    original = conv.messages[-1]
+
+    for _ in range(3):
+        assert client.post("/api/message/regenerate").status_code == 200
+
+    assert list(conv.branches) == ["main"]
+    alternatives = client.get(f"/api/message/{original.id}/alternatives").json()["alternatives"]
+    assert len(alternatives) == 4
+    assert [a["active"] for a in alternatives] == [False, False, False, True]
+
+    response = client.post(f"/api/message/{original.id}/choose")
+
+    assert response.status_code == 200
+    assert conv.messages[-1] is original
+    assert len(conv.messages) == 3
+
+
+def test_edit_marks_only_branches_through_message_stale(conversation, monkeypatch):
+    monkeypatch.setattr(settings, "max_messages_before_summary", CHUNK)
+    conv = conversation(2 * CHUNK)
+    conv.summaries.extend(["first", "second"])
+    main = list(conv.messages)
+    through = conv.create_branch("through", main[-1].id)
+    before = conv.create_branch("before", main[CHUNK].id)
+
+    conv.update_message(main[CHUNK + 1].id, "changed")
+
+    assert conv.active_branch.stale_summaries.keys() == {1}
+    assert through.stale_summaries.keys() == {1}
+    assert not before.stale_summaries
+
+
+def test_alternatives_follow_deletes(conversation):
+    conv = conversation(3)
+    first, middle, last = conv.messages
+    other = conv.add_alternative(last.id, last.to_message().model_copy(update={"id": "other"}))
+    assert conv.alternatives(last.id) == [last, other]
+
+    conv.remove_message(middle.id)
+
+    assert conv.parent_of(last.id) == first.id
+    assert conv.alternatives(other.id) == [last, other]
+    assert conv.alternatives(first.id) == [first]
+    # A branch started from the beginning adds a second root
+    conv.switch_branch(conv.create_branch("fresh", None).id)
+    conv.add_message(first.to_message().model_copy(update={"id": "root2"}))
+    assert [m.id for m in conv.alternatives("root2")] == [first.id, "root2"]
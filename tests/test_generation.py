@@ -0,0 +1,46 @@
+"""Turn generation"""
+
+from app.core.locks import conversation_lock
+from app.core.state import get_state
+from app.models import GenerationUsage, Message, new_message_id
+from app.services.ai_service import ai_service
+
+
+def test_auto_speaker_is_picked_outside_lock_and_again_on_rebase(client, conversation, monkeypatch):
+    conv = conversation(5)
+    monkeypatch.setattr(get_state(), "auto_response_enabled", True)
+    picks = []
+
+    async def decide_next_character():
+        assert not conversation_lock(conv.id).locked()
+        picks.append(len(conv.messages))
+        return "char1"
+
+    async def respond(character, prompt=None):
+        if len(picks) == 1:
+            # Someone else adds a turn meanwhile, so this generation is stale
+            conv.add_message(Message(id=new_message_id(), character_id="char2",
+                                     character_name="Bob", content="an interruption"))
+            conv.touch()
+        return None, "a new line", GenerationUsage(task="dialogue")
+
+    monkeypatch.setattr(ai_service, "decide_next_character", decide_next_character)
+    monkeypatch.setattr(ai_service, "generate_character_response", respond)
+
+    response = client.post("/api/message/generate")
+
+    assert response.status_code == 200
+    assert picks == [5, 6]
+    assert [m.content for m in conv.messages[-2:]] == ["an interruption", "a new line"]
+
+
+def test_same_version_after_reload_is_not_replayed(client, conversation):
+    conversation(3)
+    first = client.post("/api/message/generate", data={"character_id": "char1"}).json()["message"]
+    # A save of the story from before that turn, loaded again: same id and version
+    reloaded = conversation(3)
+
+    second = client.post("/api/message/generate", data={"character_id": "char1"}).json()["message"]
+
+    assert second["id"] != first["id"]
+    assert reloaded.messages[-1].id == second["id"]
@@ -0,0 +1,103 @@
+"""Background job queue"""
+
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException, Response
+
+from app.api.routes import jobs as jobs_routes
+from app.services.job_service import CANCELLED, QUEUED, RUNNING, SUCCEEDED, JobQueue
+
+
+async def _sleep_then(value, seconds=0.01):
+    await asyncio.sleep(seconds)
+    return value
+
+
+def test_max_pending_answers_503(monkeypatch):
+    queue = JobQueue(workers=1, max_pending=2)
+    monkeypatch.setattr(jobs_routes, "job_queue", queue)
+
+    async def run():
+        for _ in range(2):
+            jobs_routes.start_job(Response(), "slow", lambda: _sleep_then(1, 10))
+        with pytest.raises(HTTPException) as refused:
+            jobs_routes.start_job(Response(), "slow", lambda: _sleep_then(1, 10))
+        await queue.shutdown()
+        return refused.value
+
+    refused = asyncio.run(run())
+    assert refused.status_code == 503
+    assert refused.headers["Retry-After"]
+
+
+def test_finished_jobs_expire_after_ttl():
+    queue = JobQueue(ttl_seconds=0)
+
+    async def run():
+        job = queue.submit("quick", lambda: _sleep_then("done"))
+        assert queue.get(job.id) is job
+        await queue.wait(job.id, 5)
+        return job
+
+    job = asyncio.run(run())
+    assert job.status == SUCCEEDED and job.result == "done"
+    assert queue.get(job.id) is None
+
+
+def test_wait_returns_when_job_finishes_or_timeout_runs_out():
+    queue = JobQueue(workers=1)
+
+    async def run():
+        slow = queue.submit("slow", lambda: _sleep_then("slow", 10))
+        quick = queue.submit("quick", lambda: _sleep_then("quick"))
+        # The only worker is busy with the slow job
+        waited = await queue.wait(quick.id, 0.05)
+        assert waited.status == QUEUED
+        queue.cancel(slow.id)
+        waited = await queue.wait(quick.id, 5)
+        return slow, waited
+
+    slow, quick = asyncio.run(run())
+    assert slow.status == CANCELLED
+    assert quick.status == SUCCEEDED and quick.result == "quick"
+
+
+def test_cancel_through_route(monkeypatch):
+    queue = JobQueue()
+    monkeypatch.setattr(jobs_routes, "job_queue", queue)
+    from app.main import app
+
+    async def run():
+        job = queue.submit("slow", lambda: _sleep_then(1, 10))
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            polled = (await client.get(f"/api/jobs/{job.id}", params={"wait": 0.05})).json()["job"]
+            cancelled = (await client.delete(f"/api/jobs/{job.id}")).json()
+            finished = (await client.get(f"/api/jobs/{job.id}", params={"wait": 5})).json()["job"]
+            again = (await client.delete(f"/api/jobs/{job.id}")).json()
+            missing = await client.delete("/api/jobs/job_missing")
+        return polled, cancelled, finished, again, missing
+
+    polled, cancelled, finished, again, missing = asyncio.run(run())
+    assert polled["status"] == RUNNING
+    assert cancelled["cancelled"] is True
+    assert finished["status"] == CANCELLED
+    assert again["cancelled"] is False
+    assert missing.status_code == 404
+
+
+def test_shutdown_cancels_queued_and_running_jobs():
+    queue = JobQueue(workers=1)
+
+    async def run():
+        running = queue.submit("slow", lambda: _sleep_then(1, 10))
+        queued = queue.submit("slow", lambda: _sleep_then(1, 10))
+        await asyncio.sleep(0)
+        await queue.shutdown()
+        return running, queued
+
+    running, queued = asyncio.run(run())
+    assert running.status == CANCELLED and queued.status == CANCELLED
+    assert running.finished_at and queued.finished_at
@@ -0,0 +1,41 @@
+"""Long-term memory recall"""
+
+import numpy as np
+
+from app.core.config import settings
+from app.models import GenerationUsage
+from app.services.ai_service import ai_service
+from app.services.memory_service import memory_service
+from app.utils.prompt_builder import RECENT_MESSAGES
+
+
+def test_regenerate_does_not_recall_replaced_message(client, conversation, monkeypatch):
+    monkeypatch.setattr(settings, "memory_enabled", True)
+    monkeypatch.setattr(memory_service, "indexes", {})
+    conv = conversation(RECENT_MESSAGES + 2)
+    first, query, replaced = conv.messages[0], conv.messages[-2], conv.messages[-1]
+    replaced.content = "the secret word is marmalade"
+
+    # The replaced message is the best match for the query; the first message
+    # is just as close and is old enough to be recalled
+    dim = len(conv.messages)
+    vectors = np.eye(dim, dtype=np.float32)
+    for message in (first, replaced):
+        vectors[conv.message_position(message.id)] = vectors[conv.message_position(query.id)]
+    index = memory_service.index_for(conv.id)
+    index.add([m.id for m in conv.messages], vectors)
+
+    prompts = []
+
+    async def respond(character, prompt=None):
+        prompts.append(prompt)
+        return None, "a new line", GenerationUsage(task="dialogue")
+
+    monkeypatch.setattr(ai_service, "generate_character_response", respond)
+    monkeypatch.setattr(memory_service, "enqueue", lambda *args: None)
+
+    response = client.post("/api/message/regenerate")
+
+    assert response.status_code == 200
+    assert "line 0" in prompts[0]
+    assert "marmalade" not in prompts[0]
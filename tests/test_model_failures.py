@@ -0,0 +1,136 @@
+"""Retries, deadlines and the circuit breaker around model calls"""
+
+import asyncio
+
+import pytest
+
+from app.core.config import settings
+from app.services import ai_service as ai_module
+from app.services.ai_service import ai_service
+from app.services.backends.fake import FakeBackend
+from app.services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, ModelUnavailable
+
+
+class FlakyBackend(FakeBackend):
+    """Fake backend that fails its first `failures` calls, or drops or hangs its streams"""
+
+    def __init__(self, failures: int = 0, drop_after_output: bool = False, hang: bool = False):
+        super().__init__(responses=["one two three four five"])
+        self.failures = failures
+        self.drop_after_output = drop_after_output
+        self.hang = hang
+        self.attempts = 0
+
+    async def astream(self, model, prompt, options):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise ConnectionError("connection refused")
+        if self.hang:
+            await asyncio.sleep(60)
+        async for chunk in super().astream(model, prompt, options):
+            yield chunk
+            if self.drop_after_output:
+                raise ConnectionError("connection reset")
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    """Install a flaky backend and a fresh breaker; retries wait no time"""
+    monkeypatch.setattr(ai_service, "breaker", CircuitBreaker())
+    monkeypatch.setattr(ai_module, "retry_delay", lambda attempt: 0)
+    monkeypatch.setattr(settings, "llm_retries", 2)
+    monkeypatch.setattr(settings, "circuit_failure_threshold", 5)
+
+    def install(**kwargs) -> FlakyBackend:
+        flaky = FlakyBackend(**kwargs)
+        monkeypatch.setattr(ai_service, "backend", flaky)
+        return flaky
+
+    return install
+
+
+def _complete():
+    return asyncio.run(ai_service.complete("Say something", task="summary"))
+
+
+def test_failures_before_output_are_retried(backend):
+    flaky = backend(failures=2)
+
+    text, _ = _complete()
+
+    assert text == "one two three four five"
+    assert flaky.attempts == 3
+    assert ai_service.breaker.state == CLOSED
+
+
+def test_no_retry_once_output_has_streamed(backend):
+    flaky = backend(drop_after_output=True)
+
+    with pytest.raises(ModelUnavailable) as failed:
+        _complete()
+
+    assert failed.value.reason == "error"
+    assert flaky.attempts == 1
+
+
+def test_deadline_covers_the_whole_call(backend, monkeypatch):
+    monkeypatch.setattr(settings, "task_deadlines", {"summary": 0.1})
+    backend(hang=True)
+
+    with pytest.raises(ModelUnavailable) as failed:
+        _complete()
+
+    assert failed.value.reason == "timeout"
+
+
+def test_circuit_opens_after_threshold(backend, monkeypatch):
+    monkeypatch.setattr(settings, "llm_retries", 0)
+    monkeypatch.setattr(settings, "circuit_failure_threshold", 2)
+    flaky = backend(failures=100)
+
+    for _ in range(2):
+        with pytest.raises(ModelUnavailable, match="refused"):
+            _complete()
+    with pytest.raises(ModelUnavailable) as refused:
+        _complete()
+
+    assert refused.value.reason == "circuit_open"
+    assert refused.value.retry_after >= 1
+    assert flaky.attempts == 2
+
+
+def test_half_open_lets_one_probe_through(monkeypatch):
+    monkeypatch.setattr(settings, "circuit_failure_threshold", 1)
+    breaker = CircuitBreaker()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    breaker.opened_at -= settings.circuit_reset_seconds
+
+    breaker.check("summary")
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(ModelUnavailable):
+        breaker.check("summary")
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    breaker.opened_at -= settings.circuit_reset_seconds
+    breaker.check("summary")
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    breaker.check("summary")
+
+
+def test_route_answers_503_with_retry_after(client, conversation, backend, monkeypatch):
+    monkeypatch.setattr(settings, "llm_retries", 0)
+    monkeypatch.setattr(settings, "circuit_failure_threshold", 1)
+    backend(failures=100)
+    conv = conversation(2)
+
+    response = client.post("/api/message/generate", data={"character_id": "char1"})
+    assert response.status_code == 503
+    response = client.post("/api/message/generate", data={"character_id": "char1"})
+
+    assert response.status_code == 503
+    assert response.json()["error"]["reason"] == "circuit_open"
+    assert int(response.headers["Retry-After"]) >= 1
+    assert len(conv.messages) == 2
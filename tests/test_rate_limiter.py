@@ -0,0 +1,77 @@
+"""Rate limits and admission control"""
+
+import pytest
+
+from app.core.config import settings
+from app.services.rate_limiter import RateLimited, RequestLimiter, TokenBucket
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    """Set client and conversation limits (per minute, burst); no busy limit"""
+    def set_limits(client=(0, 1), conversation=(0, 1), max_active=0):
+        monkeypatch.setattr(settings, "client_rate_per_minute", client[0])
+        monkeypatch.setattr(settings, "client_burst", client[1])
+        monkeypatch.setattr(settings, "conversation_rate_per_minute", conversation[0])
+        monkeypatch.setattr(settings, "conversation_burst", conversation[1])
+        monkeypatch.setattr(settings, "max_active_generations", max_active)
+    return set_limits
+
+
+def _admit(limiter, client, conversation_id):
+    with limiter.admit(client, conversation_id):
+        pass
+
+
+def test_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=1.0, capacity=2, now=0.0)
+    for _ in range(2):
+        assert bucket.wait(0.0) == 0
+        bucket.take()
+
+    assert bucket.wait(0.0) == pytest.approx(1.0)
+    assert bucket.wait(0.5) == pytest.approx(0.5)
+    assert bucket.wait(1.0) == 0
+    assert bucket.wait(100.0) == 0 and bucket.tokens == 2
+
+
+def test_tokens_are_taken_from_all_buckets_or_none(limits):
+    limits(client=(1, 2), conversation=(1, 1))
+    limiter = RequestLimiter()
+    _admit(limiter, "me", "a")
+
+    with pytest.raises(RateLimited) as refused:
+        _admit(limiter, "me", "a")
+    assert "conversation" in str(refused.value) and refused.value.retry_after >= 1
+
+    # The refusal left the client's second token alone
+    _admit(limiter, "me", "b")
+    with pytest.raises(RateLimited, match="client"):
+        _admit(limiter, "me", "c")
+
+
+def test_busy_refusal_keeps_rate_budget(limits):
+    limits(client=(1, 2), max_active=1)
+    limiter = RequestLimiter()
+
+    with limiter.admit("me", None):
+        for _ in range(3):
+            with pytest.raises(RateLimited, match="busy") as refused:
+                _admit(limiter, "me", None)
+            assert refused.value.retry_after >= 1
+    assert limiter.active == 0
+
+    _admit(limiter, "me", None)
+    with pytest.raises(RateLimited, match="client"):
+        _admit(limiter, "me", None)
+
+
+def test_route_answers_429_with_retry_after(client, conversation, limits):
+    conversation(2)
+    limits(client=(1, 1))
+
+    assert client.post("/api/message/generate", data={"character_id": "char1"}).status_code == 200
+    response = client.post("/api/message/generate", data={"character_id": "char1"})
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
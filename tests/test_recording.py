@@ -0,0 +1,24 @@
+"""Request recording middleware"""
+
+import importlib
+
+import app.main
+from app.core.config import settings
+from app.services import backends
+
+
+def _middleware_names(module):
+    return [m.kwargs.get("dispatch").__name__ for m in module.app.user_middleware if "dispatch" in m.kwargs]
+
+
+def test_recording_middleware_only_when_enabled(tmp_path, monkeypatch):
+    assert "record_requests" not in _middleware_names(app.main)
+
+    monkeypatch.setattr(settings, "llm_record_path", str(tmp_path / "session.jsonl"))
+    monkeypatch.setattr(backends, "_session_log", None)
+    try:
+        assert "record_requests" in _middleware_names(importlib.reload(app.main))
+    finally:
+        backends.get_session_log().close()
+        monkeypatch.undo()
+        importlib.reload(app.main)
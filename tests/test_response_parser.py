@@ -0,0 +1,19 @@
+"""Streaming response parsers"""
+
+from app.utils.response_parser import SceneParser
+
+
+def test_scene_turns_separated_by_blank_lines():
+    parser = SceneParser(3)
+    parser.feed("Alice: hi there\n\nBob: yo\n\nNarrator: The door creaks.\nAlice: more")
+
+    assert parser.should_stop
+    assert parser.turns() == [("Alice", "hi there"), ("Bob", "yo"), ("Narrator", "The door creaks.")]
+
+
+def test_scene_stops_after_requested_turns():
+    parser = SceneParser(2)
+    parser.feed("Alice: one\nan unlabelled line\nBob: two\nNarrator: three\n")
+
+    assert parser.should_stop
+    assert parser.turns() == [("Alice", "one an unlabelled line"), ("Bob", "two")]
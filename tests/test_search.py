@@ -0,0 +1,22 @@
+"""Full-text search"""
+
+from app.core.config import settings
+from app.services.storage_service import conversation_store
+
+
+def test_reindex_reads_saves_without_touching_store(client, conversation, monkeypatch):
+    monkeypatch.setattr(settings, "search_enabled", True)
+    conv = conversation(3)
+    conv.update_message(conv.messages[1].id, "the lighthouse keeper waves")
+    conversation_store.save(conv)
+    conversation_store._log_records.pop(conv.id)
+    conversation_store._locations.pop(conv.id)
+
+    response = client.post("/api/search/reindex")
+
+    # The refresh started with the app may have indexed the save already
+    assert response.status_code == 200
+    assert conv.id not in conversation_store._log_records
+    assert conv.id not in conversation_store._locations
+    hits = client.get("/api/search", params={"q": "lighthou"}).json()["hits"]
+    assert [hit["message_id"] for hit in hits] == [conv.messages[1].id]
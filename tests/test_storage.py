@@ -0,0 +1,117 @@
+"""Save format: metadata file, framed node log and active-branch index"""
+
+import os
+
+import pytest
+
+from app.core.config import settings
+from app.models import Message, new_message_id
+from app.services import storage_service
+from app.services.storage_service import ConversationStore, index_path, log_path, meta_path
+
+
+@pytest.fixture(autouse=True)
+def save_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "save_dir", str(tmp_path))
+    return tmp_path
+
+
+def _add(conv, content):
+    message = Message(id=new_message_id(), character_id="char1", character_name="Ann", content=content)
+    conv.add_message(message)
+    return message
+
+
+def _tree(conv):
+    """Everything a load has to get back"""
+    return (
+        [(m.id, m.content, m.reaction) for m in conv.messages],
+        sorted((m.id, conv.parent_of(m.id), m.content) for m in conv.all_messages()),
+        {b.id: (b.head_id, list(b.summaries)) for b in conv.branches.values()},
+        conv.active_branch_id,
+    )
+
+
+@pytest.mark.parametrize("compression", ["gzip", "none"])
+def test_round_trip(conversation, monkeypatch, compression):
+    monkeypatch.setattr(settings, "save_compression", compression)
+    conv = conversation(5)
+    conv.summaries.append("the story so far")
+    conv.add_alternative(conv.messages[-1].id, Message(id=new_message_id(), character_id="char2",
+                                                        character_name="Bob", content="another take"))
+    side = conv.create_branch("side", conv.messages[2].id)
+    conv.switch_branch(side.id)
+    _add(conv, "on the side")
+
+    ConversationStore().save(conv)
+    loaded = ConversationStore().load(os.path.basename(meta_path(conv.id)))
+
+    assert _tree(loaded) == _tree(conv)
+    total, offset, page = ConversationStore().read_page(os.path.basename(meta_path(conv.id)), None, 2)
+    assert (total, offset) == (4, 2)
+    assert [m["content"] for m in page] == [m.content for m in conv.messages[2:]]
+
+
+def test_save_after_load_appends(conversation):
+    conv = conversation(4)
+    ConversationStore().save(conv)
+    filename = os.path.basename(meta_path(conv.id))
+    store = ConversationStore()
+    loaded = store.load(filename)
+    size = os.path.getsize(log_path(conv.id))
+
+    _add(loaded, "a new line")
+    loaded.update_message(loaded.messages[1].id, "an edited line")
+    loaded.remove_message(loaded.messages[2].id)
+    store.save(loaded)
+
+    assert os.path.getsize(log_path(conv.id)) > size
+    # Appended to, not rewritten: more records than nodes
+    assert store._log_records[conv.id] > len(loaded.all_messages())
+    assert _tree(ConversationStore().load(filename)) == _tree(loaded)
+
+
+def test_log_is_compacted(conversation, monkeypatch):
+    monkeypatch.setattr(storage_service, "COMPACT_SLACK", 2)
+    conv = conversation(3)
+    store = ConversationStore()
+    store.save(conv)
+    for i in range(10):
+        conv.update_message(conv.messages[0].id, f"edit {i}")
+        store.save(conv)
+
+    assert store._log_records[conv.id] <= 2 * len(conv.all_messages()) + 2
+    assert _tree(ConversationStore().load(os.path.basename(meta_path(conv.id)))) == _tree(conv)
+
+
+def test_partial_trailing_frame_is_ignored_and_repaired(conversation):
+    conv = conversation(3)
+    store = ConversationStore()
+    store.save(conv)
+    saved = _tree(conv)
+    before = {path: open(path, "rb").read() for path in (meta_path(conv.id), index_path(conv.id))}
+    _add(conv, "lost in a crash")
+    store.save(conv)
+    # A crash cut the last frame short, before the metadata and index were replaced
+    with open(log_path(conv.id), "rb+") as f:
+        f.truncate(os.path.getsize(log_path(conv.id)) - 5)
+    for path, data in before.items():
+        with open(path, "wb") as f:
+            f.write(data)
+    filename = os.path.basename(meta_path(conv.id))
+
+    store = ConversationStore()
+    loaded = store.load(filename)
+    assert [m.id for m in loaded.all_messages()] == [m[0] for m in saved[0]]
+
+    _add(loaded, "written after the crash")
+    store.save(loaded)
+    assert _tree(ConversationStore().load(filename)) == _tree(loaded)
+
+
+def test_index_is_written_for_active_branch(conversation):
+    conv = conversation(3)
+    ConversationStore().save(conv)
+
+    assert os.path.exists(index_path(conv.id))
+    assert not os.path.exists(log_path(conv.id) + ".tmp")
@@ -0,0 +1,131 @@
+"""Chunk summaries"""
+
+import asyncio
+
+import pytest
+
+from app.core.config import settings
+from app.models import GenerationUsage
+from app.services.ai_service import ai_service
+from app.services.summary_service import summary_service
+
+CHUNK = 4
+
+
+@pytest.fixture
+def summarized(monkeypatch):
+    """Chunks of CHUNK messages; returns the message lines of each chunk the model was asked to summarize"""
+    monkeypatch.setattr(settings, "max_messages_before_summary", CHUNK)
+    chunks = []
+
+    async def complete(prompt, task):
+        if prompt.startswith("Summarize this section"):
+            conversation = prompt.split("Conversation:\n", 1)[1].split("\n\n", 1)[0]
+            chunks.append(conversation.splitlines())
+            return f"summary of {chunks[-1][0]}", GenerationUsage(task=task)
+        return "overview", GenerationUsage(task=task)
+
+    monkeypatch.setattr(ai_service, "complete", complete)
+    return chunks
+
+
+def test_each_summary_covers_one_chunk(conversation, summarized):
+    conv = conversation(2 * CHUNK + 3)
+
+    asyncio.run(summary_service.generate_summary())
+
+    assert summarized == [[f"{m.character_name}: {m.content}" for m in conv.messages[i:i + CHUNK]]
+                          for i in (0, CHUNK)]
+    assert conv.summaries == ["summary of Narrator: line 0", "summary of Ann: line 4"]
+
+
+def test_edit_after_scene_redoes_only_its_chunk(client, conversation, summarized, monkeypatch):
+    conv = conversation(CHUNK + 1)
+    cast = [conv.get_character("char1"), conv.get_character("char2")]
+
+    async def generate_scene(turns, prompt):
+        return [(cast[i % 2], None, f"scene line {i}") for i in range(turns)], GenerationUsage(task="scene")
+
+    monkeypatch.setattr(ai_service, "generate_scene", generate_scene)
+    monkeypatch.setattr(settings, "max_scene_turns", CHUNK + 2)
+    assert client.post("/api/message/scene", data={"turns": CHUNK + 2}).status_code == 200
+    assert len(conv.messages) == 2 * CHUNK + 3
+    assert len(conv.summaries) == 2
+    first = conv.summaries[0]
+    summarized.clear()
+
+    edited = conv.messages[CHUNK + 1]
+    assert client.put(f"/api/message/{edited.id}", data={"content": "an edited line"}).status_code == 200
+    assert conv.active_branch.stale_summaries.keys() == {1}
+    asyncio.run(summary_service.generate_summary())
+
+    assert summarized == [[f"{m.character_name}: {m.content}" for m in conv.messages[CHUNK:2 * CHUNK]]]
+    assert f"{edited.character_name}: an edited line" in summarized[0]
+    assert conv.summaries[0] == first
+    assert len(conv.summaries) == 2
+    assert not conv.active_branch.stale_summaries
+
+
+def _backfill_with(conv, change, monkeypatch):
+    """Run a backfill, making `change` to the story while its first chunk is being summarized"""
+    started, resume = asyncio.Event(), asyncio.Event()
+
+    async def complete(prompt, task):
+        if not started.is_set():
+            started.set()
+            await resume.wait()
+        return f"summary {len(prompt)}", GenerationUsage(task=task)
+
+    monkeypatch.setattr(ai_service, "complete", complete)
+
+    async def run():
+        backfill = asyncio.create_task(summary_service.backfill(conv))
+        await started.wait()
+        change()
+        resume.set()
+        return await backfill
+
+    return asyncio.run(run())
+
+
+def test_backfill_skips_chunks_taken_off_the_branch(conversation, monkeypatch):
+    monkeypatch.setattr(settings, "max_messages_before_summary", CHUNK)
+    conv = conversation(2 * CHUNK)
+    replaced = conv.messages[-1]
+
+    def regenerate_last():
+        conv.replace_message(replaced.id, replaced.to_message().model_copy(update={"id": "new", "content": "other"}))
+
+    result = _backfill_with(conv, regenerate_last, monkeypatch)
+
+    assert result["summaries_added"] == 1
+    assert len(conv.summaries) == 1
+
+
+def test_backfill_commits_nothing_once_earlier_summaries_are_dropped(conversation, monkeypatch):
+    monkeypatch.setattr(settings, "max_messages_before_summary", CHUNK)
+    conv = conversation(3 * CHUNK)
+    conv.summaries.append("first")
+    main = conv.active_branch
+
+    def replace_early_message():
+        early = conv.messages[1]
+        conv.replace_message(early.id, early.to_message().model_copy(update={"id": "new", "content": "other"}))
+
+    result = _backfill_with(conv, replace_early_message, monkeypatch)
+
+    assert result["summaries_added"] == 0
+    assert main.summaries == []
+
+
+def test_backfill_of_switched_away_branch_uses_its_own_path(conversation, monkeypatch):
+    monkeypatch.setattr(settings, "max_messages_before_summary", CHUNK)
+    conv = conversation(2 * CHUNK)
+    main = conv.active_branch
+    side = conv.create_branch("side", conv.messages[CHUNK].id)
+
+    result = _backfill_with(conv, lambda: conv.switch_branch(side.id), monkeypatch)
+
+    assert result["summaries_added"] == 2
+    assert len(main.summaries) == 2
+    assert side.summaries == []